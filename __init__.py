@@ -1,24 +1,187 @@
-from flask import Flask
+from flask import Flask, current_app, has_app_context
 from flask_mongoengine import MongoEngine, Document
 from flask_login import LoginManager
+from pymongo import ReadPreference
+from models import metrics, profiler, querycapture
 
+import logging
+import os
+import tempfile
 import pymongo
 
-def create_app():
-    app = Flask(__name__)
-    app.config['MONGODB_SETTINGS'] = {
-        'db':'staycation',
-        'host':'localhost'
+# Extensions are created unbound and attached to each app in create_app(), so importing the
+# models (which subclass db.Document) neither builds an app nor opens a Mongo connection
+db = MongoEngine()
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login'
+# login_manager.login_message = "Please login or register first to get an account."
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}
+
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def _read_preference(name):
+    if name not in READ_PREFERENCES:
+        raise ValueError(f"unknown read preference {name!r}, expected one of {', '.join(READ_PREFERENCES)}")
+    return READ_PREFERENCES[name]
+
+
+def mongodb_settings():
+    """MONGODB_SETTINGS from the environment. Unset options keep the pymongo defaults.
+
+    - MONGODB_HOST (host or mongodb:// URI; a URI must name the database), MONGODB_DB
+    - MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS, MONGO_WAIT_QUEUE_TIMEOUT_MS
+    - MONGO_CONNECT_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS
+    - MONGO_READ_PREFERENCE: primary (default), primaryPreferred, secondary, secondaryPreferred, nearest
+    - MONGO_COMPRESSORS: e.g. "zstd,snappy,zlib" (zstd and snappy need their Python packages)
+    """
+    return {
+        'db': os.environ.get('MONGODB_DB', 'staycation'),
+        'host': os.environ.get('MONGODB_HOST', 'localhost'),
+        'maxPoolSize': _env_int('MONGO_MAX_POOL_SIZE'),
+        'minPoolSize': _env_int('MONGO_MIN_POOL_SIZE'),
+        'maxIdleTimeMS': _env_int('MONGO_MAX_IDLE_TIME_MS'),
+        'waitQueueTimeoutMS': _env_int('MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+        'connectTimeoutMS': _env_int('MONGO_CONNECT_TIMEOUT_MS'),
+        'socketTimeoutMS': _env_int('MONGO_SOCKET_TIMEOUT_MS'),
+        'serverSelectionTimeoutMS': _env_int('MONGO_SERVER_SELECTION_TIMEOUT_MS'),
+        'read_preference': _read_preference(os.environ.get('MONGO_READ_PREFERENCE', 'primary')),
+        'compressors': os.environ.get('MONGO_COMPRESSORS') or None,
+        # create the client without connecting; the pool and its monitor threads start on the
+        # first query, i.e. inside each worker of a pre-forking server
+        'connect': False,
     }
+
+
+def analytics_read_preference():
+    """Read preference for the dashboard aggregations (MONGO_ANALYTICS_READ_PREFERENCE).
+
+    Set it to secondaryPreferred to take the dashboard load off the primary on a replica set.
+    """
+    if has_app_context():
+        return current_app.config['MONGO_ANALYTICS_READ_PREFERENCE']
+    return ReadPreference.PRIMARY
+
+
+def create_app(config=None, blueprints=True):
+    """Build a configured app.
+
+    - config: settings applied over the defaults and the environment, e.g. MONGODB_SETTINGS
+    - blueprints: register the application's blueprints (app_noAJax.py registers its own)
+    """
+    app = Flask(__name__)
+    app.config['MONGODB_SETTINGS'] = mongodb_settings()
+    app.config['MONGO_ANALYTICS_READ_PREFERENCE'] = _read_preference(
+        os.environ.get('MONGO_ANALYTICS_READ_PREFERENCE', os.environ.get('MONGO_READ_PREFERENCE', 'primary')))
     app.static_folder = 'assets'
-    db = MongoEngine(app)
+    # LOG_LEVEL=DEBUG shows the per-request debug logging; slow Mongo commands are logged as warnings
+    app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    # request/Mongo metrics on /metrics; commands slower than SLOW_QUERY_MS are logged with their route
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') != '0'
+    app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+    # /metrics is served to the admin and to scrapers sending `Authorization: Bearer <METRICS_TOKEN>`
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    # admin-only capture of single requests flagged with `X-Profile: 1` or `?_profile=1`;
+    # with PROFILER_ENABLED unset no hook is installed at all
+    app.config['PROFILER_ENABLED'] = os.environ.get('PROFILER_ENABLED', '0') == '1'
+    app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'staycation-profiles'))
+    app.config['PROFILE_KEEP'] = 50
+    app.config['PROFILE_SAMPLE_INTERVAL'] = 0.001
 
     app.config['SECRET_KEY'] = '9OLWxND4o83j4K4iuopO'
-    login_manager = LoginManager()
+    # rows per insert_many batch for CSV uploads
+    app.config['IMPORT_BATCH_SIZE'] = 1000
+    # background uploads: spool directory and import threads per process
+    app.config['IMPORT_SPOOL_DIR'] = os.path.join(tempfile.gettempdir(), 'staycation-imports')
+    app.config['IMPORT_WORKERS'] = 2
+    # documents per cursor batch (and per output chunk) for /export
+    app.config['EXPORT_BATCH_SIZE'] = 2000
+    # per-process cache for the Flask-Login user loader (set USER_CACHE_ENABLED=0 to compare latency)
+    app.config['USER_CACHE_ENABLED'] = os.environ.get('USER_CACHE_ENABLED', '1') != '0'
+    app.config['USER_CACHE_TTL'] = 30
+    app.config['USER_CACHE_SIZE'] = 1024
+    # rows per page on the booking and bundle listings
+    app.config['PAGE_SIZE'] = 20
+    # seconds browsers may reuse a /packages/suggest typeahead answer
+    app.config['SUGGEST_CACHE_SECONDS'] = 60
+    # bundle discount tiers: (minimum number of packages, discount rate)
+    app.config['BUNDLE_DISCOUNT_TIERS'] = [(1, 0.0), (2, 0.10), (4, 0.20)]
+    # candidate bundles priced per /bundleQuote request
+    app.config['BUNDLE_QUOTE_LIMIT'] = 50
+    # seconds between sweeps flagging expired bundles in each process (0 disables; see `flask sweep-bundles`)
+    app.config['BUNDLE_SWEEP_INTERVAL'] = int(os.environ.get('BUNDLE_SWEEP_INTERVAL', 3600))
+    # seconds each process reuses the /kpis aggregations (0 recomputes on every request)
+    app.config['KPI_CACHE_TTL'] = int(os.environ.get('KPI_CACHE_TTL', 60))
+    # live dashboard: 'local' follows this process's writes, 'changestream' every process's (replica set only)
+    app.config['LIVE_FEED_SOURCE'] = os.environ.get('LIVE_FEED_SOURCE', 'local')
+    app.config['LIVE_FEED_INTERVAL'] = 1.0
+    app.config['LIVE_HEARTBEAT'] = 15
+    # trailing day and month buckets the live dashboard holds and streams
+    app.config['LIVE_WINDOW_DAYS'] = 90
+    app.config['LIVE_WINDOW_MONTHS'] = 24
+    # chart data from the rollups ('rollup') or the per-process columnar booking snapshot ('snapshot')
+    app.config['DASHBOARD_SOURCE'] = os.environ.get('DASHBOARD_SOURCE', 'rollup')
+    app.config['SNAPSHOT_REFRESH_INTERVAL'] = 5.0
+    app.config.update(config or {})
+
+    logging.basicConfig(level=app.config['LOG_LEVEL'], format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    # the command listeners have to be registered before MongoEngine creates the client
+    metrics.init_app(app)
+    querycapture.init_app(app)
+    profiler.init_app(app)
+    db.init_app(app)
     login_manager.init_app(app)
-    login_manager.login_view = 'auth.login'
-    # login_manager.login_message = "Please login or register first to get an account."
-    return app, db, login_manager
+    if blueprints:
+        register_blueprints(app)
+    return app
+
+
+def register_blueprints(app):
+    # Imported here rather than at module level: importing the package (as every model does)
+    # does not load the views, templates helpers and forms
+    from controllers.dashboard import dashboard
+    from controllers.auth import auth
+    from controllers.bookController import booking
+    from controllers.packageController import package
+    from controllers.profileController import profile
+    from controllers.exportController import export
+    from .app import main
+
+    app.register_blueprint(main)
+    app.register_blueprint(dashboard)
+    app.register_blueprint(auth)
+    app.register_blueprint(booking)
+    app.register_blueprint(package)
+    app.register_blueprint(export)
+    if app.config['PROFILER_ENABLED']:
+        app.register_blueprint(profile)
+
+
+def _forget_connections():
+    """Drop Mongo clients inherited from a parent process; each is recreated on first use.
+
+    Clients are not fork-safe. With connect=False nothing is opened before a pre-forking server
+    forks, but if the parent did query (e.g. a preloaded app warming a cache) the child must not
+    reuse its sockets, locks or monitor threads. The clients are discarded rather than closed,
+    since closing would act on sockets the parent still uses.
+    """
+    from mongoengine import connection
+    from mongoengine.base import _document_registry
+
+    connection._connections.clear()
+    connection._dbs.clear()
+    for document in _document_registry.values():
+        document._collection = None
 
-app, db, login_manager = create_app()
 
+os.register_at_fork(after_in_child=_forget_connections)
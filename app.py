@@ -1,38 +1,32 @@
 # https://medium.com/@dmitryrastorguev/basic-user-authentication-login-for-flask-using-mongoengine-and-wtforms-922e64ef87fe
 
 from flask_login import login_required, current_user
-from flask import Blueprint, render_template, request, jsonify, url_for, redirect
-from app import app, db #, login_manager
-
-from werkzeug.security import generate_password_hash
+from flask import Blueprint, render_template, request, jsonify, url_for, redirect, flash, current_app
 
 # Register Blueprint so we can factor routes
 # from bmi import bmi, get_dict_from_csv, insert_reading_data_into_database
 
-from controllers.dashboard import dashboard
-from controllers.auth import auth
-from controllers.bookController import booking
-from controllers.packageController import package
-
 from models.package import Package
 from models.book import Booking
 from models.users import User
+from models.rollup import BookingRollup
+from models.bundle import BundlePurchase
 from models.forms import BookForm
+from models import importer
+from models.importjob import ImportJob
 
-#for uploading file
-import csv
-import io
-import json
-import datetime as dt
+import click
+import logging
 import os
+import time
 
-# register blueprint from respective module
-app.register_blueprint(dashboard)
-app.register_blueprint(auth)
-app.register_blueprint(booking)
-app.register_blueprint(package)
+# Site-wide routes, template filters and CLI commands; create_app() registers this blueprint
+# along with the ones in controllers/. cli_group=None keeps the commands at the top level.
+main = Blueprint('main', __name__, cli_group=None)
 
-@app.template_filter('formatdate') # use this name
+log = logging.getLogger(__name__)
+
+@main.app_template_filter('formatdate') # use this name
 def format_date(value, format="%d/%m/%Y"):
     if value is None:
         return ""
@@ -47,18 +41,127 @@ def format_date(value, format="%d/%m/%Y"):
             # Final fallback that's fully portable
             return f"{value.day}/{value.month:02d}/{value.year}"
 
-@app.template_filter('formatmoney') # use this name
+@main.app_template_filter('formatmoney') # use this name
 def format_money(value, ndigits=2):
     """Format money with 2 decimal digits"""
     if value is None:
         return ""
     return f'{value:.{ndigits}f}'
 
-@app.route('/base')
+@main.cli.command('rebuild-rollups')
+def rebuild_rollups():
+    """Regenerate the dashboard booking rollups from the booking collection."""
+    written = BookingRollup.rebuild()
+    print(f"Rebuilt {written} booking rollup documents")
+
+@main.cli.command('backfill-checkout')
+def backfill_checkout():
+    """Store check_out_date on bookings created before it existed."""
+    updated = Booking.backfillCheckOutDates()
+    print(f"Set check_out_date on {updated} bookings")
+
+@main.cli.command('recompute-totals')
+@click.option('--hotel', 'hotel_names', multiple=True, help="Only bookings of this hotel (repeatable); default all.")
+def recompute_totals(hotel_names):
+    """Refresh total_cost of bookings after a package's unit_cost or duration changed."""
+    packages = list(Package.getPackages(hotel_names).values()) if hotel_names else None
+    modified = Booking.recomputeTotals(packages)
+    print(f"Recomputed total_cost on {modified} bookings")
+    if modified:
+        # revenue in the rollups was summed from the old totals
+        print(f"Rebuilt {BookingRollup.rebuild()} booking rollup documents")
+
+@main.cli.command('backfill-bundle-expiry')
+def backfill_bundle_expiry():
+    """Store expires_at on bundles bought before it existed, then flag the expired ones."""
+    print(f"Set expires_at on {BundlePurchase.backfillExpiry()} bundles")
+    print(f"Flagged {BundlePurchase.sweepExpired()} bundles as expired")
+
+@main.cli.command('sweep-bundles')
+def sweep_bundles():
+    """Flag bundles past their expiry date as expired (the app also does this every BUNDLE_SWEEP_INTERVAL)."""
+    print(f"Flagged {BundlePurchase.sweepExpired()} bundles as expired")
+
+@main.cli.command('backfill-package-search')
+def backfill_package_search():
+    """Store the lowercased search_name on packages created before package search existed."""
+    print(f"Set search_name on {Package.backfillSearchNames()} packages")
+
+@main.cli.command('check-package-names')
+@click.option('--merge', is_flag=True, help="Merge each duplicated hotel name into its oldest package.")
+def check_package_names(merge):
+    """List hotel names held by more than one package, which block the unique hotel_name index."""
+    duplicates = Package.findDuplicateNames()
+    for hotel_name, ids in duplicates.items():
+        print(f"{hotel_name}: {len(ids)} packages ({', '.join(str(i) for i in ids)})")
+    if not duplicates:
+        print("No duplicate hotel names")
+    elif merge:
+        removed = Package.mergeDuplicateNames()
+        print(f"Merged {sum(removed.values())} duplicate packages into {len(removed)}")
+    else:
+        raise click.ClickException(f"{len(duplicates)} hotel name(s) are duplicated; rerun with --merge to fix")
+
+@main.cli.command('snapshot-stats')
+def snapshot_stats():
+    """Load the columnar booking snapshot and report its size."""
+    from models.snapshot import booking_snapshot
+
+    started = time.perf_counter()
+    stats = booking_snapshot.refresh(force=True).stats()
+    print(f"Loaded {stats['rows']} bookings of {stats['hotels']} hotels in {time.perf_counter() - started:.2f}s: "
+          f"{stats['bytes'] / 1024:.1f} KB, {stats['bytes_per_row']:.0f} bytes per booking")
+
+@main.cli.command('audit-indexes')
+def audit_indexes():
+    """Explain the queries every model query helper sends; exit non-zero on an unexpected COLLSCAN."""
+    from models import indexaudit
+
+    failures = 0
+    for name, stages, collscan in indexaudit.audit():
+        print(f"{'FAIL' if collscan else 'ok  '} {name}: {' > '.join(stages)}")
+        failures += collscan
+    if failures:
+        raise SystemExit(f"{failures} query helper(s) scan a whole collection")
+
+@main.cli.command('generate-data')
+@click.option('--users', default=1000, show_default=True)
+@click.option('--packages', default=50, show_default=True)
+@click.option('--bookings', default=100000, show_default=True)
+@click.option('--booking-lists', default=0, show_default=True, help="ListOfBooking rows (CSV output only).")
+@click.option('--seed', default=0, show_default=True, help="Same seed, same dataset.")
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), default='2022-01-01', show_default=True, help="First check-in date.")
+@click.option('--days', default=730, show_default=True, help="Number of days check-ins are spread over.")
+@click.option('--skew', default=2.0, show_default=True, help="Hotel and customer popularity skew; 1 is uniform.")
+@click.option('--out', 'out_dir', type=click.Path(file_okay=False), help="Write the /upload CSVs to this directory.")
+@click.option('--load', is_flag=True, help="Bulk-insert users, packages and bookings into the database.")
+@click.option('--drop', is_flag=True, help="With --load, drop users, packages, bookings and rollups first.")
+@click.option('--batch-size', default=10000, show_default=True)
+@click.option('--check', is_flag=True, help="With --out, re-read the booking CSVs and fail if any stay would be skipped as overlapping.")
+def generate_data(users, packages, bookings, booking_lists, seed, start, days, skew, out_dir, load, drop, batch_size, check):
+    """Generate a seeded synthetic dataset as /upload CSVs and/or straight into Mongo."""
+    from models import datagen
+
+    if not out_dir and not load:
+        raise click.UsageError("pass --out DIR, --load, or both")
+    dates = {'start': start.date(), 'days': days, 'skew': skew}
+    if out_dir:
+        for path, count in datagen.write_csvs(out_dir, users, packages, bookings, booking_lists, seed, **dates).items():
+            print(f"Wrote {count} rows to {path}")
+        if check:
+            overlaps = datagen.count_overlaps(out_dir)
+            if overlaps:
+                raise click.ClickException(f"{overlaps} booking rows overlap an earlier stay of the same customer and package")
+            print("No overlapping stays")
+    if load:
+        datagen.load(users, packages, bookings, seed, batch_size, drop,
+                     progress=lambda datatype, count: print(f"Inserted {count} {datatype} documents"), **dates)
+
+@main.route('/base')
 def show_base():
     return render_template('base.html')
 
-@app.route("/upload", methods=['GET','POST'])
+@main.route("/upload", methods=['GET','POST'])
 @login_required
 def upload():
     if request.method == 'GET':
@@ -66,81 +169,51 @@ def upload():
     elif request.method == 'POST':
         type = request.form.get('type')
         if type == 'create':
-            print("No create Action yet")
+            log.info("upload: create action is not implemented")
         elif type == 'upload':
             file = request.files.get('file')
             datatype = request.form.get('datatype')
 
-            data = file.read().decode('utf-8')
-            dict_reader = csv.DictReader(io.StringIO(data), delimiter=',', quotechar='"')
-            file.close()
-
-            if datatype == "Users":
-                for item in list(dict_reader):
-                    pwd = generate_password_hash(item['password'], method='sha256')
-                    User.createUser(email=item['email'], password=pwd, name=item['name'])
-            elif datatype == "Package":
-                for item in list(dict_reader):
-                    Package.createPackage(hotel_name=item['hotel_name'], duration=int(item['duration']),
-                        unit_cost=float(item['unit_cost']), image_url=item['image_url'],
-                        description=item['description'])
-            elif datatype == "Booking":
-                for item in list(dict_reader):
-                    existing_user = User.getUser(email=item['customer'])
-                    existing_package = Package.getPackage(hotel_name=item['hotel_name'])
-                    try:
-                        check_in_date=dt.datetime.strptime(item['check_in_date'], "%Y-%m-%d")
-                    except Exception:
-                        # Skip bad date format rather than creating invalid record
-                        print(f"Skipping booking row with invalid date: {item['check_in_date']}")
-                        continue
-                    if not existing_user or not existing_package:
-                        print(f"Skipping booking row due to missing user/package: user={existing_user} package={existing_package}")
-                        continue
-                    aBooking = Booking.createBooking(check_in_date=check_in_date, customer=existing_user, package=existing_package)
-                    aBooking.calculate_total_cost()
-            elif datatype == "ListOfBooking":
-                # CSV columns: check_in_date, customer, hotel_names (JSON array string)
-                # For each row, create sequential bookings across the list of hotels starting at check_in_date
-                for item in list(dict_reader):
-                    raw_date = item.get('check_in_date', '').strip()
-                    # Try multiple date formats
-                    check_in_date = None
-                    for fmt in ("%d/%m/%Y", "%Y-%m-%d"):
-                        try:
-                            check_in_date = dt.datetime.strptime(raw_date, fmt)
-                            break
-                        except Exception:
-                            continue
-                    if not check_in_date:
-                        print(f"Invalid date format in row: {raw_date}")
-                        continue
-
-                    email = item.get('customer', '').strip()
-                    customer = User.getUser(email=email)
-                    if not customer:
-                        print(f"Unknown user, skipping row: {email}")
-                        continue
-
-                    hotels_raw = item.get('hotel_names', '').strip()
-                    try:
-                        hotels = json.loads(hotels_raw.replace("'", '"'))
-                    except Exception:
-                        hotels = [h.strip().strip('"').strip("'") for h in hotels_raw.split(',') if h.strip()]
-
-                    current_date = check_in_date
-                    for hotel in hotels:
-                        package = Package.getPackage(hotel_name=hotel)
-                        if not package:
-                            print(f"Package not found, skipping hotel: {hotel}")
-                            continue
-                        Booking.createBooking(check_in_date=current_date, customer=customer, package=package)
-                        # advance by duration nights
-                        current_date = current_date + dt.timedelta(days=package.duration)
-                    
+            if request.form.get('background'):
+                # Spool to disk and import on a worker thread; the page polls /upload/jobs/<job_id>
+                try:
+                    job = ImportJob.submit(file, datatype, current_app.config['IMPORT_SPOOL_DIR'],
+                                           batch_size=current_app.config['IMPORT_BATCH_SIZE'],
+                                           max_workers=current_app.config['IMPORT_WORKERS'])
+                except ValueError as e:
+                    flash(f"Upload failed: {e}")
+                    return render_template("upload.html", panel="Upload")
+                return render_template("upload.html", panel="Upload", job=job)
+
+            # Rows are streamed off the upload and written in batches (see models/importer.py)
+            try:
+                result = importer.import_csv(file.stream, datatype,
+                                             batch_size=current_app.config.get('IMPORT_BATCH_SIZE', importer.DEFAULT_BATCH_SIZE))
+            except ValueError as e:
+                flash(f"Upload failed: {e}")
+            else:
+                flash(f"{datatype}: imported {result.imported} rows, skipped {result.skipped} rows")
+                for reason, count in result.skip_reasons.most_common():
+                    flash(f"Skipped {count} rows: {reason}")
+            finally:
+                file.close()
+
         return render_template("upload.html", panel="Upload")
+
+@main.route("/upload/jobs")
+@login_required
+def upload_jobs():
+    return jsonify(jobs=[job.to_dict() for job in ImportJob.getRecentJobs()])
+
+@main.route("/upload/jobs/<job_id>")
+@login_required
+def upload_job_status(job_id):
+    job = ImportJob.getJob(job_id)
+    if not job:
+        return jsonify(error="No such import job"), 404
+    return jsonify(job.to_dict())
     
-@app.route("/changeAvatar")
+@main.route("/changeAvatar")
 def changeAvatar():
     basedir = os.path.abspath(os.path.dirname(__file__))
     # Specify the relative path to the subfolder
@@ -156,11 +229,11 @@ def changeAvatar():
             # url_for('static') /static/default.jpg etc
     return render_template("changeAvatar.html", filenames=files, panel="Change Avatar") 
 
-@app.route("/chooseAvatar", methods=['POST'])
+@main.route("/chooseAvatar", methods=['POST'])
 def chooseAvatar():
     # get the filename
     chosenPath = request.json['path']
-    print('chosen path: ', chosenPath)
+    log.debug("chooseAvatar path=%s", chosenPath)
   
     basedir = os.path.abspath(os.path.dirname(__file__))
 
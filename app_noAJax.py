@@ -2,7 +2,7 @@
 
 from flask_login import login_required, current_user
 from flask import Blueprint, render_template, request, jsonify, url_for, redirect
-from app import app, db #, login_manager
+from app import create_app, db #, login_manager
 
 from werkzeug.security import generate_password_hash
 
@@ -26,6 +26,9 @@ import json
 import datetime as dt
 import os
 
+# this demo registers its own routes and blueprints instead of the default ones
+app = create_app(blueprints=False)
+
 # register blueprint from respective module
 app.register_blueprint(dashboard)
 app.register_blueprint(auth)
@@ -83,8 +86,7 @@ def upload():
                     existing_package = Package.getPackage(hotel_name=item['hotel_name'])
                     check_in_date=dt.datetime.strptime(item['check_in_date'], "%Y-%m-%d")
 
-                    aBooking = Booking.createBooking(check_in_date=check_in_date, customer=existing_user, package=existing_package)
-                    aBooking.calculate_total_cost()
+                    Booking.createBooking(check_in_date=check_in_date, customer=existing_user, package=existing_package)
                     
         return render_template("upload.html", panel="Upload")
     
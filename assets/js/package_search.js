@@ -0,0 +1,44 @@
+// Typeahead for the package search box: hotel names from /packages/suggest fill a <datalist>.
+// Keystrokes are debounced, an answer that arrives after a newer keystroke is dropped, and every
+// prefix already answered is served from memory (the endpoint is also cacheable by the browser).
+const searchInput = document.getElementById('packageSearch');
+const suggestionList = document.getElementById('packageSuggestions');
+const SUGGEST_DELAY_MS = 120;
+
+let suggestTimer = null;
+let suggestRequest = 0;
+const suggestCache = new Map();
+
+function showSuggestions(names) {
+    suggestionList.innerHTML = '';
+    names.forEach(function (name) {
+        const option = document.createElement('option');
+        option.value = name;
+        suggestionList.appendChild(option);
+    });
+}
+
+function suggest(prefix) {
+    if (suggestCache.has(prefix)) {
+        showSuggestions(suggestCache.get(prefix));
+        return;
+    }
+    const request = ++suggestRequest;
+    $.getJSON('/packages/suggest', { prefix: prefix }, function (data) {
+        suggestCache.set(prefix, data.suggestions);
+        if (request === suggestRequest) {
+            showSuggestions(data.suggestions);
+        }
+    });
+}
+
+searchInput.addEventListener('input', function () {
+    clearTimeout(suggestTimer);
+    const prefix = searchInput.value.trim().toLowerCase();
+    if (!prefix) {
+        suggestRequest++;
+        showSuggestions([]);
+        return;
+    }
+    suggestTimer = setTimeout(function () { suggest(prefix); }, SUGGEST_DELAY_MS);
+});
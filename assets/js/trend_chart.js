@@ -5,16 +5,65 @@ let currentChart = null;
 const ctx = document.getElementById('myChart').getContext('2d');
 const chartContainer = document.getElementById('chartContainer');
 const chartTypeDropdown = document.getElementById('chartTypeDropdown');
+const chartOptionIds = ['chartFrom', 'chartTo', 'chartGranularity', 'chartMaxPoints'];
+const liveToggle = document.getElementById('chartLive');
+const liveWindowText = document.getElementById('chartLiveWindow');
+
+// Live mode: one EventSource on /trend_chart/stream sends a snapshot of the recent daily and monthly
+// buckets (the server's window), then the buckets in it that change; they are kept here, keyed by period|hotel|bucket
+let liveSource = null;
+let liveBuckets = new Map();
+let liveRenderTimer = null;
+
+// Range, granularity and point cap sent with every chart request (empty values use the server defaults)
+function chartParams() {
+    return {
+        from: document.getElementById('chartFrom').value,
+        to: document.getElementById('chartTo').value,
+        granularity: document.getElementById('chartGranularity').value,
+        max_points: document.getElementById('chartMaxPoints').value
+    };
+}
+
+// Color derived from a label, so a series keeps its color when the chart is redrawn
+function colorFor(label) {
+    let hash = 0;
+    for (let i = 0; i < label.length; i++) {
+        hash = (hash * 31 + label.charCodeAt(i)) | 0;
+    }
+    return 'hsl(' + (Math.abs(hash) % 360) + ', 65%, 50%)';
+}
+
+function chartError(xhr, fallback) {
+    alert((xhr.responseJSON && xhr.responseJSON.error) || fallback);
+}
 
 // Add event listener for dropdown changes
-chartTypeDropdown.addEventListener('change', function() {
-    const selectedType = this.value;
+chartTypeDropdown.addEventListener('change', loadSelectedChart);
+liveToggle.addEventListener('change', loadSelectedChart);
+
+// Reload the chart shown when an option changes
+chartOptionIds.forEach(function(id) {
+    document.getElementById(id).addEventListener('change', loadSelectedChart);
+});
+
+function loadSelectedChart() {
+    const selectedType = chartTypeDropdown.value;
 
     // Destroy existing chart if it exists
-    if (currentChart) {
-        currentChart.destroy();
-        currentChart = null;
+    destroyChart();
+
+    // Live charts show the server's window: daily revenue and monthly bookings
+    chartOptionIds.forEach(function(id) {
+        document.getElementById(id).disabled = liveToggle.checked;
+    });
+    if (liveToggle.checked && selectedType !== 'none') {
+        chartContainer.style.display = 'block';
+        startLive();
+        renderLive();
+        return;
     }
+    stopLive();
 
     // Handle different chart types
     if (selectedType === 'none') {
@@ -29,81 +78,167 @@ chartTypeDropdown.addEventListener('change', function() {
         chartContainer.style.display = 'block';
         loadBookingsByMonthChart();
     }
-});
+}
+
+function destroyChart() {
+    if (currentChart) {
+        currentChart.destroy();
+        currentChart = null;
+    }
+}
+
+function startLive() {
+    if (liveSource) {
+        return;
+    }
+    liveSource = new EventSource('/trend_chart/stream');
+    liveSource.addEventListener('snapshot', function(e) {
+        const snapshot = JSON.parse(e.data);
+        liveBuckets = new Map();
+        applyLiveBuckets(snapshot.buckets);
+        liveWindowText.textContent = 'Days from ' + snapshot.window.day + ', months from ' + snapshot.window.month;
+        renderLive();
+    });
+    liveSource.addEventListener('update', function(e) {
+        applyLiveBuckets(JSON.parse(e.data).buckets);
+        // redraw at most once a second however many updates arrive
+        if (!liveRenderTimer) {
+            liveRenderTimer = setTimeout(function() {
+                liveRenderTimer = null;
+                renderLive();
+            }, 1000);
+        }
+    });
+}
+
+function stopLive() {
+    if (liveSource) {
+        liveSource.close();
+        liveSource = null;
+    }
+    liveBuckets = new Map();
+    liveWindowText.textContent = '';
+}
+
+function applyLiveBuckets(buckets) {
+    buckets.forEach(function(b) {
+        const key = b.period + '|' + b.hotel_name + '|' + b.bucket;
+        if (b.count > 0) {
+            liveBuckets.set(key, b);
+        } else {
+            liveBuckets.delete(key);
+        }
+    });
+}
+
+// "2022-01-01" -> "January 2022", the label /bookings_by_month uses
+function monthLabel(bucket) {
+    return new Date(bucket + 'T00:00:00').toLocaleString('en-US', {month: 'long', year: 'numeric'});
+}
+
+// Redraw the selected chart from the live buckets
+function renderLive() {
+    const selectedType = chartTypeDropdown.value;
+    if (!liveSource || selectedType === 'none') {
+        return;
+    }
+    const rows = Array.from(liveBuckets.values()).sort((a, b) => {
+        return a.hotel_name.localeCompare(b.hotel_name) || a.bucket.localeCompare(b.bucket);
+    });
+    destroyChart();
+    if (selectedType === 'amount') {
+        const chartDim = {};
+        rows.filter(b => b.period === 'day').forEach(b => {
+            (chartDim[b.hotel_name] = chartDim[b.hotel_name] || []).push([b.bucket + 'T00:00:00', b.revenue]);
+        });
+        renderAmountChart(chartDim);
+    } else {
+        const chartData = {};
+        const months = new Set();
+        rows.filter(b => b.period === 'month').forEach(b => {
+            (chartData[b.hotel_name] = chartData[b.hotel_name] || {})[monthLabel(b.bucket)] = b.count;
+            months.add(b.bucket);
+        });
+        renderBookingsChart(chartData, Array.from(months).sort().map(monthLabel));
+    }
+}
 
 // Function to load Amount Incoming (Line Chart)
 function loadAmountIncomingChart() {
     $.ajax({
         url: "/trend_chart",
         type: "POST",
-        data: {},
-        error: function() {
-            alert("Error loading Amount Incoming chart");
+        data: chartParams(),
+        error: function(xhr) {
+            chartError(xhr, "Error loading Amount Incoming chart");
         },
         success: function(data, status, xhr) {
-            const chartDim = data.chartDim;
-
-            // Transform data for Chart.js
-            const vLabels = [];
-            const vData = [];
-
-            for (const [key, values] of Object.entries(chartDim)) {
-                vLabels.push(key);
-                let xy = [];
-                for (let i = 0; i < values.length; i++) {
-                    let d = new Date(values[i][0]);
-                    let year = d.getFullYear();
-                    let month = ('' + (d.getMonth() + 1)).padStart(2, '0');
-                    let day = ('' + d.getDate()).padStart(2, '0');
-                    let aDateTime = year + '-' + month + '-' + day;
-                    xy.push({'x': aDateTime, 'y': values[i][1]});
-                }
-                vData.push(xy);
-            }
+            renderAmountChart(data.chartDim);
+        }
+    });
+}
+
+// Draw the Amount Incoming line chart from {hotel: [[date, revenue], ...]}
+function renderAmountChart(chartDim) {
+    // Transform data for Chart.js
+    const vLabels = [];
+    const vData = [];
+
+    for (const [key, values] of Object.entries(chartDim)) {
+        vLabels.push(key);
+        let xy = [];
+        for (let i = 0; i < values.length; i++) {
+            let d = new Date(values[i][0]);
+            let year = d.getFullYear();
+            let month = ('' + (d.getMonth() + 1)).padStart(2, '0');
+            let day = ('' + d.getDate()).padStart(2, '0');
+            let aDateTime = year + '-' + month + '-' + day;
+            xy.push({'x': aDateTime, 'y': values[i][1]});
+        }
+        vData.push(xy);
+    }
 
-            // Create line chart
-            currentChart = new Chart(ctx, {
-                data: {
-                    datasets: []
+    // Create line chart
+    currentChart = new Chart(ctx, {
+        data: {
+            datasets: []
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            scales: {
+                x: {
+                    type: 'time',
+                    time: {
+                        parser: 'yyyy-MM-dd',
+                    },
+                    title: {
+                        display: true,
+                        text: 'Date'
+                    }
                 },
-                options: {
-                    responsive: true,
-                    maintainAspectRatio: false,
-                    scales: {
-                        x: {
-                            type: 'time',
-                            time: {
-                                parser: 'yyyy-MM-dd',
-                            },
-                            title: {
-                                display: true,
-                                text: 'Date'
-                            }
-                        },
-                        y: {
-                            title: {
-                                display: true,
-                                text: 'Revenue ($)'
-                            }
-                        }
+                y: {
+                    title: {
+                        display: true,
+                        text: 'Revenue ($)'
                     }
                 }
-            });
-
-            // Add datasets for each hotel
-            for (let i = 0; i < vLabels.length; i++) {
-                currentChart.data.datasets.push({
-                    label: vLabels[i],
-                    type: "line",
-                    borderColor: '#' + (0x1100000 + Math.random() * 0xffffff).toString(16).substr(1, 6),
-                    backgroundColor: "rgba(249, 238, 236, 0.74)",
-                    data: vData[i],
-                    spanGaps: true
-                });
             }
-            currentChart.update();
         }
     });
+
+    // Add datasets for each hotel
+    for (let i = 0; i < vLabels.length; i++) {
+        currentChart.data.datasets.push({
+            label: vLabels[i],
+            type: "line",
+            borderColor: colorFor(vLabels[i]),
+            backgroundColor: "rgba(249, 238, 236, 0.74)",
+            data: vData[i],
+            spanGaps: true
+        });
+    }
+    currentChart.update();
 }
 
 // Function to load Bookings By Month (Bar Chart)
@@ -111,85 +246,76 @@ function loadBookingsByMonthChart() {
     $.ajax({
         url: "/bookings_by_month",
         type: "POST",
-        data: {},
-        error: function() {
-            alert("Error loading Bookings By Month chart");
+        data: chartParams(),
+        error: function(xhr) {
+            chartError(xhr, "Error loading Bookings By Month chart");
         },
         success: function(data, status, xhr) {
-            const chartData = data.chartData;
+            renderBookingsChart(data.chartData, data.labels);
+        }
+    });
+}
 
-            // Extract all unique hotels (sorted alphabetically - already done in backend)
-            const hotels = Object.keys(chartData);
+// Draw the Bookings By Month bar chart from {hotel: {label: count}} and the labels in order
+function renderBookingsChart(chartData, labels) {
+    // Extract all unique hotels (sorted alphabetically - already done in backend)
+    const hotels = Object.keys(chartData);
 
-            // Extract all unique months across all hotels
-            const allMonths = new Set();
-            for (const hotel in chartData) {
-                for (const month in chartData[hotel]) {
-                    allMonths.add(month);
-                }
-            }
+    // Bucket labels across all hotels, already in chronological order
+    const monthsList = labels;
+
+    // One color per month, the same on every redraw
+    const colors = monthsList.map(colorFor);
+
+    // Create datasets - one for each month
+    const datasets = monthsList.map((month, index) => {
+        const dataPoints = hotels.map(hotel => {
+            return chartData[hotel][month] || 0;
+        });
+
+        return {
+            label: month,
+            data: dataPoints,
+            backgroundColor: colors[index],
+            borderColor: colors[index],
+            borderWidth: 1
+        };
+    });
 
-            // Sort months chronologically
-            const monthsList = Array.from(allMonths).sort((a, b) => {
-                return new Date(a) - new Date(b);
-            });
-
-            // Generate random colors for each month
-            const colors = monthsList.map(() => {
-                return '#' + (0x1100000 + Math.random() * 0xffffff).toString(16).substr(1, 6);
-            });
-
-            // Create datasets - one for each month
-            const datasets = monthsList.map((month, index) => {
-                const dataPoints = hotels.map(hotel => {
-                    return chartData[hotel][month] || 0;
-                });
-
-                return {
-                    label: month,
-                    data: dataPoints,
-                    backgroundColor: colors[index],
-                    borderColor: colors[index],
-                    borderWidth: 1
-                };
-            });
-
-            // Create bar chart
-            currentChart = new Chart(ctx, {
-                type: 'bar',
-                data: {
-                    labels: hotels,
-                    datasets: datasets
+    // Create bar chart
+    currentChart = new Chart(ctx, {
+        type: 'bar',
+        data: {
+            labels: hotels,
+            datasets: datasets
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            scales: {
+                x: {
+                    title: {
+                        display: true,
+                        text: 'Hotels'
+                    }
                 },
-                options: {
-                    responsive: true,
-                    maintainAspectRatio: false,
-                    scales: {
-                        x: {
-                            title: {
-                                display: true,
-                                text: 'Hotels'
-                            }
-                        },
-                        y: {
-                            beginAtZero: true,
-                            title: {
-                                display: true,
-                                text: 'Number of Bookings'
-                            },
-                            ticks: {
-                                stepSize: 1
-                            }
-                        }
+                y: {
+                    beginAtZero: true,
+                    title: {
+                        display: true,
+                        text: 'Number of Bookings'
                     },
-                    plugins: {
-                        legend: {
-                            display: true,
-                            position: 'top'
-                        }
+                    ticks: {
+                        stepSize: 1
                     }
                 }
-            });
+            },
+            plugins: {
+                legend: {
+                    display: true,
+                    position: 'top'
+                }
+            }
         }
     });
 }
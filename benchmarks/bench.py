@@ -0,0 +1,255 @@
+"""Endpoint benchmark suite.
+
+Seeds a throwaway database with synthetic users, packages and bookings (models/datagen.py) plus
+bundles, then times the hot routes through the Flask test client and reports
+p50/p95 latency, Mongo commands per request and peak Python memory per route.
+
+    python benchmarks/bench.py --bookings 50000 --out bench.json
+    python benchmarks/bench.py --baseline bench.json          # compare against a stored run
+
+A MongoDB server at --host is used when reachable (database --db, dropped before seeding);
+otherwise the run falls back to mongomock, in which case command counts are not available.
+"""
+import argparse
+import datetime as dt
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+import pymongo
+from pymongo import monitoring
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROUTES = [
+    ('GET /packages', 'get', '/packages', 'customer'),
+    ('GET /manageBooking', 'get', '/manageBooking', 'customer'),
+    ('GET /manageBundle', 'get', '/manageBundle', 'customer'),
+    ('POST /trend_chart', 'post', '/trend_chart', 'admin'),
+    ('POST /bookings_by_month', 'post', '/bookings_by_month', 'admin'),
+    ('POST /upload', 'upload', '/upload', 'admin'),
+]
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts Mongo commands issued by the benchmark thread."""
+
+    def __init__(self):
+        self.count = 0
+        self._thread = threading.get_ident()
+
+    def started(self, event):
+        if threading.get_ident() == self._thread:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def mongo_reachable(host):
+    try:
+        pymongo.MongoClient(host, serverSelectionTimeoutMS=500).admin.command('ping')
+        return True
+    except pymongo.errors.PyMongoError:
+        return False
+
+
+def load_app(settings):
+    """Build the app through create_app() with MONGODB_SETTINGS replaced by `settings`."""
+    # The checkout is the `app` package (app/__init__.py holds create_app) with models/ and
+    # controllers/ importable from its root, whatever the directory is called
+    sys.path.insert(0, ROOT)
+    spec = importlib.util.spec_from_file_location('app', os.path.join(ROOT, '__init__.py'),
+                                                  submodule_search_locations=[ROOT])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules['app'] = package
+    spec.loader.exec_module(package)
+    return package.create_app({'MONGODB_SETTINGS': settings, 'WTF_CSRF_ENABLED': False, 'TESTING': True})
+
+
+def seed(args, rng):
+    """Load the synthetic dataset. Returns (customer email, admin email)."""
+    from werkzeug.security import generate_password_hash
+    from models import datagen
+    from models.users import User
+    from models.package import Package
+    from models.bundle import BundlePurchase
+
+    datagen.load(args.users, args.packages, args.bookings, seed=args.seed, drop=True, days=args.days)
+    User._get_collection().insert_one({'email': 'admin@abc.com', 'password': generate_password_hash('12345', method='sha256'),
+                                       'name': 'Admin', 'avatar': ''})
+
+    # datagen skews activity towards the first customers, so user 0 is the heavy account the
+    # per-user pages are timed with; give it a tenth of the bundles too
+    customer_ids = [u['_id'] for u in User.objects(email__endswith=datagen.EMAIL_DOMAIN).only('id').as_pymongo()]
+    heavy = User.objects(email=datagen.user_email(0)).only('id').as_pymongo().first()['_id']
+    package_ids = [p['_id'] for p in Package.objects.only('id').as_pymongo()]
+    BundlePurchase.drop_collection()
+    bundles = []
+    for i in range(args.bundles):
+        customer = heavy if i % 10 == 0 else rng.choice(customer_ids)
+        items = [{'package': pid, 'utilised': rng.random() < 0.3}
+                 for pid in rng.sample(package_ids, min(len(package_ids), rng.randint(1, 4)))]
+        purchased = dt.datetime.utcnow() - dt.timedelta(days=rng.randrange(500))
+        bundles.append({'customer': customer, 'bundledPackages': items, 'purchased_date': purchased,
+                        'expires_at': purchased + BundlePurchase.VALIDITY,
+                        'expired': purchased + BundlePurchase.VALIDITY <= dt.datetime.utcnow()})
+    if bundles:
+        BundlePurchase._get_collection().insert_many(bundles, ordered=False)
+    return datagen.user_email(0), 'admin@abc.com'
+
+
+def upload_csv(args, rng):
+    """A Booking CSV in the /upload format, referencing seeded users and hotels."""
+    from models import datagen
+
+    lines = ['check_in_date,customer,hotel_name']
+    for _ in range(args.upload_rows):
+        day = dt.date(2023, 1, 1) + dt.timedelta(days=rng.randrange(365))
+        lines.append(f'{day:%Y-%m-%d},{datagen.user_email(rng.randrange(args.users))},"{datagen.hotel_name(rng.randrange(args.packages))}"')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def login(app, email):
+    client = app.test_client()
+    response = client.post('/login', data={'email': email, 'password': '12345'})
+    if response.status_code != 302:
+        raise RuntimeError(f"could not log in as {email}")
+    return client
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def time_route(client, method, path, args, rng, counter):
+    timings, commands, peaks = [], [], []
+    for i in range(args.warmup + args.repeat):
+        if method == 'upload':
+            data = {'type': 'upload', 'datatype': 'Booking',
+                    'file': (io.BytesIO(upload_csv(args, rng)), 'bench.csv')}
+            call = lambda: client.post(path, data=data, content_type='multipart/form-data')
+        else:
+            call = lambda: getattr(client, method)(path)
+        tracemalloc.start()
+        before = counter.count if counter else 0
+        started = time.perf_counter()
+        response = call()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}")
+        if i >= args.warmup:
+            timings.append(elapsed * 1000)
+            peaks.append(peak / 1024)
+            if counter:
+                commands.append(counter.count - before)
+    return {
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'mean_ms': round(statistics.mean(timings), 2),
+        'queries_per_request': round(statistics.mean(commands), 1) if commands else None,
+        'peak_kb': round(max(peaks), 1),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print p50 changes against a baseline run; returns the names of routes that regressed."""
+    regressed = []
+    print(f"\n{'route':28} {'base p50':>10} {'p50':>10} {'change':>8}")
+    for name, now in results['routes'].items():
+        base = baseline.get('routes', {}).get(name)
+        if not base:
+            print(f"{name:28} {'-':>10} {now['p50_ms']:>10} {'new':>8}")
+            continue
+        change = (now['p50_ms'] - base['p50_ms']) / base['p50_ms'] * 100 if base['p50_ms'] else 0.0
+        flag = ' !' if change > threshold else ''
+        print(f"{name:28} {base['p50_ms']:>10} {now['p50_ms']:>10} {change:>+7.1f}%{flag}")
+        if change > threshold:
+            regressed.append(name)
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='mongodb://localhost:27017')
+    parser.add_argument('--db', default='staycation_bench')
+    parser.add_argument('--mongomock', action='store_true', help="use mongomock even if a server is reachable")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--packages', type=int, default=50)
+    parser.add_argument('--bookings', type=int, default=20000)
+    parser.add_argument('--bundles', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=730, help="spread of check-in dates")
+    parser.add_argument('--upload-rows', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help="write results JSON here")
+    parser.add_argument('--baseline', help="results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=20.0, help="p50 regression %% that fails the run")
+    args = parser.parse_args(argv)
+
+    use_mock = args.mongomock or not mongo_reachable(args.host)
+    counter = None
+    if use_mock:
+        import mongomock
+        settings = {'db': args.db, 'host': 'localhost', 'mongo_client_class': mongomock.MongoClient}
+    else:
+        # listeners must be registered before the app creates its client
+        counter = CommandCounter()
+        monitoring.register(counter)
+        settings = {'db': args.db, 'host': args.host}
+    app = load_app(settings)
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    customer, admin = seed(args, rng)
+    print(f"seeded {args.users} users, {args.packages} packages, {args.bookings} bookings, {args.bundles} bundles "
+          f"in {time.perf_counter() - started:.1f}s ({'mongomock' if use_mock else args.host})")
+
+    clients = {'customer': login(app, customer), 'admin': login(app, admin)}
+    results = {
+        'meta': {
+            'backend': 'mongomock' if use_mock else 'mongodb',
+            'python': platform.python_version(),
+            'timestamp': dt.datetime.utcnow().isoformat(timespec='seconds'),
+            'volumes': {k: getattr(args, k) for k in ('users', 'packages', 'bookings', 'bundles', 'upload_rows')},
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'routes': {},
+    }
+    print(f"\n{'route':28} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8} {'peak KB':>9}")
+    for name, method, path, role in ROUTES:
+        stats = time_route(clients[role], method, path, args, rng, counter)
+        results['routes'][name] = stats
+        queries = '-' if stats['queries_per_request'] is None else stats['queries_per_request']
+        print(f"{name:28} {stats['p50_ms']:>8} {stats['p95_ms']:>8} {queries:>8} {stats['peak_kb']:>9}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = compare(results, json.load(f), args.threshold)
+        if regressed:
+            print(f"\nregressed beyond {args.threshold}%: {', '.join(regressed)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,19 @@
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import login_user, login_required, logout_user, current_user
-from flask import Blueprint, request, redirect, render_template, url_for, flash
+from flask import Blueprint, request, redirect, render_template, url_for, flash, current_app
 from app import login_manager
 
 from models.forms import RegForm
-from models.users import User
+from models.users import User, user_cache
+import logging
 import os
 
 auth = Blueprint('auth', __name__)
+log = logging.getLogger(__name__)
+
+@auth.record_once
+def configure_user_cache(state):
+    user_cache.configure(max_size=state.app.config['USER_CACHE_SIZE'], ttl=state.app.config['USER_CACHE_TTL'])
 
 @auth.route('/register', methods=['GET', 'POST'])
 def register():
@@ -28,7 +34,7 @@ def register():
 def login():
     form = RegForm()
     if request.method == 'POST':
-        print(request.form.get('checkbox'))
+        log.debug("login attempt email=%s remember=%s", request.form.get('email'), request.form.get('checkbox'))
         if form.validate():
             check_user = User.getUser(email=form.email.data)
             if check_user:
@@ -50,7 +56,8 @@ def logout():
 # Load the current user if any
 @login_manager.user_loader
 def load_user(user_id):
-    print('loading user_id: ', user_id)
+    if current_app.config['USER_CACHE_ENABLED']:
+        return User.getCachedUserById(user_id)
     return User.getUserById(user_id)
 
 
@@ -1,28 +1,30 @@
 from flask_login import login_user, login_required, logout_user, current_user
-from flask import Blueprint, request, redirect, render_template, url_for, flash
+from flask import Blueprint, request, redirect, render_template, url_for, flash, current_app, jsonify
 
 from models.forms import BookForm
 
 from models.users import User
 from models.package import Package
-from models.book import Booking
+from models.book import Booking, BookingConflict
 from models.bundle import BundlePurchase
 
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
+import logging
 
 booking = Blueprint('bookingController', __name__) # use bookingController.fn
+log = logging.getLogger(__name__)
 
 @booking.route('/view')
 @login_required
 def view():
-    if current_user.name == 'Admin':
+    if current_user.isAdmin():
         flash('This is a non-admin function. Please log in as a non-admin user to use this function.')
         return redirect(request.referrer)
     form = BookForm()
     hotel_name=request.args.get('hotel_name').strip("'")
 
     the_package_to_be_booked = Package.getPackage(hotel_name=hotel_name)
-    print(the_package_to_be_booked)
+    log.debug("view hotel_name=%s found=%s", hotel_name, the_package_to_be_booked is not None)
     return render_template('booking.html', panel=hotel_name, form=form, package=the_package_to_be_booked)
 
 
@@ -40,19 +42,25 @@ def book():
         # check_in_date in book 2023-03-28 <class 'str'>
 
         existing_package = Package.getPackage(hotel_name=hotel_name)
-        print(existing_package)
         if (current_user is None) or (existing_package is None):
-            print(f"Something is wrong")
+            log.warning("book: unknown package hotel_name=%s", hotel_name)
         else:
-            aBooking = Booking.createBooking(check_in_date, current_user, existing_package) 
-            # print('aBooking.check_in_date', aBooking.check_in_date, type(aBooking.check_in_date)) # type is str
-            # aBooking.check_in_date 2023-03-28 <class 'str'>
-            # If booking initiated from Manage Bundle with context, mark utilised
-            if bundle_id and package_id:
-                try:
-                    BundlePurchase.mark_package_utilised(bundle_id, package_id)
-                except Exception as e:
-                    print(f"Failed to mark bundle item utilised: {e}")
+            customer = current_user._get_current_object()
+            # If booking initiated from Manage Bundle with context, redeem the bundle item first;
+            # the redemption is atomic, so of two concurrent bookings only one gets the item, and
+            # it is given back if the booking then cannot be made
+            if bundle_id and package_id and not BundlePurchase.redeem(bundle_id, package_id, customer=customer):
+                flash('This bundle package has already been used or the bundle has expired.')
+                return redirect(url_for('packageController.manageBundle'))
+            try:
+                Booking.createBooking(check_in_date, current_user, existing_package)
+            except Exception as e:
+                if bundle_id and package_id:
+                    BundlePurchase.unredeem(bundle_id, package_id, customer=customer)
+                if not isinstance(e, BookingConflict):
+                    raise
+                flash(str(e))
+                return redirect(request.referrer or url_for('packageController.packages'))
         if bundle_id and package_id:
             return redirect(url_for('packageController.manageBundle'))
         return redirect(url_for('packageController.packages'))
@@ -60,12 +68,14 @@ def book():
 @booking.route('/manageBooking')
 @login_required
 def manageBooking(days = -2000):
-    bookings = list(Booking.getUserBookingsFromDate(customer=current_user, from_date=date.today()+timedelta(days = days)))
+    # One page at a time, ordered by check-in date in Mongo; ?after=/?before= carry the keyset cursor
+    page = Booking.getUserBookingsFromDate(customer=current_user._get_current_object(),
+                                           from_date=date.today()+timedelta(days = days), prefetch_refs=True,
+                                           page_size=current_app.config['PAGE_SIZE'],
+                                           after=request.args.get('after'), before=request.args.get('before'))
     # Filter out any invalid records that may have been created in the past
-    bookings = [b for b in bookings if getattr(b, 'package', None) is not None and getattr(b, 'customer', None) is not None]
-    if bookings:
-        bookings.sort(key = lambda b: b.check_in_date)
-    return render_template('userBookings.html', panel='Manage Booking', bookings=bookings)
+    bookings = [b for b in page.items if getattr(b, 'package', None) is not None and getattr(b, 'customer', None) is not None]
+    return render_template('userBookings.html', panel='Manage Booking', bookings=bookings, page=page)
 
 @booking.route("/updateBooking", methods=["POST"])
 @login_required
@@ -75,7 +85,10 @@ def update():
     new_check_in_date=request.form.get("check_in_date")
     # print('old_check_in_date', old_check_in_date, type(old_check_in_date))
 
-    Booking.updateBooking(old_check_in_date, new_check_in_date, current_user, hotel_name)
+    try:
+        Booking.updateBooking(old_check_in_date, new_check_in_date, current_user, hotel_name)
+    except BookingConflict as e:
+        flash(str(e))
     return redirect(url_for('bookingController.manageBooking'))
      
 @booking.route("/deleteBooking", methods=["POST"])
@@ -87,4 +100,22 @@ def delete():
     # convert check_in_date to date type ?? check
     # 2023-03-09 00:00:00 <class 'str'>
     Booking.deleteBooking(check_in_date, current_user, hotel_name)
-    return redirect(url_for('bookingController.manageBooking'))
\ No newline at end of file
+    return redirect(url_for('bookingController.manageBooking'))
+
+@booking.route("/availability")
+@login_required
+def availability():
+    """Which packages the current user can book for the whole stay [from, to). Dates are YYYY-MM-DD."""
+    try:
+        from_date = datetime.strptime(request.args.get('from', ''), "%Y-%m-%d")
+        to_date = datetime.strptime(request.args.get('to', ''), "%Y-%m-%d")
+    except ValueError:
+        return jsonify(error="from and to must be dates in YYYY-MM-DD format"), 400
+    if to_date <= from_date:
+        return jsonify(error="to must be after from"), 400
+    return jsonify({
+        'from': from_date.strftime("%Y-%m-%d"),
+        'to': to_date.strftime("%Y-%m-%d"),
+        'packages': [{'hotel_name': p.hotel_name, 'available': available}
+                     for p, available in Booking.getAvailability(current_user._get_current_object(), from_date, to_date)],
+    })
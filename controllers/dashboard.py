@@ -1,76 +1,164 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, Response, render_template, request, jsonify, current_app, abort, stream_with_context
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta, date
-from app import db
+from app import db, analytics_read_preference
 from models.book import Booking
+from models.rollup import BookingRollup, bucket_label
+from models.downsample import lttb
+from models import kpi
+from models.live import live_dashboard
+from models.snapshot import booking_snapshot
+import queue
 
 dashboard = Blueprint('dashboard', __name__)
 
+@dashboard.record_once
+def configure_live_dashboard(state):
+    config = state.app.config
+    with state.app.app_context():
+        read_preference = analytics_read_preference()
+    live_dashboard.configure(config['LIVE_FEED_SOURCE'], config['LIVE_FEED_INTERVAL'], read_preference=read_preference,
+                             window_days=config['LIVE_WINDOW_DAYS'], window_months=config['LIVE_WINDOW_MONTHS'])
+    booking_snapshot.refresh_interval = config['SNAPSHOT_REFRESH_INTERVAL']
+
+def chart_args(default_granularity):
+    """(granularity, date_from, date_to, max_points) from the request; raises ValueError on bad input.
+
+    Parameters (query string or form): from, to (YYYY-MM-DD, inclusive), granularity
+    (day/week/month/quarter) and max_points (cap per series, 0 or absent for no cap).
+    """
+    granularity = request.values.get('granularity') or default_granularity
+    if granularity not in BookingRollup.GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(BookingRollup.GRANULARITIES)}")
+    try:
+        date_from = datetime.strptime(request.values['from'], '%Y-%m-%d') if request.values.get('from') else None
+        date_to = datetime.strptime(request.values['to'], '%Y-%m-%d') if request.values.get('to') else None
+    except ValueError:
+        raise ValueError("from and to must be dates in YYYY-MM-DD format")
+    if date_from and date_to and date_from > date_to:
+        raise ValueError("from must not be after to")
+    try:
+        max_points = int(request.values.get('max_points') or 0)
+    except ValueError:
+        raise ValueError("max_points must be an integer")
+    if max_points and max_points < 3:
+        raise ValueError("max_points must be at least 3")
+    return granularity, date_from, date_to, max_points
+
+def chart_series(field, granularity, date_from, date_to, max_points):
+    """{hotel_name: [(bucket, revenue or count), ...]} sorted by bucket, downsampled to max_points.
+
+    Read from the rollups, or from the in-memory booking snapshot with DASHBOARD_SOURCE=snapshot.
+    """
+    if current_app.config['DASHBOARD_SOURCE'] == 'snapshot':
+        rows = booking_snapshot.buckets(granularity, date_from, date_to)
+    else:
+        rows = BookingRollup.getBuckets(granularity, date_from, date_to)
+    series = {}
+    for row in rows:
+        series.setdefault(row['hotel_name'], []).append((row['bucket'], row[field]))
+    if max_points:
+        series = {hotel: lttb(points, max_points) for hotel, points in series.items()}
+    return series
+
 @dashboard.route('/trend_chart', methods=['GET', 'POST'])
 def trend_chart():
     
     if request.method == 'GET':
         
         #I want to get some data from the service
-        return render_template('trend_chart.html', panel="Package Chart")    #do nothing but to show index.html
+        return render_template('trend_chart.html', panel="Package Chart", granularities=BookingRollup.GRANULARITIES)
     
     elif request.method == 'POST':
         
-        #Chart is indexed by first date and last date
-        #And we are going to plot the period from 2021-01-17 to 2021-01-23
-
-        #Trend is reconstructed each time from Booking to incorporate new booking since the last trend chart
-
-        all_bookings = Booking.getAllBookings()
-        print(f"There are {len(all_bookings)} of booking records")
-        #TREND.objects.delete()
-
-        # hotel_costbyDate[hotel_name] = {date: accum_cost, ...}
-        hotel_costbyDate = {}
-
-        for aBooking in list(all_bookings):
-            hotel_name = aBooking.package.hotel_name
-            check_in_date = aBooking.check_in_date
-                      
-            if hotel_name not in hotel_costbyDate:
-                hotel_costbyDate[hotel_name] = {}
-            if check_in_date not in hotel_costbyDate[hotel_name]:
-                hotel_costbyDate[hotel_name][check_in_date] = 0
-            hotel_costbyDate[hotel_name][check_in_date] += aBooking.total_cost
-        
-        hotel_costbyDateSortedListValues = {}
-        for hotel, dateAmts in hotel_costbyDate.items():
-            hotel_costbyDateSortedListValues[hotel] = sorted(list(dateAmts.items()))
+        try:
+            granularity, date_from, date_to, max_points = chart_args(BookingRollup.DAY)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        #Trend is read from the daily and monthly rollups kept current by the Booking write paths
+        #(run `flask rebuild-rollups` once to populate it for an existing booking collection)
+        hotel_costbyDateSortedListValues = chart_series('revenue', granularity, date_from, date_to, max_points)
 
-        return jsonify({'chartDim': hotel_costbyDateSortedListValues, 'labels': []})
+        return jsonify({'chartDim': hotel_costbyDateSortedListValues, 'labels': [], 'granularity': granularity})
 
 @dashboard.route('/bookings_by_month', methods=['POST'])
 def bookings_by_month():
     """
-    Aggregates bookings by month-year for each hotel.
-    Returns format: {hotel_name: {month-year: count, ...}, ...}
+    Aggregates bookings by period (month by default) for each hotel.
+    Returns format: {'chartData': {hotel_name: {label: count, ...}, ...}, 'labels': [label, ...]}
+    with labels in chronological order.
     """
-    all_bookings = Booking.getAllBookings()
-    print(f"Processing {len(all_bookings)} bookings for month aggregation")
+    try:
+        granularity, date_from, date_to, max_points = chart_args(BookingRollup.MONTH)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    # hotel_bookingsByMonth[hotel_name] = {month-year: count, ...}
-    hotel_bookingsByMonth = {}
+    # Series come sorted by hotel name, then bucket
+    series = chart_series('count', granularity, date_from, date_to, max_points)
+    sorted_hotel_data = {hotel: {bucket_label(granularity, bucket): count for bucket, count in points}
+                         for hotel, points in series.items()}
+    buckets = sorted({bucket for points in series.values() for bucket, _ in points})
 
-    for aBooking in list(all_bookings):
-        hotel_name = aBooking.package.hotel_name
-        check_in_date = aBooking.check_in_date
+    return jsonify({'chartData': sorted_hotel_data, 'labels': [bucket_label(granularity, b) for b in buckets],
+                    'granularity': granularity})
+
+@dashboard.route('/cost_histogram', methods=['POST'])
+@login_required
+def cost_histogram():
+    """Admin: number of bookings per total_cost bin, from the in-memory booking snapshot.
+
+    Parameters: bins (default 10), from, to (YYYY-MM-DD, check-in dates, inclusive).
+    Returns {'edges': [...], 'counts': [...]}: counts[i] bookings cost from edges[i] up to edges[i + 1].
+    """
+    if not current_user.isAdmin():
+        return jsonify(error='Admin only'), 403
+    try:
+        _, date_from, date_to, _ = chart_args(BookingRollup.DAY)
+        bins = int(request.values.get('bins') or 10)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not 1 <= bins <= 1000:
+        return jsonify({'error': "bins must be between 1 and 1000"}), 400
+    date_to = date_to + timedelta(days=1) if date_to else None
+    edges, counts = booking_snapshot.histogram(bins, date_from, date_to)
+    return jsonify({'edges': edges, 'counts': counts})
 
-        # Format as "Month YYYY" (e.g., "January 2022")
-        month_year = check_in_date.strftime("%B %Y")
+@dashboard.route('/kpis')
+@login_required
+def kpis():
+    """Admin KPI panel, from the same cached aggregations as /kpis/data."""
+    if not current_user.isAdmin():
+        abort(403)
+    return render_template('kpis.html', panel="KPIs", kpis=kpi.compute(ttl=current_app.config['KPI_CACHE_TTL']))
 
-        if hotel_name not in hotel_bookingsByMonth:
-            hotel_bookingsByMonth[hotel_name] = {}
-        if month_year not in hotel_bookingsByMonth[hotel_name]:
-            hotel_bookingsByMonth[hotel_name][month_year] = 0
-        hotel_bookingsByMonth[hotel_name][month_year] += 1
+@dashboard.route('/kpis/data')
+@login_required
+def kpis_data():
+    """Booking and bundle KPIs as JSON: one $facet aggregation per collection, cached for KPI_CACHE_TTL seconds."""
+    if not current_user.isAdmin():
+        return jsonify(error='Admin only'), 403
+    return jsonify(kpi.compute(ttl=current_app.config['KPI_CACHE_TTL']))
 
-    # Sort hotels alphabetically
-    sorted_hotel_data = dict(sorted(hotel_bookingsByMonth.items()))
+@dashboard.route('/trend_chart/stream')
+@login_required
+def trend_chart_stream():
+    """Server-sent events for the live dashboard: a snapshot of the rollups, then updates as bookings change."""
+    if not current_user.isAdmin():
+        abort(403)
+    heartbeat = current_app.config['LIVE_HEARTBEAT']
 
-    return jsonify({'chartData': sorted_hotel_data})
+    def events():
+        client = live_dashboard.subscribe()
+        try:
+            while True:
+                try:
+                    yield client.get(timeout=heartbeat)
+                except queue.Empty:
+                    # comment line: keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+        finally:
+            live_dashboard.unsubscribe(client)
 
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
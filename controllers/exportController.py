@@ -0,0 +1,52 @@
+from flask import Blueprint, Response, request, jsonify, stream_with_context, current_app, abort
+from flask_login import login_required, current_user
+
+from models import exporter
+import datetime as dt
+
+export = Blueprint('exportController', __name__)
+
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+@export.before_request
+@login_required
+def admin_only():
+    if not current_user.isAdmin():
+        abort(403)
+
+def _parse_day(name):
+    raw = request.args.get(name)
+    if not raw:
+        return None
+    return dt.datetime.strptime(raw, "%Y-%m-%d").date()
+
+def _stream(chunks, name, fmt):
+    filename = f"{name}-{dt.date.today():%Y%m%d}.{fmt}"
+    return Response(stream_with_context(chunks), mimetype=MIMETYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@export.route('/export/bookings')
+def export_bookings():
+    """Bookings as CSV (the /upload Booking format) or NDJSON.
+
+    Query: format=csv|ndjson, hotel=<hotel_name> (repeatable), from=YYYY-MM-DD, to=YYYY-MM-DD
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in exporter.FORMATS:
+        return jsonify(error=f"format must be one of {', '.join(exporter.FORMATS)}"), 400
+    try:
+        date_from, date_to = _parse_day('from'), _parse_day('to')
+    except ValueError:
+        return jsonify(error="from and to must be dates in YYYY-MM-DD format"), 400
+    chunks = exporter.export_bookings(fmt, hotel_names=request.args.getlist('hotel'), date_from=date_from,
+                                      date_to=date_to, batch_size=current_app.config['EXPORT_BATCH_SIZE'])
+    return _stream(chunks, 'bookings', fmt)
+
+@export.route('/export/bundles')
+def export_bundles():
+    """Bundle purchases with the status of each item, as CSV (one row per item) or NDJSON."""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in exporter.FORMATS:
+        return jsonify(error=f"format must be one of {', '.join(exporter.FORMATS)}"), 400
+    chunks = exporter.export_bundles(fmt, batch_size=current_app.config['EXPORT_BATCH_SIZE'])
+    return _stream(chunks, 'bundles', fmt)
@@ -1,21 +1,106 @@
 from flask_login import login_user, login_required, logout_user, current_user
-from flask import Blueprint, request, redirect, render_template, url_for, flash
+from flask import Blueprint, request, redirect, render_template, url_for, flash, jsonify, current_app
 from markupsafe import Markup
 
 from models.forms import BookForm
 
 from models.users import User
 from models.package import Package
-from models.bundle import BundlePurchase
+from models.bundle import BundlePurchase, expiry_sweeper
+from models.pricing import PricingEngine
 import datetime as dt
 
 package = Blueprint('packageController', __name__)
 
+# Discount tiers are read once when the blueprint is registered; the bundle purchase view and
+# /bundleQuote share the engine
+@package.record_once
+def create_pricing(state):
+    state.app.extensions['pricing'] = PricingEngine(state.app.config['BUNDLE_DISCOUNT_TIERS'])
+
+def pricing():
+    return current_app.extensions['pricing']
+
+# flags expired bundles every BUNDLE_SWEEP_INTERVAL seconds; started per process on its first request
+@package.before_app_request
+def start_expiry_sweeper():
+    interval = current_app.config['BUNDLE_SWEEP_INTERVAL']
+    if interval:
+        expiry_sweeper.start(interval)
+
+def search_args():
+    """Package.search() keyword arguments from the query string; raises ValueError on bad input.
+
+    Parameters: q (full text), prefix (start of the hotel name), min_duration, max_duration,
+    min_cost, max_cost, page and page_size.
+    """
+    args = {'text': request.args.get('q', '').strip() or None,
+            'prefix': request.args.get('prefix', '').strip() or None}
+    try:
+        for name, convert in (('min_duration', int), ('max_duration', int), ('min_cost', float), ('max_cost', float)):
+            value = request.args.get(name, '').strip()
+            args[name] = convert(value) if value else None
+    except ValueError:
+        raise ValueError("min_duration and max_duration must be integers, min_cost and max_cost numbers")
+    try:
+        args['page'] = int(request.args.get('page') or 1)
+        args['page_size'] = int(request.args.get('page_size') or current_app.config['PAGE_SIZE'])
+    except ValueError:
+        raise ValueError("page and page_size must be integers")
+    if args['page'] < 1 or args['page_size'] < 1:
+        raise ValueError("page and page_size must be at least 1")
+    return args
+
+def searching():
+    return any(request.args.get(name) for name in ('q', 'prefix', 'min_duration', 'max_duration', 'min_cost', 'max_cost'))
+
 @package.route('/')
 @package.route('/packages')
 def packages():
-    all_packages = Package.getAllPackages()
-    return render_template('packages.html', panel="Package", all_packages=all_packages)
+    """The catalogue, or one page of search results when any search parameter is given."""
+    if not searching():
+        all_packages = Package.getAllPackages()
+        return render_template('packages.html', panel="Package", all_packages=all_packages)
+    try:
+        args = search_args()
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('packageController.packages'))
+    results, has_next = Package.search(**args)
+    return render_template('packages.html', panel="Package", all_packages=results, search=args, has_next=has_next)
+
+@package.route('/packages/search')
+def searchPackages():
+    """JSON: one page of packages matching the search parameters (see search_args)."""
+    try:
+        args = search_args()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    results, has_next = Package.search(**args)
+    packages = [{'hotel_name': p.hotel_name, 'duration': p.duration, 'unit_cost': p.unit_cost,
+                 'package_cost': p.packageCost(), 'image_url': p.image_url, 'description': p.description}
+                for p in results]
+    return jsonify(page=args['page'], page_size=min(args['page_size'], Package.MAX_PAGE_SIZE), has_next=has_next, packages=packages)
+
+@package.route('/packages/suggest')
+def suggestPackages():
+    """JSON: hotel names starting with `prefix`, for typeahead. Cacheable so repeated keystrokes stay local."""
+    prefix = request.args.get('prefix', '').strip()
+    try:
+        limit = max(1, min(int(request.args.get('limit') or Package.SUGGEST_LIMIT), Package.MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify(error='limit must be an integer'), 400
+    response = jsonify(prefix=prefix, suggestions=Package.suggest(prefix, limit))
+    response.headers['Cache-Control'] = f"public, max-age={current_app.config['SUGGEST_CACHE_SECONDS']}"
+    return response
+
+@package.route('/packageCacheStats')
+@login_required
+def packageCacheStats():
+    """Hit/miss counters of this worker's package catalog cache (admin only)."""
+    if not current_user.isAdmin():
+        return jsonify(error='Admin only'), 403
+    return jsonify(Package.cacheStats())
 
 @package.route("/viewPackageDetail/<hotel_name>")
 def viewPackageDetail(hotel_name):
@@ -30,9 +115,9 @@ def bundlePurchase():
         flash('Please select packages to buy as a bundle')
         return redirect(url_for('packageController.packages'))
 
-    # Retrieve package objects, ignore invalid names
-    packages = [Package.getPackage(hotel_name=h) for h in selected]
-    packages = [p for p in packages if p]
+    # Resolve all selected packages in one lookup, ignore invalid names, and price the bundle
+    quote = pricing().quote(selected)
+    packages = quote.packages
     if not packages:
         flash('Selected packages not found.')
         return redirect(url_for('packageController.packages'))
@@ -40,21 +125,12 @@ def bundlePurchase():
     # Persist bundle purchase (unlimited per day, purchased_date auto set)
     BundlePurchase.create(customer=current_user, packages=packages)
 
-    # Pricing + Discount messaging (retain existing logic: discount only when >=2)
-    total = sum(p.unit_cost * p.duration for p in packages)
+    # Pricing + Discount messaging (discount tiers come from BUNDLE_DISCOUNT_TIERS)
+    total = quote.list_price
+    discount_rate = quote.discount_rate
+    discounted_total = quote.total
     package_names = ", ".join(p.hotel_name for p in packages)
 
-    count = len(packages)
-    # Determine discount tier
-    if count == 1:
-        discount_rate = 0.0
-    elif 2 <= count <= 3:
-        discount_rate = 0.10
-    else:  # 4 or more
-        discount_rate = 0.20
-
-    discounted_total = total * (1 - discount_rate)
-
     if discount_rate == 0:
         msg = (
             f'No discount for bundle purchase for {package_names}.<br>'
@@ -69,12 +145,54 @@ def bundlePurchase():
     flash(Markup(msg))
     return redirect(url_for('packageController.packages'))
 
+@package.route('/bundleQuote', methods=['POST'])
+def bundleQuote():
+    """Price candidate bundles without buying them.
+
+    Body: {"hotel_names": [...]} for one bundle or {"bundles": [[...], [...]]} for up to
+    BUNDLE_QUOTE_LIMIT of them.
+    """
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return jsonify(error='Expected a JSON object'), 400
+    bundles = body['bundles'] if 'bundles' in body else [body.get('hotel_names', [])]
+    if not isinstance(bundles, list) or not all(
+            isinstance(names, list) and all(isinstance(h, str) for h in names) for names in bundles):
+        return jsonify(error='Expected "hotel_names" as a list of names or "bundles" as a list of such lists'), 400
+    limit = current_app.config['BUNDLE_QUOTE_LIMIT']
+    if len(bundles) > limit:
+        return jsonify(error=f'At most {limit} bundles per request'), 400
+    quotes = [q.to_dict() for q in pricing().quote_many(bundles)]
+    if 'bundles' in body:
+        return jsonify(quotes=quotes)
+    return jsonify(quotes[0])
+
 @package.route('/myBundles')
 @login_required
 def myBundles():
     """List bundles purchased by current user."""
-    bundles = BundlePurchase.getByUser(current_user).order_by('purchased_date')
-    return render_template('packages.html', panel="My Bundle Purchases", all_packages=Package.getAllPackages(), bundles=bundles)
+    page = BundlePurchase.getByUser(current_user._get_current_object(), prefetch_refs=True,
+                                    page_size=current_app.config['PAGE_SIZE'],
+                                    after=request.args.get('after'), before=request.args.get('before'))
+    return render_template('packages.html', panel="My Bundle Purchases", all_packages=Package.getAllPackages(), bundles=page.items, page=page)
+
+@package.route('/expiringBundles')
+@login_required
+def expiringBundles():
+    """Admin: unexpired bundles expiring in the next `days` days (default 30) with un-utilised items.
+
+    Query: days, min_unutilised (default 1), limit
+    """
+    if not current_user.isAdmin():
+        return jsonify(error='Admin only'), 403
+    try:
+        days = int(request.args.get('days', 30))
+        min_unutilised = int(request.args.get('min_unutilised', 1))
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+    except ValueError:
+        return jsonify(error='days, min_unutilised and limit must be integers'), 400
+    bundles = BundlePurchase.getExpiring(days=days, min_unutilised=min_unutilised, limit=limit)
+    return jsonify(days=days, count=len(bundles), bundles=bundles)
 
 @package.route('/manageBundle')
 @login_required
@@ -86,14 +204,16 @@ def manageBundle():
     - If no purchased bundles, shows the empty-state message in the template
     """
     # Restrict to non-admin users (assignment requirement mirrors other non-admin functions)
-    if getattr(current_user, 'name', '') == 'Admin':
+    if current_user.isAdmin():
         flash('This is a non-admin function. Please log in as a non-admin user to use this function.')
         return redirect(url_for('packageController.packages'))
 
-    bundles = BundlePurchase.getByUser(current_user).order_by('purchased_date')
+    page = BundlePurchase.getByUser(current_user._get_current_object(), prefetch_refs=True,
+                                    page_size=current_app.config['PAGE_SIZE'],
+                                    after=request.args.get('after'), before=request.args.get('before'))
     # Prepare enriched bundle data for template (expiry logic handled in model helpers, but we expose stamp)
     enriched = []
-    for b in bundles:
+    for b in page.items:
         enriched.append({
             'obj': b,
             'purchase_date': b.purchased_date,
@@ -101,4 +221,4 @@ def manageBundle():
             'expired': b.is_expired,
             'packages': b.bundledPackages
         })
-    return render_template('manageBundle.html', panel='Manage Bundles', bundles=enriched)
+    return render_template('manageBundle.html', panel='Manage Bundles', bundles=enriched, page=page)
@@ -0,0 +1,23 @@
+from flask import Blueprint, render_template, send_from_directory, current_app, abort
+from flask_login import login_required, current_user
+
+from models import profiler
+
+profile = Blueprint('profileController', __name__)
+
+@profile.before_request
+@login_required
+def admin_only():
+    if not current_user.isAdmin():
+        abort(403)
+
+@profile.route('/profiles')
+def profiles():
+    captures = profiler.list_captures(current_app.config['PROFILE_DIR'])
+    return render_template('profiles.html', captures=captures, panel="Profiles",
+                           header=profiler.HEADER, query_flag=profiler.QUERY_FLAG)
+
+@profile.route('/profiles/<name>')
+def download_profile(name):
+    # send_from_directory refuses names that would leave PROFILE_DIR
+    return send_from_directory(current_app.config['PROFILE_DIR'], name, as_attachment=True)
@@ -1,20 +1,113 @@
 from models.users import User
-from models.package import Package
+from models.package import Package, CatalogVersion
+from models.rollup import BookingRollup
+from models.prefetch import prefetch
+from models.pagination import keyset_page
 from app import db
 from mongoengine.queryset.visitor import Q
+from pymongo import UpdateMany
+import datetime as dt
+
+
+class BookingConflict(Exception):
+    """Raised when a stay would overlap another booking of the same package by the same customer."""
+
 
 class Booking(db.Document):
     
-    meta = {'collection': 'booking'}
+    meta = {
+        'collection': 'booking',
+        'indexes': [
+            # (customer, check_in_date) serves getBookingsByEmail, getUserBookingsFromDate and getBooking
+            # as a prefix; the trailing _id gives keyset pagination its (check_in_date, _id) order
+            ('customer', 'check_in_date', 'id'),
+            # overlap queries: customer and package equality, then only stays ending after the range
+            # start are scanned
+            ('customer', 'package', 'check_out_date', 'check_in_date'),
+            # incremental refresh of the analytics snapshot
+            'modified_at',
+        ],
+    }
+
+    # CatalogVersion bumped on every delete: the analytics snapshot reloads instead of catching up
+    DELETES_VERSION = 'booking-deletes'
+
     check_in_date = db.DateTimeField(required=True)
+    # check_in_date + package.duration days, stored so overlap checks are pure index range queries
+    check_out_date = db.DateTimeField()
     customer = db.ReferenceField(User)
     package = db.ReferenceField(Package)
     total_cost = db.FloatField()
-    
-    def calculate_total_cost(self):
-        self.total_cost = self.package.duration * self.package.unit_cost
-        self.save()
+    # set by every write path; the analytics snapshot (models/snapshot.py) reads what changed since its last refresh
+    modified_at = db.DateTimeField()
 
+    @staticmethod
+    def stayDates(check_in_date, package):
+        """(check_in, check_out) datetimes for a stay; check_in_date may be a 'YYYY-MM-DD' string."""
+        check_in = Booking._fields['check_in_date'].to_mongo(check_in_date)
+        return check_in, check_in + dt.timedelta(days=package.duration)
+
+    @staticmethod
+    def hasConflict(customer, package, check_in, check_out, exclude_id=None):
+        """True if another booking of package by customer overlaps [check_in, check_out).
+
+        A package is sold to any number of customers; only one customer's own stays of it must not
+        overlap. The check and the write that follows are two operations, so two concurrent
+        requests from the same customer can still both pass it.
+        """
+        bookings = Booking.objects(customer=customer, package=package, check_out_date__gt=check_in, check_in_date__lt=check_out)
+        if exclude_id is not None:
+            bookings = bookings.filter(id__ne=exclude_id)
+        return bookings.only('id').first() is not None
+
+    @staticmethod
+    def getBookedPackageIds(customer, from_date, to_date, packages):
+        """Ids of the packages customer has at least one stay of overlapping [from_date, to_date)."""
+        overlapping = Booking.objects(customer=customer, package__in=list(packages),
+                                      check_out_date__gt=from_date, check_in_date__lt=to_date)
+        # distinct on the raw collection: ids only, without dereferencing each package
+        return set(Booking._get_collection().distinct('package', overlapping._query))
+
+    @staticmethod
+    def getAvailability(customer, from_date, to_date):
+        """[(package, available), ...] for the whole catalog over [from_date, to_date) for customer, in one query."""
+        packages = Package.getAllPackages()
+        booked = Booking.getBookedPackageIds(customer, from_date, to_date, packages)
+        return [(p, p.id not in booked) for p in packages]
+
+    @staticmethod
+    def recomputeTotals(packages=None):
+        """Refresh total_cost and check_out_date of bookings whose package cost or duration changed.
+
+        One UpdateMany per package, all sent in a single bulk_write; only bookings whose stored
+        total_cost or check_out_date differs from what the package now gives are touched (the cost
+        can stay the same while the duration changes). Returns the number modified.
+        """
+        packages = Package.getAllPackages() if packages is None else packages
+        ops = []
+        for p in packages:
+            check_out_date = {'$add': ['$check_in_date', p.duration * 24 * 3600 * 1000]}
+            stale = {'$or': [{'total_cost': {'$ne': p.packageCost()}},
+                             {'$expr': {'$ne': ['$check_out_date', check_out_date]}}]}
+            ops.append(UpdateMany({'package': p.id, **stale},
+                                  [{'$set': {'total_cost': p.packageCost(), 'modified_at': '$$NOW',
+                                             'check_out_date': check_out_date}}]))
+        if not ops:
+            return 0
+        return Booking._get_collection().bulk_write(ops, ordered=False).modified_count
+
+    @staticmethod
+    def backfillCheckOutDates():
+        """Set check_out_date on bookings missing it: one update_many per package. Returns the count."""
+        updated = 0
+        collection = Booking._get_collection()
+        for package in Package.getAllPackages():
+            result = collection.update_many(
+                {'package': package.id, 'check_out_date': None},
+                [{'$set': {'check_out_date': {'$add': ['$check_in_date', package.duration * 24 * 3600 * 1000]}}}])
+            updated += result.modified_count
+        return updated
+    
     @staticmethod
     def getBookingsByEmail(email):
         customer = User.getUser(email)
@@ -25,16 +118,37 @@ class Booking(db.Document):
     @staticmethod
     def getAllBookings():
         return Booking.objects()           
-            
+
     @staticmethod
-    def createBooking(check_in_date, customer, package):
-        booking = Booking(check_in_date=check_in_date, customer=customer, package=package).save()
-        booking.calculate_total_cost()
+    def createBooking(check_in_date, customer, package, check_conflicts=True):
+        check_in, check_out = Booking.stayDates(check_in_date, package)
+        if check_conflicts and Booking.hasConflict(customer, package, check_in, check_out):
+            raise BookingConflict(f"You already have {package.hotel_name} booked between {check_in:%d/%m/%Y} and {check_out:%d/%m/%Y}")
+        # total_cost comes from the already-resolved package, so the booking is written once
+        booking = Booking(check_in_date=check_in, check_out_date=check_out, customer=customer, package=package,
+                          total_cost=package.packageCost(), modified_at=dt.datetime.utcnow()).save()
+        BookingRollup.record(package.hotel_name, booking.check_in_date, booking.total_cost)
         return booking
               
     @staticmethod
-    def getUserBookingsFromDate(customer, from_date):
-        return Booking.objects(Q(customer = customer) & Q(check_in_date__gte = from_date))
+    def getUserBookingsFromDate(customer, from_date, prefetch_refs=False, page_size=None, after=None, before=None):
+        """Bookings of customer from from_date on, ordered by (check_in_date, _id) in Mongo.
+
+        With prefetch_refs=True returns a list whose package and customer references are already
+        resolved (one query per collection) instead of a QuerySet.
+        With page_size set returns a pagination.Page of at most page_size bookings following the
+        `after` cursor (or preceding the `before` cursor); its items are prefetched the same way.
+        """
+        bookings = Booking.objects(Q(customer = customer) & Q(check_in_date__gte = from_date))
+        if page_size:
+            page = keyset_page(bookings, 'check_in_date', after=after, before=before, page_size=page_size)
+            if prefetch_refs:
+                prefetch(page.items, 'package', 'customer', known=[customer])
+            return page
+        bookings = bookings.order_by('check_in_date', 'id')
+        if prefetch_refs:
+            return prefetch(bookings, 'package', 'customer', known=[customer])
+        return bookings
                
 
     @staticmethod
@@ -43,11 +157,21 @@ class Booking(db.Document):
         return Booking.objects(Q(customer = customer) & Q(check_in_date = check_in_date) & Q(package = package)).first()
 
     @staticmethod
-    def updateBooking(old_check_in_date, new_check_in_date, customer, hotel_name):
+    def updateBooking(old_check_in_date, new_check_in_date, customer, hotel_name, check_conflicts=True):
         booking = Booking.getBooking(old_check_in_date, customer, hotel_name)
         if booking:
-            booking.check_in_date = new_check_in_date
-            return booking.save()
+            old_date = booking.check_in_date
+            package = Package.getPackage(hotel_name)
+            check_in, check_out = Booking.stayDates(new_check_in_date, package)
+            if check_conflicts and Booking.hasConflict(customer, package, check_in, check_out, exclude_id=booking.id):
+                raise BookingConflict(f"You already have {hotel_name} booked between {check_in:%d/%m/%Y} and {check_out:%d/%m/%Y}")
+            booking.check_in_date = check_in
+            booking.check_out_date = check_out
+            booking.modified_at = dt.datetime.utcnow()
+            booking = booking.save()
+            BookingRollup.recordMany([(hotel_name, old_date, booking.total_cost, -1),
+                                      (hotel_name, check_in, booking.total_cost, 1)])
+            return booking
             
 
     @staticmethod
@@ -55,4 +179,6 @@ class Booking(db.Document):
         booking = Booking.getBooking(check_in_date, customer, hotel_name)
         if booking:
             booking.delete()
+            CatalogVersion.bump(Booking.DELETES_VERSION)
+            BookingRollup.record(hotel_name, booking.check_in_date, booking.total_cost, -1)
         return booking
\ No newline at end of file
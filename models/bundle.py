@@ -1,7 +1,18 @@
 from app import db
 from models.users import User
 from models.package import Package
+from models.prefetch import prefetch
+from models.pagination import keyset_page
+from bson import ObjectId
+from bson.errors import InvalidId
+from mongoengine.queryset.visitor import Q
 import datetime as dt
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
 
 
 class BundledPackage(db.EmbeddedDocument):
@@ -22,13 +33,28 @@ class BundlePurchase(db.Document):
     - A bundle expires one year after its purchased_date.
     - Packages must be booked before expiry; otherwise they are considered expired.
     - Once an embedded package is booked we mark it utilised=True.
+
+    expires_at is stored at purchase (backfillExpiry() sets it on older bundles) and expired is
+    flagged in bulk by sweepExpired(), so queries can range over an index. A bundle counts as
+    expired when it is flagged or its expiry_date has passed: the flag lags the clock by up to one
+    sweep interval and is never set on bundles without expires_at.
     """
 
-    meta = {"collection": "bundlePurchases"}
+    # A bundle expires one year after purchase
+    VALIDITY = dt.timedelta(days=365)
+
+    meta = {
+        "collection": "bundlePurchases",
+        # getByUser filters on customer and sorts (and paginates) on (purchased_date, _id);
+        # sweepExpired and getExpiring range over expires_at among the unexpired bundles
+        "indexes": [("customer", "purchased_date", "id"), ("expired", "expires_at")],
+    }
 
     purchased_date = db.DateTimeField(required=True, default=lambda: dt.datetime.utcnow())
     customer = db.ReferenceField(User, required=True)
     bundledPackages = db.ListField(db.EmbeddedDocumentField(BundledPackage))
+    expires_at = db.DateTimeField()
+    expired = db.BooleanField(default=False)
 
     @staticmethod
     def create(customer: User, packages: list[Package]):
@@ -40,42 +66,160 @@ class BundlePurchase(db.Document):
         if not customer or not packages:
             raise ValueError("customer and packages are required")
         items = [BundledPackage(package=p, utilised=False) for p in packages]
-        bundle = BundlePurchase(customer=customer, bundledPackages=items)
+        now = dt.datetime.utcnow()
+        bundle = BundlePurchase(customer=customer, bundledPackages=items, purchased_date=now,
+                                expires_at=now + BundlePurchase.VALIDITY)
         return bundle.save()
 
     @staticmethod
-    def getByUser(customer: User):
-        return BundlePurchase.objects(customer=customer)
+    def getByUser(customer: User, prefetch_refs=False, page_size=None, after=None, before=None):
+        """Bundles of customer, ordered by (purchased_date, _id) in Mongo.
+
+        With prefetch_refs=True returns a list whose customer and bundled package references are
+        resolved with one query per collection.
+        With page_size set returns a pagination.Page of at most page_size bundles following the
+        `after` cursor (or preceding the `before` cursor); its items are prefetched the same way.
+        """
+        bundles = BundlePurchase.objects(customer=customer)
+        paths = ('customer', 'bundledPackages.package')
+        if page_size:
+            page = keyset_page(bundles, 'purchased_date', after=after, before=before, page_size=page_size)
+            if prefetch_refs:
+                prefetch(page.items, *paths, known=[customer])
+            return page
+        bundles = bundles.order_by('purchased_date', 'id')
+        if prefetch_refs:
+            return prefetch(bundles, *paths, known=[customer])
+        return bundles
+
+    @staticmethod
+    def redeem(bundle_id, package_id, customer: User = None):
+        """Atomically mark one un-utilised item for package_id in an unexpired bundle as utilised.
+
+        A single conditional positional update: it only matches while the bundle is unexpired
+        (and belongs to customer, if given) and still holds an un-utilised item for the package,
+        so of two concurrent redemptions exactly one wins.
+        Returns True if this call redeemed the item, False otherwise.
+        """
+        try:
+            bundle_id, package_id = ObjectId(bundle_id), ObjectId(package_id)
+        except (InvalidId, TypeError):
+            return False
+        now = dt.datetime.utcnow()
+        # the same rule as is_expired: not flagged and before expiry_date, which for bundles not
+        # backfilled yet is computed from their purchase date
+        unexpired = Q(expired__ne=True) & (Q(expires_at__gt=now) | (Q(expires_at=None) & Q(purchased_date__gt=now - BundlePurchase.VALIDITY)))
+        bundles = BundlePurchase.objects(unexpired, pk=bundle_id,
+                                         bundledPackages__match={'package': package_id, 'utilised': False})
+        if customer is not None:
+            bundles = bundles.filter(customer=customer)
+        return bundles.update_one(set__bundledPackages__S__utilised=True) == 1
+
+    @staticmethod
+    def unredeem(bundle_id, package_id, customer: User = None):
+        """Give back an item taken by redeem(), when the booking it paid for could not be made.
+
+        The mirror of redeem(): one conditional positional update that flips a utilised item for
+        package_id back, whether or not the bundle has expired since.
+        Returns True if an item was given back.
+        """
+        try:
+            bundle_id, package_id = ObjectId(bundle_id), ObjectId(package_id)
+        except (InvalidId, TypeError):
+            return False
+        bundles = BundlePurchase.objects(pk=bundle_id, bundledPackages__match={'package': package_id, 'utilised': True})
+        if customer is not None:
+            bundles = bundles.filter(customer=customer)
+        return bundles.update_one(set__bundledPackages__S__utilised=False) == 1
 
     @staticmethod
     def mark_package_utilised(bundle_id, package_id):
         """Mark a specific packaged item in a bundle as utilised.
 
-        Returns the updated document or None if not found.
+        Kept for existing callers; see redeem(). Returns True if an item was redeemed.
         """
-        bundle: BundlePurchase = BundlePurchase.objects(pk=bundle_id).first()
-        if not bundle:
-            return None
-        for bp in bundle.bundledPackages:
-            if str(bp.package.id) == str(package_id):
-                bp.utilised = True
-        return bundle.save()
+        return BundlePurchase.redeem(bundle_id, package_id)
+
+    @staticmethod
+    def backfillExpiry():
+        """Set expires_at on bundles missing it, in one update_many. Returns the count."""
+        result = BundlePurchase._get_collection().update_many(
+            {'expires_at': None},
+            [{'$set': {'expires_at': {'$add': ['$purchased_date', BundlePurchase.VALIDITY // dt.timedelta(milliseconds=1)]},
+                       'expired': {'$ifNull': ['$expired', False]}}}])
+        return result.modified_count
+
+    @staticmethod
+    def sweepExpired(now=None):
+        """Flag every bundle past its expires_at as expired, in one update_many. Returns the count."""
+        now = now or dt.datetime.utcnow()
+        return BundlePurchase.objects(expired=False, expires_at__lte=now).update(set__expired=True)
+
+    @staticmethod
+    def getExpiring(days=30, now=None, min_unutilised=1, limit=None):
+        """Unexpired bundles whose expires_at falls in the next `days` days, soonest first.
+
+        The number of un-utilised items is counted in the aggregation and bundles with fewer than
+        min_unutilised are left out. Returns dicts with bundle_id, customer_id, email, name,
+        purchased_date, expires_at, items and unutilised.
+        """
+        now = now or dt.datetime.utcnow()
+        pipeline = [
+            {'$match': {'expired': False, 'expires_at': {'$gt': now, '$lte': now + dt.timedelta(days=days)}}},
+            {'$project': {'customer': 1, 'purchased_date': 1, 'expires_at': 1,
+                          'items': {'$size': '$bundledPackages'},
+                          'unutilised': {'$size': {'$filter': {'input': '$bundledPackages',
+                                                               'cond': {'$eq': ['$$this.utilised', False]}}}}}},
+            {'$match': {'unutilised': {'$gte': min_unutilised}}},
+            {'$sort': {'expires_at': 1, '_id': 1}},
+        ]
+        if limit:
+            pipeline.append({'$limit': limit})
+        pipeline += [
+            {'$lookup': {'from': User._get_collection_name(), 'localField': 'customer',
+                         'foreignField': '_id', 'as': 'user'}},
+            {'$unwind': {'path': '$user', 'preserveNullAndEmptyArrays': True}},
+            {'$project': {'_id': 0, 'bundle_id': {'$toString': '$_id'}, 'customer_id': {'$toString': '$customer'},
+                          'email': '$user.email', 'name': '$user.name', 'purchased_date': 1, 'expires_at': 1,
+                          'items': 1, 'unutilised': 1}},
+        ]
+        return list(BundlePurchase.objects.aggregate(pipeline))
+
+    @staticmethod
+    def expiredExpression(now=None):
+        """Aggregation expression for is_expired: flagged, or expiry_date (expires_at, else
+        purchased_date + VALIDITY) at or before now."""
+        now = now or dt.datetime.utcnow()
+        expiry_date = {'$ifNull': ['$expires_at', {'$add': ['$purchased_date',
+                                                            BundlePurchase.VALIDITY // dt.timedelta(milliseconds=1)]}]}
+        return {'$or': [{'$eq': ['$expired', True]}, {'$lte': [expiry_date, now]}]}
+
+    @staticmethod
+    def itemStatusExpression(now=None):
+        """Aggregation expression for the status of an unwound `$bundledPackages` item.
+
+        The package_status() rules: 'utilised', then 'expired' when the bundle is expired (see
+        expiredExpression), else 'un-utilised'.
+        """
+        return {'$switch': {'branches': [
+            {'case': {'$eq': ['$bundledPackages.utilised', True]}, 'then': 'utilised'},
+            {'case': BundlePurchase.expiredExpression(now), 'then': 'expired'},
+        ], 'default': 'un-utilised'}}
 
     # ---- Expiry helpers ----
     @property
     def expiry_date(self):
-        """Expiry is exactly one calendar year (365 days) from purchase."""
+        """Stored expires_at; computed from purchased_date for bundles not backfilled yet."""
+        if self.expires_at:
+            return self.expires_at
         if not self.purchased_date:
             return None
-        return self.purchased_date + dt.timedelta(days=365)
+        return self.purchased_date + BundlePurchase.VALIDITY
 
     @property
     def is_expired(self):
-        exp = self.expiry_date
-        if exp is None:
-            return False
-        # Compare in UTC
-        return dt.datetime.utcnow() > exp
+        """Flagged by sweepExpired(), or past expiry_date before the sweeper has got to it."""
+        return bool(self.expired) or (self.expiry_date is not None and self.expiry_date <= dt.datetime.utcnow())
 
     def package_status(self, embedded_pkg: BundledPackage):
         """Return status string for a packaged item based on utilisation and expiry.
@@ -89,3 +233,37 @@ class BundlePurchase(db.Document):
         if self.is_expired:
             return 'Expired'
         return 'Un-utilised'
+
+
+class ExpirySweeper:
+    """Runs BundlePurchase.sweepExpired() every `interval` seconds on a daemon thread.
+
+    One thread per process: start() is cheap to call on every request and starts the thread the
+    first time it is called in a process, including in each worker after a fork.
+    """
+
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self, interval):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, args=(interval,), name='bundle-expiry-sweeper', daemon=True).start()
+
+    def _run(self, interval):
+        while True:
+            try:
+                flagged = BundlePurchase.sweepExpired()
+                if flagged:
+                    log.info("bundle expiry sweep flagged=%d", flagged)
+            except Exception:
+                log.exception("bundle expiry sweep failed")
+            time.sleep(interval)
+
+
+expiry_sweeper = ExpirySweeper()
@@ -0,0 +1,40 @@
+"""In-process publish/subscribe for booking changes.
+
+BookingRollup publishes here after every write it applies, so anything that needs to follow
+bookings (the live dashboard) subscribes instead of polling Mongo. Events are dicts:
+
+- {'type': 'buckets', 'keys': [(period, hotel_name, bucket), ...]}: rollup buckets that changed
+- {'type': 'reset'}: the rollups were rebuilt; followers should reload everything
+
+Callbacks run synchronously on the writer's thread, so they must be cheap and must not block.
+Only writes made by this process are seen; see models/live.py for following other processes.
+"""
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = ()
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers = self._subscribers + (callback,)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not callback)
+
+    def publish(self, event):
+        # the tuple is replaced, never mutated, so it can be iterated without the lock
+        for callback in self._subscribers:
+            try:
+                callback(event)
+            except Exception:
+                log.exception("change feed subscriber failed event=%s", event.get('type'))
+
+
+booking_changes = ChangeFeed()
@@ -0,0 +1,325 @@
+"""Seeded synthetic datasets for load and scale testing.
+
+Rows come out of generators in the same CSV formats /upload accepts (see models/importer.py), so
+write_csvs() and load() never hold the users or bookings: only the package catalogue, a per-day
+weight table and the last check-out of each (customer, package) pair drawn so far are kept, which
+is bounded by users x packages whatever the booking volume.
+
+- The same seed always produces the same rows. Users and packages each draw from their own random
+  stream, so changing the booking volume does not change them; bookings and booking lists are
+  drawn together, in check-in order
+- Stays follow the booking rules: one customer's stays of one package never overlap, across both
+  booking files, so the CSVs import without "overlaps an existing booking" skips (count_overlaps()
+  checks written CSVs for this)
+- Customer i is user{i}@synth.abc.com, so bookings can reference users without storing them
+- Hotel popularity and customer activity are skewed: index = n * u ** skew for uniform u, so a
+  skew of 1 is uniform and larger values concentrate rows on the first hotels and customers
+- Check-in dates follow the Singapore holiday seasons (June and November-December peaks,
+  busier Fridays and Saturdays)
+"""
+from models.users import User
+from models.package import Package, CatalogVersion, catalog_cache
+from models.book import Booking
+from models.rollup import BookingRollup
+
+from werkzeug.security import generate_password_hash
+from bson import ObjectId
+from itertools import accumulate, islice
+import bisect
+import csv
+import datetime as dt
+import json
+import os
+import random
+
+PASSWORD = '12345'
+EMAIL_DOMAIN = 'synth.abc.com'
+DEFAULT_START = dt.date(2022, 1, 1)
+
+# CSV file name and header for each /upload datatype, named like the samples in assets/js/
+FILES = {
+    'Users': ('users.csv', ['email', 'password', 'name']),
+    'Package': ('staycation.csv', ['hotel_name', 'duration', 'unit_cost', 'image_url', 'description']),
+    'Booking': ('booking.csv', ['check_in_date', 'customer', 'hotel_name']),
+    'ListOfBooking': ('listofbooking.csv', ['check_in_date', 'customer', 'hotel_names']),
+}
+
+FIRST_NAMES = ('Wei Ling', 'Muhammad', 'Priya', 'John', 'Mei Hua', 'Arjun', 'Siti', 'Daniel', 'Hui Min',
+               'Rajesh', 'Nurul', 'Peter', 'Xin Yi', 'Ahmad', 'Kavitha', 'Marcus')
+LAST_NAMES = ('Tan', 'Lim', 'Ng', 'Lee', 'Wong', 'Ong', 'Goh', 'Chua', 'Koh', 'Teo', 'Rahman', 'Kumar',
+              'Ismail', 'Pillai', 'Lennon', 'Fernandez')
+BRANDS = ('Shangri-La', 'Capella', 'Raffles', 'Marina', 'Orchard', 'Fullerton', 'Sentosa', 'Carlton',
+          'Peninsula', 'Straits', 'Parkroyal', 'Harbour', 'Lagoon', 'Emerald', 'Lotus', 'Jade')
+PLACES = ('Bay', 'Quay', 'Gardens', 'Heights', 'Cove', 'Park', 'Point', 'Hill', 'Riverside', 'Beach')
+IMAGES = ('https://bit.ly/3Ifjcn6', 'https://bit.ly/3Ideiaa')
+# relative check-in volume per month (school holidays in June and from mid-November)
+MONTH_WEIGHTS = (0.8, 0.9, 1.0, 0.9, 1.0, 1.6, 1.1, 1.0, 1.1, 0.9, 1.3, 1.8)
+WEEKDAY_WEIGHTS = (0.8, 0.8, 0.9, 1.0, 1.3, 1.4, 1.0)
+
+
+def _rng(seed, datatype):
+    return random.Random(f"{seed}:{datatype}")
+
+
+def _skewed(rng, n, skew):
+    """Index in [0, n) biased towards 0 by `skew` (1 = uniform)."""
+    return min(n - 1, int(n * rng.random() ** skew))
+
+
+def user_email(i):
+    return f"user{i}@{EMAIL_DOMAIN}"
+
+
+def hotel_name(i):
+    brand = BRANDS[i % len(BRANDS)]
+    place = PLACES[(i // len(BRANDS)) % len(PLACES)]
+    cycle = i // (len(BRANDS) * len(PLACES))
+    return f"{brand} {place}" + (f" {cycle + 1}" if cycle else "")
+
+
+def user_rows(count, seed=0):
+    rng = _rng(seed, 'Users')
+    for i in range(count):
+        yield [user_email(i), PASSWORD, f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"]
+
+
+def package_rows(count, seed=0):
+    rng = _rng(seed, 'Package')
+    for i in range(count):
+        duration = rng.randint(1, 4)
+        name = hotel_name(i)
+        yield [name, duration, f"{rng.randrange(150, 900, 10):.2f}", rng.choice(IMAGES),
+               f"Enjoy a {duration}-night staycation at {name} with breakfast for two."]
+
+
+class _Calendar:
+    """Seasonal check-in volume over `days` days starting at `start`."""
+
+    def __init__(self, start, days):
+        self.start = start
+        dates = [start + dt.timedelta(days=d) for d in range(days)]
+        self._cumulative = list(accumulate(MONTH_WEIGHTS[d.month - 1] * WEEKDAY_WEIGHTS[d.weekday()] for d in dates))
+
+    def spread(self, count):
+        """The number of check-ins on each day, in date order: `count` split by the day weights."""
+        total = self._cumulative[-1]
+        previous = 0
+        for offset, cumulative in enumerate(self._cumulative):
+            upto = round(cumulative / total * count)
+            yield self.start + dt.timedelta(days=offset), upto - previous
+            previous = upto
+
+
+class _StayPlanner:
+    """Draws customers and packages for stays whose check-in days come in date order.
+
+    Keeps the last check-out of every (customer, package) pair drawn so far; a stay starting at
+    or after it cannot overlap any earlier stay of that pair, so the drawn stays satisfy
+    Booking.hasConflict() without remembering them. Draws that would overlap are redrawn.
+    """
+
+    MAX_TRIES = 1000
+
+    def __init__(self, rng, users, durations, skew):
+        self.rng = rng
+        self.users = users
+        self.durations = durations
+        self.skew = skew
+        self._check_out = {}
+
+    def draw(self, day, hotels=1):
+        """(customer, [package, ...]) for `hotels` back-to-back stays from day, in the order the
+        importer books them (by hotel name)."""
+        for _ in range(self.MAX_TRIES):
+            customer = _skewed(self.rng, self.users, self.skew)
+            packages = {_skewed(self.rng, len(self.durations), self.skew) for _ in range(hotels)}
+            packages = sorted(packages, key=hotel_name)
+            check_in, stays = day, []
+            for package in packages:
+                if self._check_out.get((customer, package), day) > check_in:
+                    break
+                check_out = check_in + dt.timedelta(days=self.durations[package])
+                stays.append(((customer, package), check_out))
+                check_in = check_out
+            else:
+                self._check_out.update(stays)
+                return customer, packages
+        raise ValueError("cannot place more stays without overlapping ones; use more users, packages or days")
+
+
+def stays(users, packages, bookings=0, booking_lists=0, seed=0, start=DEFAULT_START, days=730, skew=2.0):
+    """(datatype, check-in date, customer index, [package index, ...]) in check-in order.
+
+    datatype is 'Booking' (one package) or 'ListOfBooking' (2 to 4 packages stayed at back to back).
+    """
+    rng = _rng(seed, 'Booking')
+    durations = [int(duration) for _, duration, _, _, _ in package_rows(packages, seed)]
+    planner = _StayPlanner(rng, users, durations, skew)
+    calendar = _Calendar(start, days)
+    for (day, n_bookings), (_, n_lists) in zip(calendar.spread(bookings), calendar.spread(booking_lists)):
+        for _ in range(n_bookings):
+            yield ('Booking', day) + planner.draw(day)
+        for _ in range(n_lists):
+            yield ('ListOfBooking', day) + planner.draw(day, rng.randint(2, 4))
+
+
+def booking_rows(count, users, packages, seed=0, booking_lists=0, **dates):
+    for datatype, day, customer, hotels in stays(users, packages, count, booking_lists, seed, **dates):
+        if datatype == 'Booking':
+            yield [f"{day:%Y-%m-%d}", user_email(customer), hotel_name(hotels[0])]
+
+
+def booking_list_rows(count, users, packages, seed=0, bookings=0, **dates):
+    for datatype, day, customer, hotels in stays(users, packages, bookings, count, seed, **dates):
+        if datatype == 'ListOfBooking':
+            yield [f"{day:%d/%m/%Y}", user_email(customer), json.dumps([hotel_name(h) for h in hotels])]
+
+
+def rows(datatype, users=0, packages=0, bookings=0, booking_lists=0, seed=0, **dates):
+    """The row generator for one datatype. `dates` takes start, days and skew."""
+    if datatype == 'Users':
+        return user_rows(users, seed)
+    if datatype == 'Package':
+        return package_rows(packages, seed)
+    if datatype == 'Booking':
+        return booking_rows(bookings, users, packages, seed, booking_lists, **dates)
+    if datatype == 'ListOfBooking':
+        return booking_list_rows(booking_lists, users, packages, seed, bookings, **dates)
+    raise ValueError(f"unknown datatype: {datatype}")
+
+
+def write_csvs(out_dir, users, packages, bookings, booking_lists=0, seed=0, **dates):
+    """Stream each non-empty datatype to its CSV in out_dir. Returns {path: rows written}."""
+    if (bookings or booking_lists) and not (users and packages):
+        raise ValueError("bookings need at least one user and one package")
+    os.makedirs(out_dir, exist_ok=True)
+    counts = {'Users': users, 'Package': packages, 'Booking': bookings, 'ListOfBooking': booking_lists}
+    written = {}
+    for datatype, (file_name, header) in FILES.items():
+        if not counts[datatype]:
+            continue
+        path = os.path.join(out_dir, file_name)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(header)
+            writer.writerows(rows(datatype, users, packages, bookings, booking_lists, seed, **dates))
+        written[path] = counts[datatype]
+    return written
+
+
+def _csv_stays(out_dir, durations):
+    """(customer, [(hotel, check-in, check-out), ...]) of each row of the booking CSVs in out_dir,
+    in the order /upload imports them; stays are back to back from the row's check-in."""
+    for datatype, date_format in (('Booking', '%Y-%m-%d'), ('ListOfBooking', '%d/%m/%Y')):
+        path = os.path.join(out_dir, FILES[datatype][0])
+        if not os.path.exists(path):
+            continue
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                hotels = [row['hotel_name']] if datatype == 'Booking' else json.loads(row['hotel_names'])
+                stays, day = [], dt.datetime.strptime(row['check_in_date'], date_format)
+                for hotel in hotels:
+                    stays.append((hotel, day, day + dt.timedelta(days=durations[hotel])))
+                    day = stays[-1][2]
+                yield row['customer'], stays
+
+
+def count_overlaps(out_dir):
+    """Rows of the booking CSVs in out_dir that /upload would skip as overlapping an earlier stay
+    of the same customer and package, whatever order the rows are in."""
+    with open(os.path.join(out_dir, FILES['Package'][0]), newline='', encoding='utf-8') as f:
+        durations = {row['hotel_name']: int(row['duration']) for row in csv.DictReader(f)}
+    # Accepted stays never overlap within a (customer, package), so sorted by check-in they are
+    # also sorted by check-out and the only candidate is the last one starting before the new end.
+    starts, ends = {}, {}
+    overlaps = 0
+    for customer, stays in _csv_stays(out_dir, durations):
+        slots = []
+        for hotel, s_new, e_new in stays:
+            key = (customer, hotel)
+            i = bisect.bisect_left(starts.setdefault(key, []), e_new)
+            if i and ends[key][i - 1] > s_new:
+                break
+            slots.append((key, i, s_new, e_new))
+        else:
+            for key, i, s_new, e_new in slots:
+                starts[key].insert(i, s_new)
+                ends.setdefault(key, []).insert(i, e_new)
+            continue
+        overlaps += 1
+    return overlaps
+
+
+def _object_id(kind, i):
+    """Stable ObjectId for synthetic row i of a kind, so bookings can reference it without a lookup."""
+    return ObjectId(f"5e000000{kind:02x}{i:014x}")
+
+
+def _insert(collection, docs, batch_size):
+    docs = iter(docs)
+    inserted = 0
+    while True:
+        batch = list(islice(docs, batch_size))
+        if not batch:
+            return inserted
+        collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+
+
+def load(users, packages, bookings, seed=0, batch_size=10000, drop=False, progress=None, **dates):
+    """Bulk-insert a generated dataset straight into Mongo. Returns {datatype: documents inserted}.
+
+    Documents are written exactly as the importer would write them (hashed password, booking
+    check_out_date and total_cost), with one insert_many per batch_size rows, and the dashboard
+    rollups are rebuilt at the end. The bookings are those of write_csvs() without booking lists.
+    With drop=True the users, packages, bookings and rollups are
+    removed first; otherwise loading the same dataset twice fails on duplicate keys.
+    `progress`, if given, is called with (datatype, documents inserted so far) after each datatype.
+    """
+    if bookings and not (users and packages):
+        raise ValueError("bookings need at least one user and one package")
+    if drop:
+        for model in (User, Package, Booking, BookingRollup):
+            model.drop_collection()
+        # the analytics snapshot cannot catch up with a dropped collection; make it reload
+        CatalogVersion.bump(Booking.DELETES_VERSION)
+        for model in (User, Package, Booking):
+            model.ensure_indexes()
+
+    # every synthetic user has the same password, so hash it once
+    password = generate_password_hash(PASSWORD, method='sha256')
+    counts = {}
+    counts['Users'] = _insert(User._get_collection(), (
+        {'_id': _object_id(1, i), 'email': email, 'password': password, 'name': name, 'avatar': ''}
+        for i, (email, _, name) in enumerate(user_rows(users, seed))), batch_size)
+    if progress:
+        progress('Users', counts['Users'])
+
+    catalogue = [(int(duration), float(unit_cost)) for _, duration, unit_cost, _, _ in package_rows(packages, seed)]
+    counts['Package'] = _insert(Package._get_collection(), (
+        {'_id': _object_id(2, i), 'hotel_name': name, 'search_name': name.lower(), 'duration': int(duration),
+         'unit_cost': float(unit_cost), 'image_url': image_url, 'description': description}
+        for i, (name, duration, unit_cost, image_url, description) in enumerate(package_rows(packages, seed))),
+        batch_size)
+    # insert_many bypasses Package.save, so invalidate the catalog cache here
+    catalog_cache.invalidate()
+    if progress:
+        progress('Package', counts['Package'])
+
+    loaded_at = dt.datetime.utcnow()
+
+    def booking_docs():
+        # same draws as booking_rows(), but keeping indexes instead of formatting names
+        for _, day, customer, (package,) in stays(users, packages, bookings, 0, seed, **dates):
+            check_in = dt.datetime.combine(day, dt.time())
+            duration, unit_cost = catalogue[package]
+            yield {'check_in_date': check_in, 'check_out_date': check_in + dt.timedelta(days=duration),
+                   'customer': _object_id(1, customer), 'package': _object_id(2, package),
+                   'total_cost': unit_cost * duration, 'modified_at': loaded_at}
+
+    counts['Booking'] = _insert(Booking._get_collection(), booking_docs(), batch_size)
+    if progress:
+        progress('Booking', counts['Booking'])
+    if counts['Booking']:
+        BookingRollup.rebuild()
+    return counts
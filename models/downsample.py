@@ -0,0 +1,49 @@
+"""Shape-preserving downsampling of chart series.
+
+lttb() implements Largest-Triangle-Three-Buckets (Steinarsson, 2013): the first and last points
+are kept, the rest of the series is cut into threshold - 2 equal buckets, and from each bucket the
+point forming the largest triangle with the point kept before it and the average of the next
+bucket is kept. Peaks and troughs survive, unlike with plain averaging or taking every nth point,
+and the result is a subset of the original points, so every value plotted is a real one.
+"""
+import datetime as dt
+
+
+def _x(value):
+    return value.timestamp() if isinstance(value, dt.datetime) else value
+
+
+def lttb(points, threshold):
+    """At most `threshold` of the (x, y) points, in order. x may be a number or a datetime.
+
+    Series already within the threshold, and thresholds below 3, return the points unchanged.
+    """
+    points = list(points)
+    if threshold < 3 or len(points) <= threshold:
+        return points
+    xs = [_x(x) for x, _ in points]
+    ys = [float(y or 0) for _, y in points]
+
+    sampled = [points[0]]
+    every = (len(points) - 2) / (threshold - 2)
+    kept = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        # average of the next bucket (the last point for the final bucket)
+        next_start, next_end = end, min(int((i + 2) * every) + 1, len(points))
+        if next_start >= next_end:
+            next_start, next_end = len(points) - 1, len(points)
+        avg_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        ax, ay = xs[kept], ys[kept]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        kept = best
+    sampled.append(points[-1])
+    return sampled
@@ -0,0 +1,165 @@
+"""Streaming CSV/NDJSON export of bookings and bundle purchases.
+
+Documents are read through one server-side cursor with `batch_size` documents per round trip,
+projected to the fields the export needs. Each batch's customer and package references are
+resolved together (one `$in` query for the users, the package catalog cache for the hotels)
+and rendered into one chunk of output, so memory use is bounded by the batch size, not by the
+number of rows exported.
+
+Formats
+- csv: bookings as check_in_date, customer, hotel_name, check_out_date, total_cost. The first
+  three columns are the /upload Booking format, which ignores the extra columns, so an export
+  can be uploaded again as is. Bundles as one row per bundled package.
+- ndjson: one JSON object per line, one per booking or per bundle (with its items).
+"""
+from models.users import User
+from models.package import Package
+from models.book import Booking
+from models.bundle import BundlePurchase
+
+from itertools import islice
+import csv
+import datetime as dt
+import io
+import json
+
+FORMATS = ('csv', 'ndjson')
+DEFAULT_BATCH_SIZE = 2000
+
+BOOKING_FIELDS = ['check_in_date', 'customer', 'hotel_name', 'check_out_date', 'total_cost']
+BUNDLE_FIELDS = ['bundle_id', 'purchased_date', 'expiry_date', 'customer', 'hotel_name', 'status']
+
+
+def _batches(cursor, batch_size):
+    while True:
+        batch = list(islice(cursor, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _emails(user_ids):
+    """{user_id: email} for one batch, in one query."""
+    users = User.objects(pk__in=list(set(user_ids))).only('email').as_pymongo()
+    return {u['_id']: u['email'] for u in users}
+
+
+def _day(value):
+    return f"{value:%Y-%m-%d}" if value else ''
+
+
+def _render(rows, fmt, fields):
+    """One output chunk for a batch of row dicts."""
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        csv.DictWriter(buffer, fields, extrasaction='ignore').writerows(rows)
+    else:
+        for row in rows:
+            buffer.write(json.dumps(row, default=str))
+            buffer.write('\n')
+    return buffer.getvalue()
+
+
+def _header(fields):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(fields)
+    return buffer.getvalue()
+
+
+def booking_filter(hotel_names=None, date_from=None, date_to=None):
+    """Raw query for bookings of the named hotels checking in between date_from and date_to (inclusive).
+
+    Returns None if hotel_names names no existing hotel.
+    """
+    query = {}
+    if hotel_names:
+        packages = Package.getPackages(hotel_names)
+        if not packages:
+            return None
+        query['package'] = {'$in': [p.id for p in packages.values()]}
+    if date_from or date_to:
+        query['check_in_date'] = {}
+        if date_from:
+            query['check_in_date']['$gte'] = dt.datetime.combine(date_from, dt.time())
+        if date_to:
+            query['check_in_date']['$lt'] = dt.datetime.combine(date_to + dt.timedelta(days=1), dt.time())
+    return query
+
+
+def export_bookings(fmt='csv', hotel_names=None, date_from=None, date_to=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Generate the booking export as text chunks, one per batch."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format: {fmt}")
+    if fmt == 'csv':
+        yield _header(BOOKING_FIELDS)
+    query = booking_filter(hotel_names, date_from, date_to)
+    if query is None:
+        return
+    projection = {'check_in_date': 1, 'check_out_date': 1, 'customer': 1, 'package': 1, 'total_cost': 1}
+    cursor = Booking._get_collection().find(query, projection, batch_size=batch_size)
+    try:
+        for batch in _batches(cursor, batch_size):
+            emails = _emails(b['customer'] for b in batch)
+            packages = Package.getPackagesByIds({b['package'] for b in batch})
+            rows = []
+            for b in batch:
+                package = packages.get(b['package'])
+                email = emails.get(b['customer'])
+                if package is None or email is None:
+                    # dangling reference: the row could not be imported again
+                    continue
+                rows.append({
+                    'check_in_date': _day(b['check_in_date']),
+                    'customer': email,
+                    'hotel_name': package.hotel_name,
+                    'check_out_date': _day(b.get('check_out_date')),
+                    'total_cost': b.get('total_cost'),
+                })
+            yield _render(rows, fmt, BOOKING_FIELDS)
+    finally:
+        cursor.close()
+
+
+def _item_status(utilised, expired):
+    if utilised:
+        return 'utilised'
+    return 'expired' if expired else 'un-utilised'
+
+
+def export_bundles(fmt='csv', batch_size=DEFAULT_BATCH_SIZE):
+    """Generate the bundle purchase export as text chunks, one per batch."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format: {fmt}")
+    if fmt == 'csv':
+        yield _header(BUNDLE_FIELDS)
+    now = dt.datetime.utcnow()
+    projection = {'purchased_date': 1, 'expires_at': 1, 'expired': 1, 'customer': 1, 'bundledPackages': 1}
+    cursor = BundlePurchase._get_collection().find({}, projection, batch_size=batch_size)
+    try:
+        for batch in _batches(cursor, batch_size):
+            emails = _emails(b['customer'] for b in batch)
+            packages = Package.getPackagesByIds({i['package'] for b in batch for i in b.get('bundledPackages', [])})
+            rows = []
+            for b in batch:
+                expiry = b.get('expires_at') or b['purchased_date'] + BundlePurchase.VALIDITY
+                expired = b.get('expired') or expiry <= now
+                items = []
+                for item in b.get('bundledPackages', []):
+                    package = packages.get(item['package'])
+                    items.append({
+                        'hotel_name': package.hotel_name if package else None,
+                        'status': _item_status(item.get('utilised'), expired),
+                    })
+                bundle = {
+                    'bundle_id': str(b['_id']),
+                    'purchased_date': _day(b['purchased_date']),
+                    'expiry_date': _day(expiry),
+                    'customer': emails.get(b['customer']),
+                }
+                if fmt == 'csv':
+                    rows.extend(dict(bundle, **item) for item in items)
+                else:
+                    rows.append(dict(bundle, items=items))
+            yield _render(rows, fmt, BUNDLE_FIELDS)
+    finally:
+        cursor.close()
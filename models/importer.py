@@ -0,0 +1,351 @@
+"""Streaming, batched CSV importer behind the /upload endpoint.
+
+Rows are read straight off the uploaded stream in chunks of `batch_size`. For each chunk the
+referenced customers are resolved with one `$in` query and hotels through the package catalog
+cache (one `$in` query for any misses), booking costs are computed in memory, and the new
+documents are written with a single insert_many. Memory use is bounded by the batch size, not
+by the size of the file.
+
+Bookings that would overlap another stay of the same package by the same customer (one already
+booked, or an earlier row of the upload) are skipped, like Booking.createBooking refuses them; the
+existing stays a chunk could clash with are read in one query.
+
+Every insert_many is unordered, so a document the server rejects (a user or hotel name inserted
+meanwhile by a concurrent import hits the unique index) does not stop the others: its row is
+counted as skipped with the reason, and the import carries on with the next chunk.
+
+Supported datatypes (CSV headers):
+- Users: email, password, name
+- Package: hotel_name, duration, unit_cost, image_url, description
+- Booking: check_in_date (YYYY-MM-DD), customer (email), hotel_name
+- ListOfBooking: check_in_date (DD/MM/YYYY or YYYY-MM-DD), customer (email), hotel_names (JSON array)
+"""
+from models.users import User
+from models.package import Package, CatalogVersion, catalog_cache
+from models.book import Booking
+from models.rollup import BookingRollup
+
+from werkzeug.security import generate_password_hash
+from pymongo.errors import BulkWriteError
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import islice
+import csv
+import io
+import json
+import datetime as dt
+
+DATATYPES = ('Users', 'Package', 'Booking', 'ListOfBooking')
+DEFAULT_BATCH_SIZE = 1000
+DUPLICATE_KEY = 11000
+# Only the first few skipped rows are kept verbatim; the rest are only counted by reason
+MAX_SKIP_SAMPLES = 50
+
+
+class ImportResult:
+    """Running totals for one import.
+
+    - rows: CSV rows read so far
+    - imported: rows that produced at least one document
+    - skipped: rows that produced nothing
+    - documents: documents written (a ListOfBooking row can create several bookings)
+    - skip_reasons: Counter of reason -> number of rows
+    - skip_samples: [(line_number, reason), ...] for the first MAX_SKIP_SAMPLES skipped rows
+    """
+
+    def __init__(self, datatype):
+        self.datatype = datatype
+        self.rows = 0
+        self.imported = 0
+        self.skipped = 0
+        self.documents = 0
+        self.skip_reasons = Counter()
+        self.skip_samples = []
+
+    def skip(self, line, reason):
+        self.skipped += 1
+        self.skip_reasons[reason] += 1
+        if len(self.skip_samples) < MAX_SKIP_SAMPLES:
+            self.skip_samples.append((line, reason))
+
+    def to_dict(self):
+        return {
+            'datatype': self.datatype,
+            'rows': self.rows,
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'documents': self.documents,
+            'skip_reasons': dict(self.skip_reasons),
+            'skip_samples': self.skip_samples,
+        }
+
+
+def import_csv(stream, datatype, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Import a CSV from a binary or text stream. Returns an ImportResult.
+
+    `progress`, if given, is called with the ImportResult after every batch.
+    """
+    if datatype not in DATATYPES:
+        raise ValueError(f"unknown datatype: {datatype}")
+    wrapped = not isinstance(stream, io.TextIOBase)
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='') if wrapped else stream
+    reader = csv.DictReader(text, delimiter=',', quotechar='"')
+    result = ImportResult(datatype)
+    handler = _HANDLERS[datatype]
+
+    line = 1  # header
+    try:
+        while True:
+            chunk = list(islice(reader, batch_size))
+            if not chunk:
+                break
+            numbered = [(line + i + 1, row) for i, row in enumerate(chunk)]
+            line += len(chunk)
+            result.rows += len(chunk)
+            handler(numbered, result)
+            if progress:
+                progress(result)
+    finally:
+        if wrapped:
+            # leave the caller's binary stream open; closing it is the caller's job
+            text.detach()
+    return result
+
+
+def _resolve_users(emails):
+    """{email: user_id} for the emails that exist, in one query."""
+    users = User.objects(email__in=list(set(emails))).only('id', 'email').as_pymongo()
+    return {u['email']: u['_id'] for u in users}
+
+
+def _parse_date(raw, formats):
+    raw = (raw or '').strip()
+    for fmt in formats:
+        try:
+            return dt.datetime.strptime(raw, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _booking_doc(check_in_date, customer_id, package):
+    return {
+        'check_in_date': check_in_date,
+        'check_out_date': check_in_date + dt.timedelta(days=package.duration),
+        'customer': customer_id,
+        'package': package.id,
+        'total_cost': package.packageCost(),
+        'modified_at': dt.datetime.utcnow(),
+    }
+
+
+class _BookedStays:
+    """The stays a chunk of new bookings could overlap, per (customer, package): existing bookings
+    within the chunk's dates, loaded in one query, plus the bookings accepted from the chunk so far."""
+
+    def __init__(self, docs):
+        self._stays = {}
+        docs = list(docs)
+        if not docs:
+            return
+        query = {'customer': {'$in': list({d['customer'] for d in docs})},
+                 'package': {'$in': list({d['package'] for d in docs})},
+                 'check_out_date': {'$gt': min(d['check_in_date'] for d in docs)},
+                 'check_in_date': {'$lt': max(d['check_out_date'] for d in docs)}}
+        projection = {'customer': 1, 'package': 1, 'check_in_date': 1, 'check_out_date': 1}
+        for doc in Booking._get_collection().find(query, projection):
+            self.add(doc)
+
+    @staticmethod
+    def _key(doc):
+        return doc['customer'], doc['package']
+
+    def add(self, doc):
+        insort(self._stays.setdefault(self._key(doc), []), (doc['check_in_date'], doc['check_out_date']))
+
+    def conflicts(self, doc):
+        """True if doc overlaps a stay of its customer and package, as Booking.hasConflict() would find."""
+        stays = self._stays.get(self._key(doc), [])
+        # one customer's stays of one package do not overlap each other, so only the last one
+        # starting before doc's check-out can reach past its check-in
+        i = bisect_left(stays, (doc['check_out_date'],))
+        return i > 0 and stays[i - 1][1] > doc['check_in_date']
+
+
+def _insert_many(collection, docs, duplicate):
+    """insert_many(ordered=False) of docs. Returns {index in docs: skip reason} of those rejected."""
+    try:
+        collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        return {error['index']: duplicate if error['code'] == DUPLICATE_KEY else f"write error {error['code']}"
+                for error in e.details['writeErrors']}
+    return {}
+
+
+def _insert_rows(collection, docs, lines, result, duplicate):
+    """Insert one document per row (lines[i] is the CSV line of docs[i]) and count the outcome."""
+    if not docs:
+        return 0
+    failed = _insert_many(collection, docs, duplicate)
+    for i, reason in failed.items():
+        result.skip(lines[i], reason)
+    result.imported += len(docs) - len(failed)
+    result.documents += len(docs) - len(failed)
+    return len(docs) - len(failed)
+
+
+def _insert_bookings(docs, result):
+    """Insert [(line, doc, hotel_name), ...], already counted as imported rows.
+
+    A row whose bookings are not all written is counted as skipped instead and the bookings it
+    did get are deleted again, so a booking list row stays all or nothing.
+    """
+    if not docs:
+        return
+    failed = _insert_many(Booking._get_collection(), [d for _, d, _ in docs], 'booking rejected')
+    lines = {}
+    for i, reason in failed.items():
+        lines.setdefault(docs[i][0], reason)
+    written = [(d, hotel_name) for line, d, hotel_name in docs if line not in lines]
+    orphans = [d['_id'] for i, (line, d, _) in enumerate(docs) if line in lines and i not in failed]
+    if orphans:
+        Booking._get_collection().delete_many({'_id': {'$in': orphans}})
+        CatalogVersion.bump(Booking.DELETES_VERSION)
+    for line, reason in lines.items():
+        result.imported -= 1
+        result.skip(line, reason)
+    result.documents += len(written)
+    BookingRollup.recordMany((hotel_name, d['check_in_date'], d['total_cost'], 1) for d, hotel_name in written)
+
+
+def _import_users(rows, result):
+    existing = _resolve_users(row.get('email', '').strip() for _, row in rows)
+    docs, lines = [], []
+    for line, row in rows:
+        email = row.get('email', '').strip()
+        if not email or not row.get('password'):
+            result.skip(line, 'missing email or password')
+            continue
+        if email in existing:
+            result.skip(line, 'user already exists')
+            continue
+        existing[email] = None
+        lines.append(line)
+        docs.append({
+            'email': email,
+            'password': generate_password_hash(row['password'], method='sha256'),
+            'name': row.get('name', ''),
+            'avatar': '',
+        })
+    _insert_rows(User._get_collection(), docs, lines, result, 'user already exists')
+
+
+def _import_packages(rows, result):
+    known = Package.getPackages(row.get('hotel_name', '').strip() for _, row in rows)
+    docs, lines = [], []
+    for line, row in rows:
+        hotel_name = row.get('hotel_name', '').strip()
+        if not hotel_name:
+            result.skip(line, 'missing hotel_name')
+            continue
+        if hotel_name in known:
+            result.skip(line, 'package already exists')
+            continue
+        try:
+            package = Package(hotel_name=hotel_name, duration=int(row['duration']),
+                              unit_cost=float(row['unit_cost']), image_url=row.get('image_url', ''),
+                              description=row.get('description', ''))
+            package.validate()
+        except Exception:
+            result.skip(line, 'invalid package fields')
+            continue
+        known[hotel_name] = package
+        lines.append(line)
+        docs.append(package.to_mongo().to_dict())
+    if _insert_rows(Package._get_collection(), docs, lines, result, 'package already exists'):
+        # insert_many bypasses Package.save, so invalidate the catalog cache here
+        catalog_cache.invalidate()
+
+
+def _import_bookings(rows, result):
+    users = _resolve_users(row.get('customer', '').strip() for _, row in rows)
+    known = Package.getPackages(row.get('hotel_name', '').strip() for _, row in rows)
+    candidates = []
+    for line, row in rows:
+        check_in_date = _parse_date(row.get('check_in_date'), ("%Y-%m-%d",))
+        if not check_in_date:
+            result.skip(line, 'invalid check_in_date')
+            continue
+        customer_id = users.get(row.get('customer', '').strip())
+        package = known.get(row.get('hotel_name', '').strip())
+        if not customer_id or not package:
+            result.skip(line, 'unknown customer or package')
+            continue
+        candidates.append((line, _booking_doc(check_in_date, customer_id, package), package.hotel_name))
+    booked = _BookedStays(doc for _, doc, _ in candidates)
+    docs = []
+    for line, doc, hotel_name in candidates:
+        if booked.conflicts(doc):
+            result.skip(line, 'overlaps an existing booking')
+            continue
+        booked.add(doc)
+        docs.append((line, doc, hotel_name))
+        result.imported += 1
+    _insert_bookings(docs, result)
+
+
+def _parse_hotel_list(raw):
+    raw = (raw or '').strip()
+    try:
+        return json.loads(raw.replace("'", '"'))
+    except Exception:
+        return [h.strip().strip('"').strip("'") for h in raw.split(',') if h.strip()]
+
+
+def _import_booking_lists(rows, result):
+    users = _resolve_users(row.get('customer', '').strip() for _, row in rows)
+    parsed = [(line, row, _parse_hotel_list(row.get('hotel_names'))) for line, row in rows]
+    known = Package.getPackages(h for _, _, hotels in parsed for h in hotels)
+    candidates = []
+    for line, row, hotels in parsed:
+        check_in_date = _parse_date(row.get('check_in_date'), ("%d/%m/%Y", "%Y-%m-%d"))
+        if not check_in_date:
+            result.skip(line, 'invalid check_in_date')
+            continue
+        customer_id = users.get(row.get('customer', '').strip())
+        if not customer_id:
+            result.skip(line, 'unknown customer')
+            continue
+        # sequential stays: each hotel starts where the previous one ended
+        current_date = check_in_date
+        stays = []
+        for hotel in hotels:
+            package = known.get(hotel)
+            if not package:
+                continue
+            stays.append((_booking_doc(current_date, customer_id, package), hotel))
+            current_date = current_date + dt.timedelta(days=package.duration)
+        if stays:
+            candidates.append((line, stays))
+        else:
+            result.skip(line, 'no known packages in hotel_names')
+    booked = _BookedStays(doc for _, stays in candidates for doc, _ in stays)
+    docs = []
+    for line, stays in candidates:
+        # a row is one itinerary: it is imported whole or not at all
+        if any(booked.conflicts(doc) for doc, _ in stays):
+            result.skip(line, 'overlaps an existing booking')
+            continue
+        for doc, _ in stays:
+            booked.add(doc)
+        docs.extend((line, doc, hotel) for doc, hotel in stays)
+        result.imported += 1
+    _insert_bookings(docs, result)
+
+
+_HANDLERS = {
+    'Users': _import_users,
+    'Package': _import_packages,
+    'Booking': _import_bookings,
+    'ListOfBooking': _import_booking_lists,
+}
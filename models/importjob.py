@@ -0,0 +1,148 @@
+from app import db
+from models import importer
+from mongoengine.errors import ValidationError
+from concurrent.futures import ThreadPoolExecutor
+import datetime as dt
+import os
+import threading
+import uuid
+
+
+class ImportJob(db.Document):
+    """A CSV upload imported in the background.
+
+    The upload is spooled to disk and handed to a small per-process thread pool, so the web worker
+    that received it returns immediately. Progress is written to this document after every batch,
+    which lets any worker process answer a status poll.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    meta = {'collection': 'importJobs', 'indexes': ['-created_date']}
+
+    datatype = db.StringField(required=True, choices=importer.DATATYPES)
+    filename = db.StringField()
+    path = db.StringField()
+    status = db.StringField(default=QUEUED, choices=(QUEUED, RUNNING, DONE, FAILED))
+    error = db.StringField()
+    created_date = db.DateTimeField(default=lambda: dt.datetime.utcnow())
+    started_date = db.DateTimeField()
+    finished_date = db.DateTimeField()
+    bytes_total = db.IntField(default=0)
+    bytes_done = db.IntField(default=0)
+    rows = db.IntField(default=0)
+    imported = db.IntField(default=0)
+    skipped = db.IntField(default=0)
+    documents = db.IntField(default=0)
+    skip_reasons = db.DictField()
+    skip_samples = db.ListField()
+
+    @staticmethod
+    def submit(file, datatype, spool_dir, batch_size=importer.DEFAULT_BATCH_SIZE, max_workers=2):
+        """Spool an uploaded FileStorage to spool_dir and queue it. Returns the saved ImportJob."""
+        if datatype not in importer.DATATYPES:
+            raise ValueError(f"unknown datatype: {datatype}")
+        os.makedirs(spool_dir, exist_ok=True)
+        path = os.path.join(spool_dir, f"{uuid.uuid4().hex}.csv")
+        file.save(path)
+        job = ImportJob(datatype=datatype, filename=file.filename, path=path,
+                        bytes_total=os.path.getsize(path)).save()
+        _get_executor(max_workers).submit(_run, job.id, batch_size)
+        return job
+
+    @staticmethod
+    def getJob(job_id):
+        try:
+            return ImportJob.objects(pk=job_id).first()
+        except ValidationError:
+            return None
+
+    @staticmethod
+    def getRecentJobs(limit=20):
+        return ImportJob.objects.order_by('-created_date').limit(limit)
+
+    @property
+    def elapsed_seconds(self):
+        if not self.started_date:
+            return 0.0
+        end = self.finished_date or dt.datetime.utcnow()
+        return max((end - self.started_date).total_seconds(), 0.0)
+
+    def to_dict(self):
+        """Progress report for the status endpoint, with throughput and an ETA estimated from bytes read."""
+        elapsed = self.elapsed_seconds
+        throughput = self.rows / elapsed if elapsed else 0.0
+        eta = None
+        if self.status == ImportJob.RUNNING and self.bytes_done and self.bytes_total:
+            eta = elapsed * (self.bytes_total - self.bytes_done) / self.bytes_done
+        elif self.status == ImportJob.DONE:
+            eta = 0.0
+        return {
+            'id': str(self.id),
+            'datatype': self.datatype,
+            'filename': self.filename,
+            'status': self.status,
+            'error': self.error,
+            'rows': self.rows,
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'documents': self.documents,
+            'skip_reasons': self.skip_reasons,
+            'skip_samples': self.skip_samples,
+            'percent': round(100.0 * self.bytes_done / self.bytes_total, 1) if self.bytes_total else 0.0,
+            'elapsed_seconds': round(elapsed, 1),
+            'rows_per_second': round(throughput, 1),
+            'eta_seconds': None if eta is None else round(eta, 1),
+        }
+
+
+# One pool per process, created on first use so pre-forking servers do not share it
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='import-job')
+        return _executor
+
+
+def _forget_executor():
+    # worker threads do not survive fork; a child that inherited a pool builds its own
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_executor)
+
+
+def _run(job_id, batch_size):
+    job = ImportJob.getJob(job_id)
+    if not job:
+        return
+    ImportJob.objects(pk=job_id).update_one(set__status=ImportJob.RUNNING, set__started_date=dt.datetime.utcnow())
+    try:
+        with open(job.path, 'rb') as f:
+            def progress(result):
+                ImportJob.objects(pk=job_id).update_one(
+                    set__bytes_done=f.tell(), set__rows=result.rows, set__imported=result.imported,
+                    set__skipped=result.skipped, set__documents=result.documents,
+                    set__skip_reasons=dict(result.skip_reasons), set__skip_samples=result.skip_samples)
+
+            importer.import_csv(f, job.datatype, batch_size=batch_size, progress=progress)
+        ImportJob.objects(pk=job_id).update_one(set__status=ImportJob.DONE, set__bytes_done=job.bytes_total,
+                                                set__finished_date=dt.datetime.utcnow())
+    except Exception as e:
+        ImportJob.objects(pk=job_id).update_one(set__status=ImportJob.FAILED, set__error=str(e),
+                                                set__finished_date=dt.datetime.utcnow())
+    finally:
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
@@ -0,0 +1,130 @@
+"""Index audit for the model query helpers.
+
+Every hot query helper is called below with representative arguments inside
+querycapture.capture(), and each find, aggregate, count, distinct, update and delete it sends is
+explained exactly as sent: the same filter, sort and pipeline, including the keyset pagination
+cursors and the rollup and KPI aggregations. audit() reports the stages of each winning plan, so
+a helper that falls back to a collection scan (COLLSCAN) is caught before it reaches production.
+Run it with `flask audit-indexes`.
+
+- A helper may name collections it is expected to read whole (the KPI facets, the catalog read
+  by getAvailability); scans of those are reported but do not fail the audit
+- Write helpers are called with ids that match nothing, or (sweepExpired) with a date only
+  bundles it would flag anyway can match, so the audit leaves the data as it was
+- Helpers that look up a user or hotel before querying are given an existing one, if any
+"""
+from models.users import User
+from models.package import Package
+from models.book import Booking
+from models.bundle import BundlePurchase
+from models.rollup import BookingRollup
+from models.importjob import ImportJob
+from models.pagination import encode_cursor
+from models import kpi, querycapture
+
+from bson import ObjectId, SON
+import datetime as dt
+
+AUDITED_MODELS = (User, Package, Booking, BundlePurchase, BookingRollup, ImportJob)
+EXPLAINABLE = ('find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify')
+# fields the driver adds to a command that explain does not take
+DRIVER_FIELDS = ('lsid', '$db', '$clusterTime', '$readPreference', 'txnNumber', 'readConcern', 'writeConcern')
+
+
+def _helpers():
+    """(helper name, call, collections it may scan whole) for every audited helper."""
+    oid = ObjectId()
+    when = dt.datetime(2000, 1, 1)
+    until = when + dt.timedelta(days=7)
+    cursor = encode_cursor(when, oid)
+    email = (User.objects.only('email').as_pymongo().first() or {}).get('email', 'audit@example.com')
+    hotel_name = (Package.objects.only('hotel_name').as_pymongo().first() or {}).get('hotel_name', 'audit')
+    return [
+        ('User.getUser', lambda: User.getUser(email), ()),
+        ('User.getUserById', lambda: User.getUserById(oid), ()),
+        # a name that is never cached, so the lookup reaches Mongo
+        ('Package.getPackage', lambda: Package.getPackage(f'audit-{oid}'), ()),
+        ('Package.getPackagesByIds', lambda: Package.getPackagesByIds([oid]), ()),
+        ('Package.search', lambda: Package.search(text='audit'), ()),
+        ('Package.search (prefix)', lambda: Package.search(prefix='audit', min_cost=100), ()),
+        ('Package.search (filters)', lambda: Package.search(min_duration=3, max_duration=3, min_cost=100,
+                                                            max_cost=200, page=2), ()),
+        ('Package.suggest', lambda: Package.suggest('audit'), ()),
+        ('Booking.getBookingsByEmail', lambda: list(Booking.getBookingsByEmail(email)), ()),
+        ('Booking.getUserBookingsFromDate', lambda: list(Booking.getUserBookingsFromDate(oid, when)), ()),
+        ('Booking.getUserBookingsFromDate (first page)',
+         lambda: Booking.getUserBookingsFromDate(oid, when, page_size=20), ()),
+        ('Booking.getUserBookingsFromDate (next page)',
+         lambda: Booking.getUserBookingsFromDate(oid, when, page_size=20, after=cursor), ()),
+        ('Booking.getUserBookingsFromDate (previous page)',
+         lambda: Booking.getUserBookingsFromDate(oid, when, page_size=20, before=cursor), ()),
+        ('Booking.getBooking', lambda: Booking.getBooking(when, oid, hotel_name), ()),
+        ('Booking.hasConflict', lambda: Booking.hasConflict(oid, oid, when, until, exclude_id=oid), ()),
+        ('Booking.getAvailability', lambda: Booking.getAvailability(oid, when, until),
+         (Package._get_collection_name(),)),
+        ('BundlePurchase.getByUser', lambda: list(BundlePurchase.getByUser(oid)), ()),
+        ('BundlePurchase.getByUser (next page)', lambda: BundlePurchase.getByUser(oid, page_size=20, after=cursor), ()),
+        ('BundlePurchase.getByUser (previous page)',
+         lambda: BundlePurchase.getByUser(oid, page_size=20, before=cursor), ()),
+        ('BundlePurchase.redeem', lambda: BundlePurchase.redeem(oid, oid, customer=oid), ()),
+        ('BundlePurchase.sweepExpired', lambda: BundlePurchase.sweepExpired(now=when), ()),
+        ('BundlePurchase.getExpiring', lambda: BundlePurchase.getExpiring(now=when), ()),
+        *((f'BookingRollup.getBuckets ({granularity})',
+           lambda granularity=granularity: BookingRollup.getBuckets(granularity, when, until), ())
+          for granularity in BookingRollup.GRANULARITIES),
+        ('kpi.booking_kpis', kpi.booking_kpis, (Booking._get_collection_name(),)),
+        ('kpi.bundle_kpis', kpi.bundle_kpis, (BundlePurchase._get_collection_name(),)),
+        ('ImportJob.getRecentJobs', lambda: list(ImportJob.getRecentJobs()), ()),
+    ]
+
+
+def _winning_plans(explain):
+    """Every winningPlan in an explain() result: one for a find, one per $cursor of an aggregate."""
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == 'winningPlan':
+                yield value
+            else:
+                yield from _winning_plans(value)
+    elif isinstance(explain, list):
+        for item in explain:
+            yield from _winning_plans(item)
+
+
+def _stages(plan):
+    """All 'stage' names in an explain() plan, whatever the server's plan layout."""
+    if isinstance(plan, dict):
+        found = [plan['stage']] if isinstance(plan.get('stage'), str) else []
+        for value in plan.values():
+            found.extend(_stages(value))
+        return found
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in _stages(item)]
+    return []
+
+
+def _explain(database, command):
+    command = SON((key, value) for key, value in command.items() if key not in DRIVER_FIELDS)
+    return User._get_db().client[database].command('explain', command, verbosity='queryPlanner')
+
+
+def audit():
+    """Explain the queries of every audited helper.
+
+    Returns [(name, [stages], fails), ...] with one entry per query sent, named
+    'helper: collection.command', and fails set for a COLLSCAN the helper does not expect.
+    """
+    for model in AUDITED_MODELS:
+        model.ensure_indexes()
+    report = []
+    for helper, call, scanned in _helpers():
+        with querycapture.capture() as commands:
+            call()
+        queries = [(database, command) for database, command in commands if next(iter(command)) in EXPLAINABLE]
+        if not queries:
+            report.append((helper, ['(no query sent)'], False))
+        for database, command in queries:
+            name, collection = next(iter(command.items()))
+            stages = [stage for plan in _winning_plans(_explain(database, command)) for stage in _stages(plan)]
+            report.append((f"{helper}: {collection}.{name}", stages, 'COLLSCAN' in stages and collection not in scanned))
+    return report
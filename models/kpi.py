@@ -0,0 +1,114 @@
+"""Admin KPIs, each collection read in a single aggregation.
+
+booking_kpis() runs one `$facet` over `booking`: totals and average stay cost, revenue and
+bookings per hotel, and the top customers by revenue. bundle_kpis() runs one `$facet` over
+`bundlePurchases`: bundle and item totals, the utilised / un-utilised / expired split of the
+bundled items (BundlePurchase.itemStatusExpression, the package_status rules) and sell-through
+(utilised items over items sold) per hotel. Hotel and customer names are joined with `$lookup`
+after grouping, so each lookup runs once per hotel or top customer, not once per document.
+
+compute() combines both and caches the result per process for `ttl` seconds, so however large
+the collections grow, at most one pair of aggregations runs per worker per interval.
+"""
+from app import analytics_read_preference
+from models.users import User
+from models.package import Package
+from models.book import Booking
+from models.bundle import BundlePurchase
+
+import datetime as dt
+import threading
+import time
+
+TOP_CUSTOMERS = 10
+ITEM_STATUSES = ('utilised', 'un-utilised', 'expired')
+
+_lock = threading.Lock()
+_cached = {}
+
+
+def _hotel_lookup():
+    return [
+        {'$lookup': {'from': Package._get_collection_name(), 'localField': '_id',
+                     'foreignField': '_id', 'as': 'package'}},
+        {'$unwind': {'path': '$package', 'preserveNullAndEmptyArrays': True}},
+    ]
+
+
+def booking_kpis(top=TOP_CUSTOMERS):
+    """{'totals': {...}, 'hotels': [...], 'top_customers': [...]} in one aggregation."""
+    pipeline = [{'$facet': {
+        'totals': [
+            {'$group': {'_id': None, 'bookings': {'$sum': 1}, 'revenue': {'$sum': '$total_cost'},
+                        'avg_stay_cost': {'$avg': '$total_cost'}}},
+            {'$project': {'_id': 0}},
+        ],
+        'hotels': [
+            {'$group': {'_id': '$package', 'bookings': {'$sum': 1}, 'revenue': {'$sum': '$total_cost'},
+                        'avg_stay_cost': {'$avg': '$total_cost'}}},
+            *_hotel_lookup(),
+            {'$project': {'_id': 0, 'hotel_name': '$package.hotel_name', 'bookings': 1, 'revenue': 1,
+                          'avg_stay_cost': 1}},
+            {'$sort': {'revenue': -1, 'hotel_name': 1}},
+        ],
+        'top_customers': [
+            {'$group': {'_id': '$customer', 'bookings': {'$sum': 1}, 'revenue': {'$sum': '$total_cost'}}},
+            {'$sort': {'revenue': -1, '_id': 1}},
+            {'$limit': top},
+            {'$lookup': {'from': User._get_collection_name(), 'localField': '_id',
+                         'foreignField': '_id', 'as': 'user'}},
+            {'$unwind': {'path': '$user', 'preserveNullAndEmptyArrays': True}},
+            {'$project': {'_id': 0, 'email': '$user.email', 'name': '$user.name', 'bookings': 1, 'revenue': 1}},
+        ],
+    }}]
+    result = next(Booking.objects.read_preference(analytics_read_preference()).aggregate(pipeline, allowDiskUse=True))
+    totals = result['totals'][0] if result['totals'] else {'bookings': 0, 'revenue': 0.0, 'avg_stay_cost': None}
+    return {'totals': totals, 'hotels': result['hotels'], 'top_customers': result['top_customers']}
+
+
+def bundle_kpis(now=None):
+    """{'totals': {...}, 'items': {status: count}, 'hotels': [...]} in one aggregation."""
+    status = BundlePurchase.itemStatusExpression(now)
+    pipeline = [{'$facet': {
+        'totals': [
+            {'$group': {'_id': None, 'bundles': {'$sum': 1}, 'items': {'$sum': {'$size': '$bundledPackages'}}}},
+            {'$project': {'_id': 0}},
+        ],
+        'items': [
+            {'$unwind': '$bundledPackages'},
+            {'$group': {'_id': status, 'count': {'$sum': 1}}},
+        ],
+        'hotels': [
+            {'$unwind': '$bundledPackages'},
+            {'$group': {'_id': '$bundledPackages.package', 'sold': {'$sum': 1},
+                        'utilised': {'$sum': {'$cond': ['$bundledPackages.utilised', 1, 0]}}}},
+            *_hotel_lookup(),
+            {'$project': {'_id': 0, 'hotel_name': '$package.hotel_name', 'sold': 1, 'utilised': 1,
+                          'sell_through': {'$divide': ['$utilised', '$sold']}}},
+            {'$sort': {'sold': -1, 'hotel_name': 1}},
+        ],
+    }}]
+    result = next(BundlePurchase.objects.read_preference(analytics_read_preference()).aggregate(pipeline,
+                                                                                                allowDiskUse=True))
+    totals = result['totals'][0] if result['totals'] else {'bundles': 0, 'items': 0}
+    items = dict.fromkeys(ITEM_STATUSES, 0)
+    items.update({row['_id']: row['count'] for row in result['items']})
+    totals['sell_through'] = items['utilised'] / totals['items'] if totals['items'] else None
+    return {'totals': totals, 'items': items, 'hotels': result['hotels']}
+
+
+def compute(ttl=0, top=TOP_CUSTOMERS):
+    """Booking and bundle KPIs, reused for `ttl` seconds in this process (0 always recomputes)."""
+    with _lock:
+        entry = _cached.get(top)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+    kpis = {
+        'bookings': booking_kpis(top),
+        'bundles': bundle_kpis(),
+        'computed_at': dt.datetime.utcnow(),
+    }
+    if ttl:
+        with _lock:
+            _cached[top] = (time.monotonic() + ttl, kpis)
+    return kpis
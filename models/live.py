@@ -0,0 +1,270 @@
+"""Live dashboard: one shared copy of the booking rollups per process, streamed to every open dashboard.
+
+A hub thread keeps the recent day and month BookingRollup buckets in memory while at least one
+dashboard is connected, and pushes preformatted server-sent events to each client's queue:
+
+- snapshot: every non-empty bucket in the window, sent when a client connects, after a rebuild,
+  when the window moves on at midnight (UTC) and to a client that fell too far behind
+- update: the buckets in the window that changed since the last update, with their new totals
+
+The window is the trailing `window_days` days (LIVE_WINDOW_DAYS) for day buckets and `window_months`
+months (LIVE_WINDOW_MONTHS, including the current one) for month buckets, plus any later buckets of
+bookings checking in ahead, so the state and the snapshot stay bounded however much history there is.
+
+Two change sources (LIVE_FEED_SOURCE):
+
+- local (default): changefeed.booking_changes, fed by the Booking write paths of this process.
+  Changed bucket keys are collected and re-read together once per LIVE_FEED_INTERVAL, so a burst
+  of bookings costs one query however many dashboards are open. Writes made by other worker
+  processes are not seen until the next snapshot.
+- changestream: a Mongo change stream on bookingRollup (needs a replica set), which sees the
+  writes of every process.
+
+The state is loaded once and shared by all clients; when the last one disconnects it is dropped
+straight away.
+"""
+from models.rollup import BookingRollup, bucket_start
+from models.changefeed import booking_changes
+from pymongo import ReadPreference
+import datetime as dt
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+LOCAL = 'local'
+CHANGE_STREAM = 'changestream'
+SOURCES = (LOCAL, CHANGE_STREAM)
+# $or clauses per re-read query
+FETCH_CHUNK = 500
+
+
+def _key(doc):
+    return doc['period'], doc['hotel_name'], doc['bucket']
+
+
+def _bucket(doc):
+    return {'period': doc['period'], 'hotel_name': doc['hotel_name'], 'bucket': f"{doc['bucket']:%Y-%m-%d}",
+            'revenue': doc.get('revenue', 0.0), 'count': doc.get('count', 0)}
+
+
+def _message(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def window_start(window_days, window_months, today=None):
+    """{period: first bucket shown} for a window ending today."""
+    today = bucket_start(BookingRollup.DAY, today or dt.datetime.utcnow())
+    months = today.year * 12 + today.month - 1 - (window_months - 1)
+    return {BookingRollup.DAY: today - dt.timedelta(days=window_days - 1),
+            BookingRollup.MONTH: dt.datetime(months // 12, months % 12 + 1, 1)}
+
+
+class LiveDashboard:
+    """The hub: the shared rollup state, the connected clients and the thread that feeds them."""
+
+    def __init__(self, source=LOCAL, interval=1.0, max_queue=100, read_preference=ReadPreference.PRIMARY,
+                 window_days=90, window_months=24):
+        self.configure(source, interval, max_queue, read_preference, window_days, window_months)
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        # clients waiting for a snapshot: new ones and ones whose queue overflowed
+        self._waiting = set()
+        self._pending = set()
+        self._reset = False
+        self._wake = threading.Event()
+        # {(period, hotel_name, bucket): bucket dict} and the window_start() it holds; only touched
+        # by the hub thread
+        self._state = None
+        self._window = None
+        self._pid = None
+        booking_changes.subscribe(self._on_change)
+
+    def configure(self, source=LOCAL, interval=1.0, max_queue=100, read_preference=ReadPreference.PRIMARY,
+                  window_days=90, window_months=24):
+        if source not in SOURCES:
+            raise ValueError(f"LIVE_FEED_SOURCE must be one of {', '.join(SOURCES)}")
+        if window_days < 1 or window_months < 1:
+            raise ValueError("LIVE_WINDOW_DAYS and LIVE_WINDOW_MONTHS must be at least 1")
+        self.source = source
+        self.interval = interval
+        self.max_queue = max_queue
+        self.read_preference = read_preference
+        self.window_days = window_days
+        self.window_months = window_months
+
+    # ---- clients ----
+    def subscribe(self):
+        """A new client's queue of SSE messages; the snapshot arrives first."""
+        self._start()
+        client = queue.Queue(self.max_queue)
+        with self._lock:
+            self._subscribers.add(client)
+            self._waiting.add(client)
+        self._wake.set()
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._subscribers.discard(client)
+            self._waiting.discard(client)
+            idle = not self._subscribers
+        if idle:
+            # the last client left: let the hub drop the state now rather than on the next change
+            self._wake.set()
+
+    def _send(self, clients, message):
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                # a stalled client: drop what it has not read and resend the whole state instead
+                while True:
+                    try:
+                        client.get_nowait()
+                    except queue.Empty:
+                        break
+                with self._lock:
+                    if client in self._subscribers:
+                        self._waiting.add(client)
+                self._wake.set()
+
+    # ---- changes ----
+    def _on_change(self, event):
+        # runs on the writer's thread: only record what changed
+        if self.source != LOCAL or not self._subscribers:
+            return
+        with self._lock:
+            if event['type'] == 'reset':
+                self._reset = True
+            else:
+                self._pending.update(event['keys'])
+        self._wake.set()
+
+    def _collection(self):
+        return BookingRollup._get_collection().with_options(read_preference=self.read_preference)
+
+    def _in_window(self, period, bucket):
+        return period in self._window and bucket >= self._window[period]
+
+    def _load(self):
+        query = {'$or': [{'period': period, 'bucket': {'$gte': start}} for period, start in self._window.items()],
+                 'count': {'$gt': 0}}
+        cursor = self._collection().find(query, {'_id': 0, 'period': 1, 'hotel_name': 1,
+                                                 'bucket': 1, 'revenue': 1, 'count': 1})
+        return {_key(doc): _bucket(doc) for doc in cursor}
+
+    def _window_message(self):
+        return {period: f"{start:%Y-%m-%d}" for period, start in self._window.items()}
+
+    def _fetch(self, keys):
+        """Current documents of the given bucket keys; keys without one come back as zero."""
+        keys = list(keys)
+        docs = {key: {'period': key[0], 'hotel_name': key[1], 'bucket': key[2]} for key in keys}
+        for i in range(0, len(keys), FETCH_CHUNK):
+            clauses = [{'period': p, 'hotel_name': h, 'bucket': b} for p, h, b in keys[i:i + FETCH_CHUNK]]
+            for doc in self._collection().find({'$or': clauses}, {'_id': 0}):
+                docs[_key(doc)] = doc
+        return docs.values()
+
+    def _tick(self, changed_docs=()):
+        """Apply changes and deliver messages; the only place the state is read or written."""
+        with self._lock:
+            clients = set(self._subscribers)
+            waiting, self._waiting = self._waiting, set()
+            keys, self._pending = self._pending, set()
+            reset, self._reset = self._reset, False
+        if not clients:
+            self._state = None
+            return
+        window = window_start(self.window_days, self.window_months)
+        if self._state is None or reset or window != self._window:
+            self._window = window
+            self._state = self._load()
+            waiting = clients
+        else:
+            docs = [doc for doc in changed_docs if self._in_window(doc['period'], doc['bucket'])]
+            keys = [key for key in keys if self._in_window(key[0], key[2])]
+            if keys:
+                docs.extend(self._fetch(keys))
+            changed = []
+            for doc in docs:
+                bucket = _bucket(doc)
+                key = (bucket['period'], bucket['hotel_name'], doc['bucket'])
+                if self._state.get(key) != bucket:
+                    changed.append(bucket)
+                    if bucket['count'] > 0:
+                        self._state[key] = bucket
+                    else:
+                        self._state.pop(key, None)
+            if changed:
+                self._send(clients - waiting, _message('update', {'buckets': changed}))
+        waiting &= clients
+        if waiting:
+            self._send(waiting, _message('snapshot', {'window': self._window_message(),
+                                                      'buckets': list(self._state.values())}))
+
+    # ---- hub thread ----
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # a forked worker starts empty rather than with the parent's clients and state
+            self._subscribers, self._waiting, self._pending, self._state = set(), set(), set(), None
+            threading.Thread(target=self._run, name='live-dashboard', daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                if self.source == CHANGE_STREAM:
+                    self._follow_change_stream()
+                else:
+                    self._follow_local()
+            except Exception:
+                log.exception("live dashboard feed failed, reloading")
+                with self._lock:
+                    self._reset = True
+                self._wake.set()
+                time.sleep(self.interval)
+
+    @staticmethod
+    def _until_midnight():
+        """Seconds until the next UTC midnight, when the window moves on."""
+        now = dt.datetime.utcnow()
+        return (bucket_start(BookingRollup.DAY, now) + dt.timedelta(days=1) - now).total_seconds()
+
+    def _follow_local(self):
+        while True:
+            # changes wake the hub; so does midnight, which moves the window on without any change
+            self._wake.wait(self._until_midnight())
+            self._wake.clear()
+            self._tick()
+            # coalesce: changes arriving meanwhile go out together in the next update
+            time.sleep(self.interval)
+
+    def _follow_change_stream(self):
+        with self._collection().watch(full_document='updateLookup', max_await_time_ms=int(self.interval * 1000)) as stream:
+            while stream.alive:
+                docs = {}
+                deadline = time.monotonic() + self.interval
+                while time.monotonic() < deadline:
+                    change = stream.try_next()
+                    if change is None:
+                        break
+                    if change['operationType'] in ('insert', 'update', 'replace') and change.get('fullDocument'):
+                        docs[_key(change['fullDocument'])] = change['fullDocument']
+                    else:
+                        # rebuild() renames a new collection over this one: the drop and invalidate end the stream
+                        with self._lock:
+                            self._reset = True
+                self._tick(docs.values())
+
+
+live_dashboard = LiveDashboard()
@@ -0,0 +1,240 @@
+"""Request and Mongo instrumentation, exposed in Prometheus text format on /metrics.
+
+A pymongo CommandListener times every command and attributes it to the Flask endpoint being
+served on the same thread (commands issued outside a request, e.g. by CLI commands or background
+imports, are attributed to '-'). Flask request hooks then record per endpoint:
+
+- staycation_http_requests_total{endpoint, method, status}
+- staycation_http_request_duration_seconds{endpoint}: wall time of the request
+- staycation_mongo_commands_per_request{endpoint}: Mongo commands issued while serving it
+- staycation_mongo_time_per_request_seconds{endpoint}: time spent waiting on Mongo
+
+and per command staycation_mongo_commands_total{endpoint, command, outcome},
+staycation_mongo_command_duration_seconds{command} and staycation_mongo_slow_commands_total.
+Commands slower than SLOW_QUERY_MS are logged as warnings with the endpoint that issued them.
+
+The registry is per process; with several workers each one is scraped (or aggregated) separately.
+/metrics answers a scraper sending `Authorization: Bearer <METRICS_TOKEN>`, and the logged-in admin;
+anyone else gets a 403.
+"""
+from flask import request, Response, current_app
+from flask_login import current_user
+from pymongo import monitoring
+from bisect import bisect_left
+import hmac
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+NO_ENDPOINT = '-'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+REQUESTS = Counter('staycation_http_requests_total', "HTTP requests served.", ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = Histogram('staycation_http_request_duration_seconds', "HTTP request latency.", ('endpoint',))
+REQUEST_COMMANDS = Histogram('staycation_mongo_commands_per_request', "Mongo commands issued per HTTP request.",
+                             ('endpoint',), COUNT_BUCKETS)
+REQUEST_MONGO_SECONDS = Histogram('staycation_mongo_time_per_request_seconds', "Time spent in Mongo per HTTP request.",
+                                  ('endpoint',))
+COMMANDS = Counter('staycation_mongo_commands_total', "Mongo commands by endpoint and command name.",
+                   ('endpoint', 'command', 'outcome'))
+COMMAND_SECONDS = Histogram('staycation_mongo_command_duration_seconds', "Mongo command latency.", ('command',))
+SLOW_COMMANDS = Counter('staycation_mongo_slow_commands_total', "Mongo commands slower than SLOW_QUERY_MS.",
+                        ('endpoint', 'command'))
+ALL_METRICS = (REQUESTS, REQUEST_SECONDS, REQUEST_COMMANDS, REQUEST_MONGO_SECONDS, COMMANDS, COMMAND_SECONDS,
+               SLOW_COMMANDS)
+
+
+class _RequestState(threading.local):
+    endpoint = NO_ENDPOINT
+    started = None
+    commands = 0
+    mongo_seconds = 0.0
+
+
+_state = _RequestState()
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Times Mongo commands and charges them to the request being served on this thread."""
+
+    def __init__(self, slow_ms=100):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        # request_id -> (collection, command document) of in-flight commands, for the slow log
+        self._started = {}
+
+    def started(self, event):
+        if self.slow_ms is not None:
+            collection = event.command.get(event.command_name)
+            with self._lock:
+                self._started[event.request_id] = (collection, event.command)
+
+    def _finished(self, event, outcome):
+        seconds = event.duration_micros / 1e6
+        with self._lock:
+            collection, command = self._started.pop(event.request_id, (None, None))
+        endpoint = _state.endpoint
+        _state.commands += 1
+        _state.mongo_seconds += seconds
+        COMMANDS.inc(endpoint, event.command_name, outcome)
+        COMMAND_SECONDS.observe(seconds, event.command_name)
+        if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+            SLOW_COMMANDS.inc(endpoint, event.command_name)
+            log.warning("slow mongo command endpoint=%s command=%s collection=%s duration_ms=%.1f outcome=%s body=%.500s",
+                        endpoint, event.command_name, collection, seconds * 1000, outcome, _redact(command))
+
+    def succeeded(self, event):
+        self._finished(event, 'ok')
+
+    def failed(self, event):
+        self._finished(event, 'error')
+
+
+def _redact(command):
+    """The command with its documents elided: enough to see the filter, sort and pipeline shape."""
+    if not command:
+        return None
+    return {k: ('<%d documents>' % len(v) if k in ('documents', 'updates', 'deletes') else v)
+            for k, v in command.items() if k not in ('lsid', '$clusterTime', '$db')}
+
+
+command_metrics = CommandMetrics()
+_registered = False
+
+
+def _before_request():
+    _state.endpoint = request.endpoint or 'unmatched'
+    _state.started = time.perf_counter()
+    _state.commands = 0
+    _state.mongo_seconds = 0.0
+
+
+def _after_request(response):
+    _record(response.status_code)
+    return response
+
+
+def _teardown_request(error):
+    # after_request does not run when a view raises; record those requests as 500s
+    if _state.started is not None:
+        _record(500)
+    _state.endpoint = NO_ENDPOINT
+
+
+def _record(status):
+    elapsed = time.perf_counter() - _state.started
+    endpoint = _state.endpoint
+    REQUESTS.inc(endpoint, request.method, str(status))
+    REQUEST_SECONDS.observe(elapsed, endpoint)
+    REQUEST_COMMANDS.observe(_state.commands, endpoint)
+    REQUEST_MONGO_SECONDS.observe(_state.mongo_seconds, endpoint)
+    _state.started = None
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def _authorized():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {token}".encode()):
+        return True
+    return current_user.is_authenticated and current_user.isAdmin()
+
+
+def metrics_view():
+    if not _authorized():
+        return Response("Forbidden\n", status=403, mimetype='text/plain')
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Install the command listener, the request hooks and the /metrics route.
+
+    Must run before the app's MongoClient is created: pymongo only reports commands to listeners
+    registered before the client was constructed.
+    """
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    command_metrics.slow_ms = app.config.get('SLOW_QUERY_MS')
+    global _registered
+    if not _registered:
+        # listeners are process-wide; registering again for a second app would count twice
+        monitoring.register(command_metrics)
+        _registered = True
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
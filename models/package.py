@@ -1,24 +1,363 @@
 from app import db
+from collections import OrderedDict
+import re
+import threading
+import time
+
+
+class CatalogVersion(db.Document):
+    """Version stamp bumped on every catalog write.
+
+    Each process compares it with the version its PackageCatalogCache was filled at, so a write
+    in one worker invalidates the caches of all the others.
+    """
+    meta = {'collection': 'catalogVersion'}
+    name = db.StringField(primary_key=True)
+    version = db.IntField(default=0)
+
+    @staticmethod
+    def current(name):
+        doc = CatalogVersion.objects(name=name).as_pymongo().first()
+        return doc['version'] if doc else 0
+
+    @staticmethod
+    def bump(name):
+        CatalogVersion.objects(name=name).update_one(inc__version=1, upsert=True)
+
+
+class PackageCatalogCache:
+    """Per-process LRU cache of Package documents, keyed by hotel_name and by id.
+
+    - Bounded to max_size entries; the least recently used entry is evicted first
+    - The shared CatalogVersion is re-read at most every check_interval seconds; if it moved,
+      the whole cache is dropped
+    - hits, misses, evictions and invalidations are counted for stats()
+    - Mongo is never queried while holding the lock: the lock only guards reading and inserting
+      entries, and a fetch that started before the cache was cleared does not insert what it read
+    """
+
+    VERSION_NAME = 'staycation'
+
+    def __init__(self, max_size=256, check_interval=1.0):
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._all = None
+        self._version = None
+        self._checked_at = 0.0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _clear(self):
+        self._entries.clear()
+        self._all = None
+        self._generation += 1
+
+    def _check_version(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            # claimed before the query, so concurrent lookups keep using the entries meanwhile
+            self._checked_at = now
+        version = CatalogVersion.current(self.VERSION_NAME)
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    self.invalidations += 1
+                self._clear()
+                self._version = version
+
+    def _fill(self, packages, generation):
+        """Insert fetched packages, unless the cache was cleared since the fetch started."""
+        if generation != self._generation:
+            return False
+        for package in packages:
+            self._put(package)
+        return True
+
+    def _put(self, package):
+        for key in (('name', package.hotel_name), ('id', str(package.id))):
+            self._entries[key] = package
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _get(self, key):
+        package = self._entries.get(key)
+        if package is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return package
+
+    def get_by_name(self, hotel_name):
+        return self.get_many([hotel_name]).get(hotel_name)
+
+    def get_many(self, hotel_names):
+        """{hotel_name: Package} for the names that exist; misses are fetched with one $in query."""
+        self._check_version()
+        with self._lock:
+            found, missing = {}, []
+            for name in set(hotel_names):
+                package = self._get(('name', name))
+                if package is None:
+                    missing.append(name)
+                else:
+                    found[name] = package
+            generation = self._generation
+        if missing:
+            packages = list(Package.objects(hotel_name__in=missing))
+            with self._lock:
+                self._fill(packages, generation)
+            found.update((package.hotel_name, package) for package in packages)
+        return found
+
+    def get_by_id(self, package_id):
+        return self.get_many_by_id([package_id]).get(package_id)
+
+    def get_many_by_id(self, package_ids):
+        """{id: Package} for the ids that exist; misses are fetched with one $in query."""
+        self._check_version()
+        with self._lock:
+            found, missing = {}, []
+            for package_id in set(package_ids):
+                package = self._get(('id', str(package_id)))
+                if package is None:
+                    missing.append(package_id)
+                else:
+                    found[package_id] = package
+            generation = self._generation
+        if missing:
+            packages = list(Package.objects(pk__in=missing))
+            with self._lock:
+                self._fill(packages, generation)
+            by_str = {str(package_id): package_id for package_id in missing}
+            found.update((by_str[str(package.id)], package) for package in packages)
+        return found
+
+    def get_all(self):
+        """The whole catalog as a list; kept only while it fits in the cache bound."""
+        self._check_version()
+        with self._lock:
+            if self._all is not None:
+                self.hits += 1
+                return self._all
+            self.misses += 1
+            generation = self._generation
+        packages = list(Package.objects())
+        if len(packages) * 2 <= self.max_size:
+            with self._lock:
+                if self._fill(packages, generation):
+                    self._all = packages
+        return packages
+
+    def invalidate(self):
+        """Drop this process's entries and bump the shared version so other processes follow."""
+        CatalogVersion.bump(self.VERSION_NAME)
+        with self._lock:
+            self.invalidations += 1
+            self._clear()
+            self._version = None
+            self._checked_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_size': self.max_size,
+                'version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+catalog_cache = PackageCatalogCache()
+
 
 class Package(db.Document):
-    meta = {'collection': 'staycation'}
+    meta = {
+        'collection': 'staycation',
+        'indexes': [
+            # hotel_name is how every route and CSV row looks a package up
+            {'fields': ['hotel_name'], 'unique': True},
+            # typeahead: anchored prefix scans on the lowercased name, covered by the index
+            ('search_name', 'hotel_name'),
+            # full-text search; a match in the name outranks one in the description
+            {'fields': ['$hotel_name', '$description'], 'default_language': 'english',
+             'weights': {'hotel_name': 10, 'description': 2}},
+            # search filters without a query: nights, then a price range
+            ('duration', 'unit_cost'),
+        ],
+    }
     hotel_name = db.StringField(max_length=30)
     duration = db.IntField()
     unit_cost = db.FloatField()
     image_url = db.StringField(max_length=30)
     description = db.StringField(max_length=500)
-    
+    # hotel_name lowercased, for case-insensitive prefix matching (a regex can use an index only
+    # when it is case-sensitive)
+    search_name = db.StringField()
+
+    SUGGEST_LIMIT = 10
+    MAX_PAGE_SIZE = 50
+
     def packageCost(self):
         return self.unit_cost * self.duration
-    
+
+    def clean(self):
+        self.search_name = self.hotel_name.lower() if self.hotel_name else None
+
+    def save(self, *args, **kwargs):
+        package = super().save(*args, **kwargs)
+        catalog_cache.invalidate()
+        return package
+
+    def delete(self, *args, **kwargs):
+        super().delete(*args, **kwargs)
+        catalog_cache.invalidate()
+
     @staticmethod
     def getPackage(hotel_name):
-        return Package.objects(hotel_name=hotel_name).first()
-        
+        return catalog_cache.get_by_name(hotel_name)
+
+    @staticmethod
+    def getPackageById(package_id):
+        return catalog_cache.get_by_id(package_id)
+
+    @staticmethod
+    def getPackagesByIds(package_ids):
+        """{id: Package} for every id that exists, resolved in at most one query."""
+        return catalog_cache.get_many_by_id(package_ids)
+
+    @staticmethod
+    def getPackages(hotel_names):
+        """{hotel_name: Package} for every name that exists, resolved in at most one query."""
+        return catalog_cache.get_many(hotel_names)
+
     @staticmethod
     def getAllPackages():
-        return Package.objects()
-        
+        return catalog_cache.get_all()
+
     @staticmethod
     def createPackage(hotel_name, duration, unit_cost, image_url, description):
-        return Package(hotel_name=hotel_name, duration=duration, unit_cost=unit_cost, image_url=image_url, description=description).save()
\ No newline at end of file
+        return Package(hotel_name=hotel_name, duration=duration, unit_cost=unit_cost, image_url=image_url, description=description).save()
+
+    @staticmethod
+    def updatePackage(hotel_name, **fields):
+        """Update fields of the named package. Returns the saved package, or None if not found."""
+        package = Package.objects(hotel_name=hotel_name).first()
+        if not package:
+            return None
+        for field, value in fields.items():
+            setattr(package, field, value)
+        return package.save()
+
+    @staticmethod
+    def _prefixFilter(prefix):
+        return {'$regex': '^' + re.escape(prefix.lower())}
+
+    @staticmethod
+    def search(text=None, prefix=None, min_duration=None, max_duration=None, min_cost=None, max_cost=None,
+               page=1, page_size=20):
+        """One page of packages matching a full-text query and/or a name prefix, within the given ranges.
+
+        With text the results are ranked by text score, otherwise ordered by name. Returns
+        (packages, has_next); page is 1-based and page_size capped at MAX_PAGE_SIZE.
+        """
+        page_size = max(1, min(page_size, Package.MAX_PAGE_SIZE))
+        query = {}
+        if prefix:
+            query['search_name'] = Package._prefixFilter(prefix)
+        for field, low, high in (('duration', min_duration, max_duration), ('unit_cost', min_cost, max_cost)):
+            bounds = {op: value for op, value in (('$gte', low), ('$lte', high)) if value is not None}
+            if bounds:
+                query[field] = bounds
+        packages = Package.objects(__raw__=query)
+        if text:
+            packages = packages.search_text(text).order_by('$text_score')
+        else:
+            packages = packages.order_by('search_name', 'hotel_name')
+        offset = (max(page, 1) - 1) * page_size
+        # one extra document tells whether there is a next page without a count
+        found = list(packages.skip(offset).limit(page_size + 1))
+        return found[:page_size], len(found) > page_size
+
+    @staticmethod
+    def suggest(prefix, limit=SUGGEST_LIMIT):
+        """Up to `limit` hotel names starting with prefix (any case), in name order.
+
+        Answered from the (search_name, hotel_name) index alone, without reading any document.
+        """
+        if not prefix:
+            return []
+        cursor = Package._get_collection().find(
+            {'search_name': Package._prefixFilter(prefix)}, {'_id': 0, 'hotel_name': 1},
+        ).sort([('search_name', 1), ('hotel_name', 1)]).limit(limit)
+        return [doc['hotel_name'] for doc in cursor]
+
+    @staticmethod
+    def backfillSearchNames():
+        """Set search_name on packages created before it existed. Returns the count."""
+        result = Package._get_collection().update_many(
+            {'search_name': None}, [{'$set': {'search_name': {'$toLower': '$hotel_name'}}}])
+        if result.modified_count:
+            catalog_cache.invalidate()
+        return result.modified_count
+
+    @staticmethod
+    def findDuplicateNames():
+        """{hotel_name: [package ids, oldest first]} of the names held by more than one package.
+
+        Reads the collection through pymongo, so it runs even when the unique hotel_name index
+        cannot be built because of those duplicates.
+        """
+        collection = Package._get_db()[Package._get_collection_name()]
+        pipeline = [
+            {'$sort': {'_id': 1}},
+            {'$group': {'_id': '$hotel_name', 'ids': {'$push': '$_id'}}},
+            {'$match': {'ids.1': {'$exists': True}}},
+            {'$sort': {'_id': 1}},
+        ]
+        return {row['_id']: row['ids'] for row in collection.aggregate(pipeline, allowDiskUse=True)}
+
+    @staticmethod
+    def mergeDuplicateNames():
+        """Keep the oldest package of each duplicated hotel_name and delete the others, after
+        pointing their bookings and bundle items at the one kept. Returns {hotel_name: removed}.
+
+        Rollups are keyed by hotel_name, so they stay valid; bookings are stamped with modified_at
+        for the snapshot. Bookings keep the total_cost and check_out_date they were made with; run
+        recompute-totals afterwards if the duplicates differed in duration or unit_cost.
+        """
+        from models.book import Booking
+        from models.bundle import BundlePurchase
+
+        removed = {}
+        for hotel_name, (keep, *duplicates) in Package.findDuplicateNames().items():
+            Booking._get_collection().update_many(
+                {'package': {'$in': duplicates}},
+                {'$set': {'package': keep}, '$currentDate': {'modified_at': True}})
+            BundlePurchase._get_collection().update_many(
+                {'bundledPackages.package': {'$in': duplicates}},
+                {'$set': {'bundledPackages.$[item].package': keep}},
+                array_filters=[{'item.package': {'$in': duplicates}}])
+            Package._get_db()[Package._get_collection_name()].delete_many({'_id': {'$in': duplicates}})
+            removed[hotel_name] = len(duplicates)
+        if removed:
+            catalog_cache.invalidate()
+        return removed
+
+    @staticmethod
+    def cacheStats():
+        return catalog_cache.stats()
@@ -0,0 +1,81 @@
+"""Keyset (cursor) pagination over a (sort field, _id) pair.
+
+Instead of skipping N documents, each page filters on the position of the last item shown, so
+with an index on (..., field, _id) page 100 costs the same as page 1. Cursors are opaque strings
+safe to put in a query string.
+"""
+from mongoengine.queryset.visitor import Q
+from bson import ObjectId
+from bson.errors import InvalidId
+import datetime as dt
+
+DEFAULT_PAGE_SIZE = 20
+
+
+class Page:
+    """One page of results.
+
+    - items: the documents on this page, in ascending (field, _id) order
+    - next_cursor: pass as `after` to get the following page, or None on the last page
+    - prev_cursor: pass as `before` to get the preceding page, or None on the first page
+    """
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(value, pk):
+    """Cursor for a (datetime, ObjectId) position: '<microseconds since epoch>_<hex id>'."""
+    micros = (value - dt.datetime(1970, 1, 1)) // dt.timedelta(microseconds=1)
+    return f"{micros}_{pk}"
+
+
+def decode_cursor(cursor):
+    """(datetime, ObjectId) for a cursor, or None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        micros, pk = cursor.split('_', 1)
+        return dt.datetime(1970, 1, 1) + dt.timedelta(microseconds=int(micros)), ObjectId(pk)
+    except (ValueError, InvalidId, OverflowError):
+        return None
+
+
+def keyset_page(queryset, field, after=None, before=None, page_size=DEFAULT_PAGE_SIZE):
+    """Fetch one page of queryset ordered by (field, _id), starting after or ending before a cursor.
+
+    Reads page_size + 1 documents to learn whether there is another page, without a count.
+    """
+    after, before = decode_cursor(after), decode_cursor(before)
+    backwards = before is not None and after is None
+    position = before if backwards else after
+    if position:
+        value, pk = position
+        op = 'lt' if backwards else 'gt'
+        queryset = queryset.filter(Q(**{f"{field}__{op}": value}) | (Q(**{field: value}) & Q(**{f"id__{op}": pk})))
+    if backwards:
+        queryset = queryset.order_by(f"-{field}", '-id')
+    else:
+        queryset = queryset.order_by(field, 'id')
+
+    items = list(queryset.limit(page_size + 1))
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    if backwards:
+        items.reverse()
+    if not items:
+        return Page(items)
+
+    first = encode_cursor(getattr(items[0], field), items[0].pk)
+    last = encode_cursor(getattr(items[-1], field), items[-1].pk)
+    if backwards:
+        return Page(items, next_cursor=last, prev_cursor=first if has_more else None)
+    return Page(items, next_cursor=last if has_more else None, prev_cursor=first if position else None)
@@ -0,0 +1,66 @@
+"""Batch resolution of ReferenceFields for a result set.
+
+Touching a ReferenceField on a freshly loaded document costs one query per document. prefetch()
+walks a list of documents, collects every referenced id per target collection, loads them with
+one `$in` query per collection and plants the loaded documents back on the holders, so later
+attribute access (including from templates) does not hit Mongo again.
+
+Paths may go through lists of embedded documents, e.g. 'bundledPackages.package'.
+References whose target no longer exists are resolved to None.
+"""
+from mongoengine.fields import ReferenceField
+from bson import DBRef
+
+
+def _holders(document, path):
+    """Yield (holder, field_name) for the last component of a dotted path."""
+    head, _, rest = path.partition('.')
+    if not rest:
+        yield document, head
+        return
+    value = document._data.get(head)
+    for item in (value if isinstance(value, list) else [value]):
+        if item is not None:
+            yield from _holders(item, rest)
+
+
+def _reference_id(value):
+    if isinstance(value, DBRef):
+        return value.id
+    return None
+
+
+def prefetch(documents, *paths, known=()):
+    """Resolve the ReferenceFields at `paths` on every document in one query per collection.
+
+    `known` documents (e.g. current_user) are used as-is instead of being fetched again.
+    Returns `documents` as a list.
+    """
+    from models.package import Package
+
+    documents = list(documents)
+    # document class -> {id: [(holder, field_name), ...]}
+    wanted = {}
+    for document in documents:
+        for path in paths:
+            for holder, name in _holders(document, path):
+                field = holder._fields.get(name)
+                if not isinstance(field, ReferenceField):
+                    raise ValueError(f"{path} is not a ReferenceField on {type(document).__name__}")
+                ref_id = _reference_id(holder._data.get(name))
+                if ref_id is not None:
+                    wanted.setdefault(field.document_type, {}).setdefault(ref_id, []).append((holder, name))
+
+    known_by_id = {(type(doc), doc.pk): doc for doc in known if doc is not None}
+    for model, by_id in wanted.items():
+        loaded = {pk: doc for (cls, pk), doc in known_by_id.items() if cls is model and pk in by_id}
+        missing = [pk for pk in by_id if pk not in loaded]
+        if missing:
+            if model is Package:
+                loaded.update(Package.getPackagesByIds(missing))
+            else:
+                loaded.update(model.objects.in_bulk(missing))
+        for pk, holders in by_id.items():
+            for holder, name in holders:
+                holder._data[name] = loaded.get(pk)
+    return documents
@@ -0,0 +1,70 @@
+"""Bundle pricing shared by the bundle purchase view and the /bundleQuote JSON endpoint.
+
+Hotel names are resolved through the package catalog cache in one lookup per call (one `$in`
+query for any misses), even when many candidate bundles are priced at once. Discount tiers are
+loaded once at startup from BUNDLE_DISCOUNT_TIERS and expanded into a per-count lookup table.
+"""
+from models.package import Package
+
+# (minimum number of packages, discount rate): 1 package no discount, 2-3 get 10%, 4+ get 20%
+DEFAULT_TIERS = ((1, 0.0), (2, 0.10), (4, 0.20))
+
+
+class Quote:
+    """Price of one candidate bundle.
+
+    - packages: the resolved Package documents, in the order they were asked for
+    - missing: requested hotel names that do not exist
+    - list_price: sum of unit_cost * duration
+    - discount_rate: tier discount for the number of packages
+    - total: list_price after the discount
+    """
+
+    def __init__(self, packages, missing, list_price, discount_rate):
+        self.packages = packages
+        self.missing = missing
+        self.list_price = list_price
+        self.discount_rate = discount_rate
+        self.total = list_price * (1 - discount_rate)
+
+    def to_dict(self):
+        return {
+            'hotel_names': [p.hotel_name for p in self.packages],
+            'missing': self.missing,
+            'list_price': round(self.list_price, 2),
+            'discount_rate': self.discount_rate,
+            'total': round(self.total, 2),
+        }
+
+
+class PricingEngine:
+    def __init__(self, tiers=DEFAULT_TIERS):
+        tiers = sorted(tiers)
+        if not tiers:
+            raise ValueError("at least one discount tier is required")
+        # _rates[n] is the discount for a bundle of n packages; counts past the end use the last tier
+        top = tiers[-1][0]
+        self._rates = [0.0] * (top + 1)
+        for count in range(top + 1):
+            for min_count, rate in tiers:
+                if count >= min_count:
+                    self._rates[count] = rate
+
+    def discount_rate(self, count):
+        return self._rates[min(count, len(self._rates) - 1)]
+
+    def _quote(self, hotel_names, known):
+        packages = [known[h] for h in hotel_names if h in known]
+        missing = [h for h in hotel_names if h not in known]
+        list_price = sum(p.packageCost() for p in packages)
+        return Quote(packages, missing, list_price, self.discount_rate(len(packages)))
+
+    def quote(self, hotel_names):
+        """Quote one bundle given its hotel names."""
+        return self.quote_many([hotel_names])[0]
+
+    def quote_many(self, bundles):
+        """Quote several candidate bundles (lists of hotel names) with a single package lookup."""
+        bundles = [list(names) for names in bundles]
+        known = Package.getPackages({h for names in bundles for h in names})
+        return [self._quote(names, known) for names in bundles]
@@ -0,0 +1,178 @@
+"""Opt-in profiling of single requests.
+
+With PROFILER_ENABLED set, an admin request carrying an `X-Profile: 1` header or a `_profile=1`
+query parameter is run under cProfile while a sampler thread records its call stack every
+PROFILE_SAMPLE_INTERVAL seconds. Two files are written to PROFILE_DIR per capture:
+
+- <name>.pstats: deterministic profile, open with `python -m pstats` or snakeviz
+- <name>.collapsed: sampled stacks in collapsed format ("frame;frame;frame count" per line),
+  for flamegraph.pl or speedscope
+
+Only the newest PROFILE_KEEP captures are kept. With PROFILER_ENABLED unset no hook is installed,
+so ordinary requests pay nothing; when it is set, requests without the flag pay one header lookup.
+Captures are serialised: a flagged request that arrives while another is being profiled runs
+unprofiled.
+"""
+from flask import current_app, request, g
+from flask_login import current_user
+from collections import Counter
+import cProfile
+import datetime as dt
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+HEADER = 'X-Profile'
+QUERY_FLAG = '_profile'
+CAPTURE_HEADER = 'X-Profile-Capture'
+SUFFIXES = ('.pstats', '.collapsed')
+
+_capture_lock = threading.Lock()
+
+
+class _StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class Capture:
+    """One profiled request."""
+
+    def __init__(self, interval):
+        self.started = time.perf_counter()
+        self.profile = cProfile.Profile()
+        self.sampler = _StackSampler(threading.get_ident(), interval)
+
+    def start(self):
+        self.sampler.start()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.sampler.stop()
+        return time.perf_counter() - self.started
+
+    def save(self, directory, endpoint, elapsed):
+        os.makedirs(directory, exist_ok=True)
+        stamp = dt.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        name = f"{stamp}_{re.sub(r'[^A-Za-z0-9]+', '-', endpoint)}_{elapsed * 1000:.0f}ms"
+        self.profile.dump_stats(os.path.join(directory, name + '.pstats'))
+        with open(os.path.join(directory, name + '.collapsed'), 'w') as f:
+            for stack, count in self.sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return name
+
+
+def _requested():
+    return request.headers.get(HEADER) == '1' or request.args.get(QUERY_FLAG) == '1'
+
+
+def _before_request():
+    if not _requested():
+        return
+    if not (current_user.is_authenticated and current_user.isAdmin()):
+        return
+    if not _capture_lock.acquire(blocking=False):
+        log.info("profile skipped, another capture is running endpoint=%s", request.endpoint)
+        return
+    capture = Capture(_config('PROFILE_SAMPLE_INTERVAL'))
+    try:
+        capture.start()
+    except ValueError:
+        # another profiler (e.g. a debugger) already owns this thread
+        _capture_lock.release()
+        log.warning("profile skipped, a profiler is already active endpoint=%s", request.endpoint)
+        return
+    g.profile_capture = capture
+
+
+def _finish(response=None):
+    capture = g.pop('profile_capture', None)
+    if capture is None:
+        return None
+    try:
+        elapsed = capture.stop()
+        name = capture.save(_config('PROFILE_DIR'), request.endpoint or 'unmatched', elapsed)
+        prune(_config('PROFILE_DIR'), _config('PROFILE_KEEP'))
+    finally:
+        _capture_lock.release()
+    log.info("profile captured endpoint=%s name=%s duration_ms=%.1f", request.endpoint, name, elapsed * 1000)
+    if response is not None:
+        response.headers[CAPTURE_HEADER] = name
+    return name
+
+
+def _after_request(response):
+    _finish(response)
+    return response
+
+
+def _teardown_request(error):
+    # after_request is skipped when the view raised; still stop the profiler and keep the capture
+    _finish()
+
+
+def _config(key):
+    return current_app.config[key]
+
+
+def list_captures(directory):
+    """[{'name', 'created', 'files': {suffix: size}}] newest first."""
+    if not os.path.isdir(directory):
+        return []
+    captures = {}
+    for filename in os.listdir(directory):
+        base, suffix = os.path.splitext(filename)
+        if suffix not in SUFFIXES:
+            continue
+        path = os.path.join(directory, filename)
+        entry = captures.setdefault(base, {'name': base, 'created': os.path.getmtime(path), 'files': {}})
+        entry['files'][suffix] = os.path.getsize(path)
+    for entry in captures.values():
+        entry['created'] = dt.datetime.fromtimestamp(entry['created'])
+    return sorted(captures.values(), key=lambda c: c['name'], reverse=True)
+
+
+def prune(directory, keep):
+    """Delete all but the newest `keep` captures."""
+    for entry in list_captures(directory)[keep:]:
+        for suffix in entry['files']:
+            try:
+                os.remove(os.path.join(directory, entry['name'] + suffix))
+            except OSError:
+                pass
+
+
+def init_app(app):
+    """Install the capture hooks when PROFILER_ENABLED is set; otherwise do nothing."""
+    if not app.config.get('PROFILER_ENABLED'):
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,55 @@
+"""Record the Mongo commands a block of code sends, as the server receives them.
+
+A pymongo CommandListener, registered before the app's MongoClient is created (pymongo only
+reports to listeners registered by then), appends the command document of every command started
+on the calling thread while a capture() block is active there; outside one it does nothing.
+
+    with querycapture.capture() as commands:
+        Booking.hasConflict(customer, package, check_in, check_out)
+    # commands == [SON([('find', 'booking'), ('filter', {...}), ('projection', ...), ...])]
+
+models/indexaudit.py uses it to explain the exact queries the model helpers issue.
+"""
+from pymongo import monitoring
+from contextlib import contextmanager
+import threading
+
+
+class _Capture(threading.local):
+    commands = None
+
+
+_capture = _Capture()
+
+
+class CommandCapture(monitoring.CommandListener):
+    def started(self, event):
+        if _capture.commands is not None:
+            _capture.commands.append((event.database_name, event.command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+@contextmanager
+def capture():
+    """Yield a list that collects (database name, command document) of each command sent on this thread."""
+    previous, _capture.commands = _capture.commands, []
+    try:
+        yield _capture.commands
+    finally:
+        _capture.commands = previous
+
+
+_registered = False
+
+
+def init_app(app):
+    """Register the listener; must run before the app's MongoClient is created."""
+    global _registered
+    if not _registered:
+        monitoring.register(CommandCapture())
+        _registered = True
@@ -0,0 +1,194 @@
+from app import db, analytics_read_preference
+from models.package import Package
+from models.changefeed import booking_changes
+from pymongo import UpdateOne
+import datetime as dt
+
+
+def _as_datetime(value):
+    """Booking dates arrive as datetimes from Mongo or 'YYYY-MM-DD' strings from forms."""
+    return db.DateTimeField().to_mongo(value)
+
+
+class BookingRollup(db.Document):
+    """Pre-aggregated booking revenue and count per hotel and period bucket.
+
+    Fields
+    - period: 'day' or 'month'
+    - hotel_name: hotel of the booked package
+    - bucket: first instant of the day or month
+    - revenue: sum of total_cost of the bookings in the bucket
+    - count: number of bookings in the bucket
+
+    Kept up to date with $inc by the Booking write paths; rebuild() regenerates it from scratch.
+    Every change is published on changefeed.booking_changes.
+    """
+
+    DAY = 'day'
+    MONTH = 'month'
+    PERIODS = (DAY, MONTH)
+    # chart buckets; weeks and quarters are grouped from the day and month rollups at query time
+    WEEK = 'week'
+    QUARTER = 'quarter'
+    GRANULARITIES = (DAY, WEEK, MONTH, QUARTER)
+
+    meta = {
+        'collection': 'bookingRollup',
+        'indexes': [{'fields': ['period', 'hotel_name', 'bucket'], 'unique': True}],
+    }
+
+    period = db.StringField(required=True, choices=PERIODS)
+    hotel_name = db.StringField(required=True)
+    bucket = db.DateTimeField(required=True)
+    revenue = db.FloatField(default=0.0)
+    count = db.IntField(default=0)
+
+    @staticmethod
+    def record(hotel_name, check_in_date, total_cost, count=1):
+        """Add a booking to its buckets (count=1) or take it back out (count=-1)."""
+        BookingRollup.recordMany([(hotel_name, check_in_date, total_cost, count)])
+
+    @staticmethod
+    def recordMany(entries):
+        """Apply (hotel_name, check_in_date, total_cost, count) deltas in one bulk_write.
+
+        Revenue moves by total_cost * count, so count=-1 removes a booking. Deltas are collapsed
+        per bucket first, so a large import costs one upsert per touched bucket.
+        """
+        deltas = {}
+        for hotel_name, check_in_date, total_cost, count in entries:
+            for period in BookingRollup.PERIODS:
+                key = (period, hotel_name, bucket_start(period, check_in_date))
+                revenue, n = deltas.get(key, (0.0, 0))
+                deltas[key] = (revenue + (total_cost or 0.0) * count, n + count)
+        if not deltas:
+            return
+        ops = [UpdateOne({'period': period, 'hotel_name': hotel_name, 'bucket': bucket},
+                         {'$inc': {'revenue': revenue, 'count': n}}, upsert=True)
+               for (period, hotel_name, bucket), (revenue, n) in deltas.items()]
+        BookingRollup._get_collection().bulk_write(ops, ordered=False)
+        booking_changes.publish({'type': 'buckets', 'keys': list(deltas)})
+
+    @staticmethod
+    def rebuild():
+        """Regenerate every rollup document from the booking collection. Returns the number written.
+
+        The documents go into a side collection that then replaces bookingRollup in a single
+        renameCollection, so readers never see the rollups half built and $inc upserts arriving
+        meanwhile land in the old collection instead of colliding with, or adding to, rebuilt
+        buckets. A booking written while the aggregation runs can still be missed; run it when
+        writes are quiet.
+        """
+        from models.book import Booking
+
+        collection = BookingRollup._get_collection()
+        target = collection.database[collection.name + '_rebuild']
+        target.drop()
+        target.create_index([('period', 1), ('hotel_name', 1), ('bucket', 1)], unique=True)
+        written = 0
+        for period in BookingRollup.PERIODS:
+            bucket = {'year': {'$year': '$check_in_date'}, 'month': {'$month': '$check_in_date'}}
+            if period == BookingRollup.DAY:
+                bucket['day'] = {'$dayOfMonth': '$check_in_date'}
+            pipeline = [
+                {'$lookup': {'from': Package._get_collection_name(), 'localField': 'package',
+                             'foreignField': '_id', 'as': 'package'}},
+                {'$unwind': '$package'},
+                {'$group': {'_id': {'hotel_name': '$package.hotel_name', 'bucket': {'$dateFromParts': bucket}},
+                            'revenue': {'$sum': '$total_cost'}, 'count': {'$sum': 1}}},
+                {'$project': {'_id': 0, 'period': {'$literal': period}, 'hotel_name': '$_id.hotel_name',
+                              'bucket': '$_id.bucket', 'revenue': 1, 'count': 1}},
+            ]
+            docs = list(Booking.objects.aggregate(pipeline))
+            if docs:
+                target.insert_many(docs, ordered=False)
+                written += len(docs)
+        target.rename(collection.name, dropTarget=True)
+        booking_changes.publish({'type': 'reset'})
+        return written
+
+    @staticmethod
+    def getSeries(period, date_from=None, date_to=None):
+        """Non-empty buckets for a period starting in [date_from, date_to), as raw dicts ordered by hotel_name then bucket."""
+        query = {'period': period, 'count__gt': 0}
+        if date_from:
+            query['bucket__gte'] = date_from
+        if date_to:
+            query['bucket__lt'] = date_to
+        return BookingRollup.objects(**query).order_by('hotel_name', 'bucket') \
+            .only('hotel_name', 'bucket', 'revenue', 'count').read_preference(analytics_read_preference()).as_pymongo()
+
+    @staticmethod
+    def getBuckets(granularity=DAY, date_from=None, date_to=None):
+        """Revenue and count per hotel and `granularity` bucket, ordered by hotel_name then bucket.
+
+        Weeks (starting Monday) are grouped from the daily rollup and quarters from the monthly one,
+        in the aggregation. date_from and date_to (inclusive) are widened to whole buckets, so the
+        first and last buckets are never partial.
+        Returns raw dicts with hotel_name, bucket, revenue and count.
+        """
+        date_from = bucket_start(granularity, date_from) if date_from else None
+        date_to = bucket_end(granularity, date_to) if date_to else None
+        source = BookingRollup.DAY if granularity in (BookingRollup.DAY, BookingRollup.WEEK) else BookingRollup.MONTH
+        if granularity == source:
+            return list(BookingRollup.getSeries(source, date_from, date_to))
+
+        match = {'period': source, 'count': {'$gt': 0}}
+        if date_from or date_to:
+            match['bucket'] = {}
+            if date_from:
+                match['bucket']['$gte'] = date_from
+            if date_to:
+                match['bucket']['$lt'] = date_to
+        if granularity == BookingRollup.WEEK:
+            bucket = {'$dateFromParts': {'isoWeekYear': {'$isoWeekYear': '$bucket'},
+                                         'isoWeek': {'$isoWeek': '$bucket'}, 'isoDayOfWeek': 1}}
+        else:
+            quarter = {'$floor': {'$divide': [{'$subtract': [{'$month': '$bucket'}, 1]}, 3]}}
+            bucket = {'$dateFromParts': {'year': {'$year': '$bucket'},
+                                         'month': {'$add': [{'$multiply': [quarter, 3]}, 1]}}}
+        pipeline = [
+            {'$match': match},
+            {'$group': {'_id': {'hotel_name': '$hotel_name', 'bucket': bucket},
+                        'revenue': {'$sum': '$revenue'}, 'count': {'$sum': '$count'}}},
+            {'$project': {'_id': 0, 'hotel_name': '$_id.hotel_name', 'bucket': '$_id.bucket',
+                          'revenue': 1, 'count': 1}},
+            {'$sort': {'hotel_name': 1, 'bucket': 1}},
+        ]
+        return list(BookingRollup.objects.read_preference(analytics_read_preference()).aggregate(pipeline))
+
+
+def bucket_start(granularity, value):
+    """First instant of the day, week (Monday), month or quarter containing value."""
+    value = _as_datetime(value)
+    day = dt.datetime(value.year, value.month, value.day)
+    if granularity == BookingRollup.WEEK:
+        return day - dt.timedelta(days=day.weekday())
+    if granularity == BookingRollup.MONTH:
+        return day.replace(day=1)
+    if granularity == BookingRollup.QUARTER:
+        return dt.datetime(value.year, (value.month - 1) // 3 * 3 + 1, 1)
+    return day
+
+
+def bucket_end(granularity, value):
+    """First instant after the bucket containing value."""
+    start = bucket_start(granularity, value)
+    if granularity == BookingRollup.DAY:
+        return start + dt.timedelta(days=1)
+    if granularity == BookingRollup.WEEK:
+        return start + dt.timedelta(days=7)
+    months = 3 if granularity == BookingRollup.QUARTER else 1
+    month = start.month - 1 + months
+    return dt.datetime(start.year + month // 12, month % 12 + 1, 1)
+
+
+def bucket_label(granularity, bucket):
+    """Display label of a bucket: '17 Jan 2022', 'Week of 17 Jan 2022', 'January 2022' or 'Q1 2022'."""
+    if granularity == BookingRollup.WEEK:
+        return bucket.strftime("Week of %d %b %Y")
+    if granularity == BookingRollup.MONTH:
+        return bucket.strftime("%B %Y")
+    if granularity == BookingRollup.QUARTER:
+        return f"Q{(bucket.month - 1) // 3 + 1} {bucket.year}"
+    return bucket.strftime("%d %b %Y")
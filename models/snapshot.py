@@ -0,0 +1,262 @@
+"""Columnar in-memory snapshot of the bookings, for analytics without Document instances.
+
+Each booking is one entry in four numpy columns: its _id (12 bytes, kept sorted), hotel code
+(uint32 index into the package ids seen), check-in day as a date ordinal (int32) and total_cost
+(float64), i.e. 28 bytes per booking instead of a mongoengine Booking of a few KB.
+
+- The first refresh() loads every booking through one projection-only cursor sorted on _id,
+  straight into the columns without building Documents
+- Later refreshes read only the bookings whose modified_at is at or after the previous refresh
+  (less MARKER_OVERLAP, for writers with a slightly slow clock), updating their rows by _id and
+  inserting new ones. Deletes bump Booking.DELETES_VERSION, which makes the next refresh reload
+  everything; bookings written before modified_at existed also appear only on a reload
+- Published columns are read-only: a refresh builds new ones without holding the snapshot lock
+  and swaps them in under it, so queries keep running on the previous columns meanwhile
+- Group-bys, bucketing and histograms are vectorised over the columns (masks, bincount, unique)
+  and run outside the lock
+- Date ranges compare day ordinals; buckets are computed on them with datetime64 arithmetic
+
+There is one snapshot per process, refreshed at most every `refresh_interval` seconds.
+"""
+from app import analytics_read_preference
+from models.book import Booking
+from models.package import Package, CatalogVersion
+from models.rollup import BookingRollup, bucket_start, bucket_end
+from array import array
+import datetime as dt
+import numpy as np
+import os
+import threading
+import time
+
+ID_DTYPE = 'S12'
+MARKER_OVERLAP = dt.timedelta(seconds=5)
+BATCH_SIZE = 10000
+PROJECTION = {'package': 1, 'check_in_date': 1, 'total_cost': 1}
+# date ordinal of 1970-01-01, the datetime64 epoch
+EPOCH_ORDINAL = dt.date(1970, 1, 1).toordinal()
+
+
+def _frozen(values, dtype):
+    values = np.asarray(values, dtype=dtype)
+    values.flags.writeable = False
+    return values
+
+
+class _Columns:
+    """One published version of the snapshot. Never modified once published."""
+
+    def __init__(self, ids, hotel, day, cost, packages, marker, version):
+        self.ids = _frozen(ids, ID_DTYPE)
+        self.hotel = _frozen(hotel, np.uint32)
+        self.day = _frozen(day, np.int32)
+        self.cost = _frozen(cost, np.float64)
+        # hotel code -> package id
+        self.packages = tuple(packages)
+        self.marker = marker
+        self.version = version
+
+    def select(self, date_from=None, date_to=None):
+        """(hotel, day, cost) of the bookings checking in within [date_from, date_to)."""
+        if date_from is None and date_to is None:
+            return self.hotel, self.day, self.cost
+        mask = np.ones(len(self.day), dtype=bool)
+        if date_from:
+            mask &= self.day >= date_from.toordinal()
+        if date_to:
+            mask &= self.day < date_to.toordinal()
+        return self.hotel[mask], self.day[mask], self.cost[mask]
+
+
+EMPTY = _Columns([], [], [], [], [], None, None)
+
+
+class _Codes:
+    """Hotel codes of package ids, growing from those of the columns being replaced."""
+
+    def __init__(self, packages):
+        self.packages = list(packages)
+        self.codes = {p: i for i, p in enumerate(self.packages)}
+
+    def __call__(self, package_id):
+        code = self.codes.get(package_id)
+        if code is None:
+            code = self.codes[package_id] = len(self.packages)
+            self.packages.append(package_id)
+        return code
+
+
+def _bucket_days(granularity, days):
+    """Date ordinal of the first day of the day, week (Monday), month or quarter of each of days."""
+    if granularity == BookingRollup.WEEK:
+        # ordinal 1 (0001-01-01) is a Monday
+        return days - (days - 1) % 7
+    if granularity not in (BookingRollup.MONTH, BookingRollup.QUARTER):
+        return days
+    months = (days - EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    if granularity == BookingRollup.QUARTER:
+        # months count from January 1970, so quarters start at multiples of 3
+        months -= months % 3
+    return months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + EPOCH_ORDINAL
+
+
+class BookingSnapshot:
+    """The booking columns of this process, with the aggregations that run over them."""
+
+    def __init__(self, refresh_interval=5.0):
+        self.refresh_interval = refresh_interval
+        # guards the swap of self._columns; refreshes are serialised by _refresh_lock
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._pid = None
+        self._columns = EMPTY
+        self._refreshed_at = None
+        # full loads, and rows re-read by incremental refreshes
+        self.loads = 0
+        self.updates = 0
+
+    def _find(self, query, sort):
+        collection = Booking._get_collection().with_options(read_preference=analytics_read_preference())
+        return collection.find(query, PROJECTION, batch_size=BATCH_SIZE).sort(sort, 1)
+
+    # ---- refresh ----
+    def _load(self):
+        started = dt.datetime.utcnow()
+        version = CatalogVersion.current(Booking.DELETES_VERSION)
+        code = _Codes([])
+        ids, hotel, day, cost = bytearray(), array('I'), array('i'), array('d')
+        for doc in self._find({}, '_id'):
+            ids += doc['_id'].binary
+            hotel.append(code(doc.get('package')))
+            day.append(doc['check_in_date'].toordinal())
+            cost.append(doc.get('total_cost') or 0.0)
+        self.loads += 1
+        return _Columns(np.frombuffer(ids, dtype=ID_DTYPE), hotel, day, cost, code.packages, started, version)
+
+    def _catch_up(self, columns):
+        started = dt.datetime.utcnow()
+        code = _Codes(columns.packages)
+        changed = {}
+        for doc in self._find({'modified_at': {'$gte': columns.marker - MARKER_OVERLAP}}, 'modified_at'):
+            changed[doc['_id'].binary] = (code(doc.get('package')), doc['check_in_date'].toordinal(),
+                                          doc.get('total_cost') or 0.0)
+        self.updates += len(changed)
+        if not changed:
+            return _Columns(columns.ids, columns.hotel, columns.day, columns.cost, code.packages, started,
+                            columns.version)
+
+        order = sorted(changed)
+        keys = np.array(order, dtype=ID_DTYPE)
+        hotel, day, cost = (np.array(values) for values in zip(*(changed[k] for k in order)))
+        at = np.searchsorted(columns.ids, keys)
+        found = at < len(columns.ids)
+        found[found] = columns.ids[at[found]] == keys[found]
+
+        columns_hotel, columns_day, columns_cost = columns.hotel.copy(), columns.day.copy(), columns.cost.copy()
+        columns_hotel[at[found]] = hotel[found]
+        columns_day[at[found]] = day[found]
+        columns_cost[at[found]] = cost[found]
+        # keys are sorted, so new ones landing at the same position go in in order; new bookings
+        # have the highest ids, so this is nearly always an append
+        new, at = ~found, at[~found]
+        return _Columns(np.insert(columns.ids, at, keys[new]), np.insert(columns_hotel, at, hotel[new]),
+                        np.insert(columns_day, at, day[new]), np.insert(columns_cost, at, cost[new]),
+                        code.packages, started, columns.version)
+
+    def refresh(self, force=False):
+        """Bring the snapshot up to date, unless it was refreshed within refresh_interval. Returns self.
+
+        While another thread refreshes, callers return straight away and read the previous columns,
+        unless nothing is loaded yet or force is set.
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # a forked worker loads its own copy
+                    self._refresh_lock = threading.Lock()
+                    self._columns, self._refreshed_at = EMPTY, None
+                    self._pid = os.getpid()
+        if not self._refresh_lock.acquire(blocking=force or self._refreshed_at is None):
+            return self
+        try:
+            now = time.monotonic()
+            if not force and self._refreshed_at is not None and now - self._refreshed_at < self.refresh_interval:
+                return self
+            columns = self._columns
+            if columns.marker is None or CatalogVersion.current(Booking.DELETES_VERSION) != columns.version:
+                columns = self._load()
+            else:
+                columns = self._catch_up(columns)
+            with self._lock:
+                self._columns = columns
+            self._refreshed_at = now
+        finally:
+            self._refresh_lock.release()
+        return self
+
+    def columns(self):
+        """The current columns, refreshed first if due."""
+        self.refresh()
+        with self._lock:
+            return self._columns
+
+    # ---- analytics ----
+    @staticmethod
+    def _hotel_names(columns):
+        packages = Package.getPackagesByIds([p for p in columns.packages if p is not None])
+        return [packages[p].hotel_name if p in packages else None for p in columns.packages]
+
+    def byHotel(self, date_from=None, date_to=None):
+        """{hotel_name: {'count', 'revenue'}} of bookings checking in within [date_from, date_to)."""
+        columns = self.columns()
+        hotel, _, cost = columns.select(date_from, date_to)
+        counts = np.bincount(hotel, minlength=len(columns.packages))
+        revenue = np.bincount(hotel, weights=cost, minlength=len(columns.packages))
+        names = self._hotel_names(columns)
+        return {names[h]: {'count': int(counts[h]), 'revenue': float(revenue[h])}
+                for h in np.flatnonzero(counts) if names[h] is not None}
+
+    def buckets(self, granularity=BookingRollup.DAY, date_from=None, date_to=None):
+        """Revenue and count per hotel and bucket, in the form of BookingRollup.getBuckets().
+
+        date_from and date_to (inclusive) are widened to whole buckets the same way.
+        """
+        date_from = bucket_start(granularity, date_from) if date_from else None
+        date_to = bucket_end(granularity, date_to) if date_to else None
+        columns = self.columns()
+        hotel, day, cost = columns.select(date_from, date_to)
+        # one int64 key per (hotel, bucket): day ordinals stay below 2 ** 22
+        keys, group = np.unique((hotel.astype(np.int64) << 32) | _bucket_days(granularity, day.astype(np.int64)),
+                                return_inverse=True)
+        counts = np.bincount(group, minlength=len(keys))
+        revenue = np.bincount(group, weights=cost, minlength=len(keys))
+        names = self._hotel_names(columns)
+        rows = [{'hotel_name': names[key >> 32], 'bucket': dt.datetime.fromordinal(key & 0xFFFFFFFF),
+                 'revenue': r, 'count': n}
+                for key, r, n in zip(keys.tolist(), revenue.tolist(), counts.tolist()) if names[key >> 32] is not None]
+        rows.sort(key=lambda r: (r['hotel_name'], r['bucket']))
+        return rows
+
+    def histogram(self, bins=10, date_from=None, date_to=None):
+        """(edges, counts) of total_cost over `bins` equal-width bins between the lowest and highest cost."""
+        _, _, costs = self.columns().select(date_from, date_to)
+        if not len(costs):
+            return [], []
+        low, high = float(costs.min()), float(costs.max())
+        # equal costs get unit-wide bins rather than zero-width ones
+        width = (high - low) / bins or 1.0
+        edges = low + np.arange(bins + 1) * width
+        counts = np.bincount(np.minimum(np.searchsorted(edges, costs, side='right') - 1, bins - 1), minlength=bins)
+        return edges.tolist(), counts.tolist()
+
+    def stats(self):
+        """Rows held, bytes used by the columns and the refresh counters."""
+        with self._lock:
+            columns = self._columns
+        rows = len(columns.day)
+        size = sum(a.nbytes for a in (columns.ids, columns.hotel, columns.day, columns.cost))
+        return {'rows': rows, 'bytes': size, 'bytes_per_row': size / rows if rows else 0,
+                'hotels': len(columns.packages), 'loads': self.loads, 'updates': self.updates}
+
+
+booking_snapshot = BookingSnapshot()
@@ -1,15 +1,83 @@
 from app import db
 from flask_login import UserMixin
+from collections import OrderedDict
+import threading
+import time
+
+# the admin account (matches the admin menu in base.html)
+ADMIN_EMAIL = 'admin@abc.com'
+
+
+class UserCache:
+    """Short-lived per-process cache for the Flask-Login user loader.
+
+    Entries expire ttl seconds after they were loaded and the cache holds at most max_size users,
+    evicting the least recently used. User.save() drops the saved user's entry; other processes
+    see the change once their entry expires.
+    """
+
+    def __init__(self, max_size=1024, ttl=30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, max_size, ttl):
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get(self, user_id):
+        key = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        user = User.objects(pk=user_id).first()
+        if user:
+            with self._lock:
+                self._entries[key] = (now + self.ttl, user)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+
+user_cache = UserCache()
 
 
 class User(UserMixin, db.Document):
     
-    meta = {'collection': 'appUsers'}
+    meta = {
+        'collection': 'appUsers',
+        # getUser runs on every login and every CSV row
+        'indexes': [{'fields': ['email'], 'unique': True}],
+    }
     email = db.StringField(max_length=30)
     password = db.StringField()
     name = db.StringField()
     avatar = db.StringField()
     
+    def save(self, *args, **kwargs):
+        user = super().save(*args, **kwargs)
+        user_cache.invalidate(user.id)
+        return user
+
+    def isAdmin(self):
+        # by email, which is unique, rather than by the free-text name
+        return self.email == ADMIN_EMAIL
+
     @staticmethod
     def getUser(email):
         return User.objects(email=email).first()
@@ -17,6 +85,11 @@ class User(UserMixin, db.Document):
     @staticmethod
     def getUserById(user_id):
         return User.objects(pk=user_id).first()
+
+    @staticmethod
+    def getCachedUserById(user_id):
+        """getUserById through the per-process user_cache."""
+        return user_cache.get(user_id)
     
     @staticmethod 
     def createUser(email, name, password):
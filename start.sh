@@ -1,3 +1,3 @@
-export FLASK_APP=app.py; export PYTHONPATH=.; export FLASK_DEBUG=1;
+export FLASK_APP=wsgi.py; export PYTHONPATH=.; export FLASK_DEBUG=1;
 flask run --host=0.0.0.0 --port=5050
 ``
\ No newline at end of file
@@ -0,0 +1,5 @@
+# Entry point for `flask run` (see start.sh) and WSGI servers, e.g. `gunicorn app.wsgi:app`.
+# Importing the app package alone builds nothing; the app and its Mongo client are created here.
+from app import create_app
+
+app = create_app()